@@ -0,0 +1,391 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from tqdm import tqdm
+
+# loinc_service_implementation logs into loinc_log/ as soon as it is imported.
+if not os.path.exists("loinc_log"):
+    os.mkdir("loinc_log")
+
+from config import *
+from core.impl.classes.cache import LaboratoryLoincCodeCache, LaboratoryLoincLookup
+from core.impl.classes.reference_data import ReferenceDataRegistry
+from core.impl.laboratory_loinc_code_service import LaboratoryLoincCodeService
+from loinc_service_implementation import LoincServiceImplementation
+from ner_json import loads_ner_output, loads_top_level_keys
+from ner_preprocessing import get_loinc_output, preprocess_ner_output
+
+# Reference data loaded by the parent, inherited by the workers when they are forked.
+_parent_reference_data_registry: ReferenceDataRegistry = None
+
+# State of a worker process, set by _init_worker.
+_worker_connection = None
+_worker_service: LoincServiceImplementation = None
+_worker_ner_version = 2
+
+
+def connect():
+    import mysql.connector as Cn
+
+    return Cn.connect(host=HOST, user=USER, database=DATABASE, passwd=PASSWORD)
+
+
+def load_reference_data_registry(connection) -> ReferenceDataRegistry:
+    reference_data_registry = ReferenceDataRegistry(
+        load_loinc_snapshot=LOINC_SNAPSHOT_ENABLED,
+        bilateral_cui_set_path=BILATERAL_CUI_SET_PATH,
+        component_alias_path=COMPONENT_ALIAS_PATH,
+    )
+    reference_data_registry.refresh(connection)
+    return reference_data_registry
+
+
+def iter_inputs(input_path: str) -> Iterator[Tuple[str, str, str]]:
+    """
+    Streams the documents of a directory of NER JSON files or of a JSONL file.
+
+    :param input_path: Directory or JSONL file.
+    :returns: (document id, kind, payload) where kind is "file" (payload is the file path)
+        or "line" (payload is the JSONL line).
+    """
+
+    if os.path.isdir(input_path):
+        for file_name in sorted(os.listdir(input_path)):
+            if file_name.endswith(".json"):
+                yield file_name, "file", os.path.join(input_path, file_name)
+        return
+
+    with open(input_path, encoding="utf8") as f:
+        for line_num, line in enumerate(f, start=1):
+            if line.strip() == "":
+                continue
+            yield get_line_id(line, line_num), "line", line
+
+
+def get_line_id(line: str, line_num: int) -> str:
+    """
+    Gets the id of a JSONL document, its "id" (or "request_id") key, else its line number.
+    """
+
+    try:
+        # The NER output of the line is skipped, it is parsed by the worker.
+        document = loads_top_level_keys(line, ("id", "request_id"))
+    except ValueError:
+        return f"line:{line_num}"
+    for key in ("id", "request_id"):
+        if document.get(key) is not None:
+            return str(document[key])
+    return f"line:{line_num}"
+
+
+def read_checkpoint(output_path: str) -> Set[str]:
+    """
+    Reads the ids already COMPLETED in the output, the output is its own checkpoint.
+
+    :param output_path: Output JSONL file.
+    :returns: Ids of the completed documents.
+    """
+
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, encoding="utf8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Line cut by an interrupted run, the document is processed again.
+                continue
+            if record.get("status") == "COMPLETED":
+                completed.add(record["id"])
+            else:
+                completed.discard(record["id"])
+
+    return completed
+
+
+def _init_worker(ner_version: int, primed_cache_entries: Dict = None):
+    global _worker_connection, _worker_service, _worker_ner_version
+
+    _worker_connection = connect()
+    reference_data_registry = _parent_reference_data_registry
+    if reference_data_registry is None:
+        reference_data_registry = load_reference_data_registry(_worker_connection)
+
+    primed_cache_entries = primed_cache_entries or {}
+    laboratory_loinc_code_cache = LaboratoryLoincCodeCache(
+        max_cache_limit=max(LAB_CACHE_MAX_ENTRIES, len(primed_cache_entries))
+    )
+    for cache_dto, loinc_code_beans in primed_cache_entries.items():
+        laboratory_loinc_code_cache.put(cache_dto, loinc_code_beans)
+
+    _worker_service = LoincServiceImplementation(
+        connection=_worker_connection,
+        reference_data_registry=reference_data_registry,
+        laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+    )
+    _worker_ner_version = ner_version
+
+
+def _load_document(kind: str, payload: str) -> Dict:
+    if kind == "file":
+        with open(payload, "rb") as f:
+            text_dict = loads_ner_output(f.read())
+    else:
+        text_dict = loads_ner_output(payload)
+
+    if not isinstance(text_dict, dict) or "result" not in text_dict:
+        raise ValueError("No NER 'result' in the document")
+
+    return {"result": text_dict["result"]}
+
+
+def _process_document(item: Tuple[str, str, str]) -> Dict:
+    doc_id, kind, payload = item
+    start = time.time()
+    try:
+        codes = get_loinc_output(
+            _load_document(kind, payload), _worker_service, _worker_ner_version
+        )
+        return {
+            "id": doc_id,
+            "status": "COMPLETED",
+            "codes": codes,
+            "timeTaken": time.time() - start,
+        }
+    except Exception as err:
+        logging.exception(f"==> Document {doc_id} failed : {err}")
+        return {
+            "id": doc_id,
+            "status": "FAILED",
+            "error": str(err),
+            "timeTaken": time.time() - start,
+        }
+
+
+def _collect_document_lookups(item: Tuple[str, str, str]) -> List[List[LaboratoryLoincLookup]]:
+    doc_id, kind, payload = item
+    try:
+        text_dict = preprocess_ner_output(
+            _load_document(kind, payload), _worker_ner_version
+        )
+        return _worker_service.collect_laboratory_lookups(text_dict["result"])
+    except Exception as err:
+        # The document fails again, and is reported, in the second pass.
+        logging.exception(f"==> Lookups of document {doc_id} failed : {err}")
+        return []
+
+
+@contextmanager
+def map_documents(func, items, workers: int, chunksize: int, initargs: tuple):
+    """
+    Maps func over the documents, over a process pool when workers > 1.
+
+    :returns: Iterator of the results, in completion order.
+    """
+
+    if workers > 1:
+        pool = multiprocessing.Pool(
+            processes=workers, initializer=_init_worker, initargs=initargs
+        )
+        try:
+            yield pool.imap_unordered(func, items, chunksize=chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_worker(*initargs)
+        try:
+            yield map(func, items)
+        finally:
+            _worker_connection.close()
+
+
+def resolve_corpus_lookups(
+    items: Iterable[Tuple[str, str, str]],
+    workers: int,
+    ner_version: int,
+    chunksize: int,
+) -> Tuple[Dict, Dict]:
+    """
+    First pass of the corpus mode. Collects the laboratory lookups of every document
+    and resolves each distinct signature once.
+
+    :returns: Resolved code beans of every signature, and the pass summary.
+    """
+
+    start = time.time()
+    lookup_chains = dict()
+    entities = 0
+    with map_documents(
+        _collect_document_lookups, items, workers, chunksize, (ner_version,)
+    ) as results:
+        for document_lookups in tqdm(results, desc="Signatures", unit="doc"):
+            for lookups in document_lookups:
+                entities += 1
+                lookup_chains.setdefault(tuple(it.cache_dto for it in lookups), lookups)
+
+    connection = connect()
+    try:
+        reference_data_registry = _parent_reference_data_registry
+        if reference_data_registry is None:
+            reference_data_registry = load_reference_data_registry(connection)
+        laboratory_loinc_code_service = LaboratoryLoincCodeService(
+            connection=connection,
+            reference_data=reference_data_registry.current,
+            laboratory_loinc_code_cache=LaboratoryLoincCodeCache(max_cache_limit=0),
+        )
+        resolved = laboratory_loinc_code_service.resolve_lookups(lookup_chains.values())
+    finally:
+        connection.close()
+
+    return resolved, {
+        "laboratoryEntities": entities,
+        "distinctEntities": len(lookup_chains),
+        "distinctSignatures": len(resolved),
+        "signatureTime": time.time() - start,
+    }
+
+
+def run(
+    input_path: str,
+    output_path: str,
+    workers: int,
+    ner_version: int,
+    resume: bool,
+    chunksize: int,
+    two_pass: bool = False,
+) -> Dict:
+    """
+    Codes every document of the input and appends one JSON line per document to the output.
+
+    :param input_path: Directory of NER JSON files or JSONL file of NER outputs.
+    :param output_path: Output JSONL file.
+    :param workers: Number of worker processes.
+    :param ner_version: 1 if the entities are already remapped to the LOINC entity types.
+    :param resume: Skips the documents already COMPLETED in the output.
+    :param chunksize: Number of documents sent to a worker at once.
+    :param two_pass: Resolves the distinct laboratory signatures of the whole input first.
+    :returns: Throughput summary.
+    """
+
+    global _parent_reference_data_registry
+
+    completed = read_checkpoint(output_path) if resume else set()
+    if len(completed) != 0:
+        logging.info(f"==> Resuming, {len(completed)} documents already completed")
+
+    skipped = 0
+
+    def pending_inputs(count_skipped: bool):
+        nonlocal skipped
+        for item in iter_inputs(input_path):
+            if item[0] in completed:
+                skipped += count_skipped
+                continue
+            yield item
+
+    if workers > 1 and multiprocessing.get_start_method() == "fork":
+        # Loaded once before forking, the workers share the pages of the snapshot and indexes.
+        connection = connect()
+        _parent_reference_data_registry = load_reference_data_registry(connection)
+        connection.close()
+
+    summary = {"completed": 0, "failed": 0, "skipped": 0, "documentTime": 0.0}
+
+    primed_cache_entries = None
+    if two_pass:
+        primed_cache_entries, signature_summary = resolve_corpus_lookups(
+            pending_inputs(False), workers, ner_version, chunksize
+        )
+        summary.update(signature_summary)
+        logging.info(f"==> Corpus signatures : {signature_summary}")
+
+    # An interrupted run may have left a cut line, the next record starts on a new line.
+    needs_newline = False
+    if resume and os.path.exists(output_path) and os.path.getsize(output_path) != 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    start = time.time()
+
+    with open(output_path, "a" if resume else "w", encoding="utf8") as out:
+        if needs_newline:
+            out.write("\n")
+
+        with map_documents(
+            _process_document,
+            pending_inputs(True),
+            workers,
+            chunksize,
+            (ner_version, primed_cache_entries),
+        ) as results:
+            for record in tqdm(results, desc="LOINC", unit="doc"):
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                summary["completed" if record["status"] == "COMPLETED" else "failed"] += 1
+                summary["documentTime"] += record["timeTaken"]
+
+    elapsed = time.time() - start
+    processed = summary["completed"] + summary["failed"]
+    summary["skipped"] = skipped
+    summary["elapsed"] = elapsed
+    summary["docsPerSec"] = processed / elapsed if elapsed > 0 else 0.0
+    summary["avgDocumentTime"] = summary["documentTime"] / processed if processed else 0.0
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Codes a directory of NER JSON files, or a JSONL of NER outputs, into a JSONL of LOINC codes."
+    )
+    parser.add_argument("--input", required=True, help="Directory of NER JSON files or JSONL file.")
+    parser.add_argument("--output", required=True, help="Output JSONL file, also used as the checkpoint.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunksize", type=int, default=8)
+    parser.add_argument(
+        "--remap",
+        action="store_true",
+        help="Remaps the entity types with resources/Guideline_Mapping.csv (NER-2.0 types).",
+    )
+    parser.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="Resolves every distinct laboratory signature of the input once before coding the documents.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skips the documents already COMPLETED in the output and appends to it.",
+    )
+    args = parser.parse_args()
+
+    summary = run(
+        input_path=args.input,
+        output_path=args.output,
+        workers=max(1, args.workers),
+        ner_version=2 if args.remap else 1,
+        resume=args.resume,
+        chunksize=max(1, args.chunksize),
+        two_pass=args.two_pass,
+    )
+    logging.info(f"==> Bulk LOINC summary : {summary}")
+    if args.two_pass:
+        print(
+            f"Laboratory entities : {summary['laboratoryEntities']}, distinct signatures : "
+            f"{summary['distinctSignatures']}, resolved in {summary['signatureTime']:.1f} secs"
+        )
+    print(
+        f"Completed : {summary['completed']}, Failed : {summary['failed']}, "
+        f"Skipped : {summary['skipped']}, in {summary['elapsed']:.1f} secs "
+        f"({summary['docsPerSec']:.2f} docs/sec, {summary['avgDocumentTime']:.3f} secs/doc)"
+    )
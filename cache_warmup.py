@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+from bulk_loinc import iter_inputs
+from core.impl.classes.connection_pool import ConnectionPoolTimeout
+from loinc_service_implementation import LoincServiceImplementation
+from ner_json import loads_ner_output
+from ner_preprocessing import get_loinc_output, get_ner_result_from_body
+
+
+class CacheWarmup:
+    """
+    Replays a corpus of recorded NER outputs through the LOINC service at startup,
+    so the laboratory cache and the persistent cache are populated before the
+    service reports ready.
+
+    The corpus is a directory of NER JSON files or a JSONL file, like the input of
+    bulk_loinc.py. Every document is the NER output ({"result": {...}}), its
+    "result" object, or a recorded /loinc_output_from_ner body with "skipRemap".
+    The replay stops after `max_secs` seconds or `max_documents` documents. The
+    time budget is soft, it is checked between documents, so a document already
+    started finishes. A connection is checked out per document, not for the whole
+    replay.
+    """
+
+    def __init__(
+        self,
+        connection_pool,
+        reference_data_registry,
+        laboratory_loinc_code_cache,
+        corpus_path: str,
+        max_secs: float = 60,
+        max_documents: int = 1000,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.reference_data_registry = reference_data_registry
+        self.laboratory_loinc_code_cache = laboratory_loinc_code_cache
+        self.corpus_path = corpus_path
+        self.max_secs = max_secs
+        self.max_documents = max_documents
+
+        self._lock = threading.Lock()
+        self._thread: threading.Thread = None
+        self._done = threading.Event()
+        self._stats: Dict = {"status": "PENDING", "corpusPath": corpus_path}
+
+    @property
+    def is_done(self) -> bool:
+        return self._done.is_set()
+
+    def start(self):
+        """
+        Runs the replay in a background thread.
+
+        :returns: None.
+        """
+
+        self._thread = threading.Thread(target=self.run, name="cache-warmup", daemon=True)
+        self._thread.start()
+
+    def run(self) -> Dict:
+        """
+        Replays the corpus within the budget.
+
+        :returns: Summary of the replay.
+        """
+
+        start = time.time()
+        self._update(status="RUNNING", startedAt=start)
+        cache_before = self._get_cache_stats()
+        logging.info(
+            f"==> Warming up the caches from {self.corpus_path}, budget {self.max_secs} secs / {self.max_documents} documents"
+        )
+
+        deadline = start + self.max_secs
+        documents = 0
+        failed = 0
+        stopped_by = "corpus"
+        try:
+            for doc_id, kind, payload in iter_inputs(self.corpus_path):
+                if documents >= self.max_documents:
+                    stopped_by = "documents"
+                    break
+                if time.time() >= deadline:
+                    stopped_by = "time"
+                    break
+
+                try:
+                    text_dict, ner_version = self._load_document(kind, payload)
+                except Exception as err:
+                    documents += 1
+                    failed += 1
+                    logging.warning(f"==> Warm-up document {doc_id} failed : {err}")
+                    self._update(documents=documents, failed=failed)
+                    continue
+
+                # One connection per document, the requests served meanwhile are not
+                # left one connection short for the whole replay.
+                try:
+                    connection = self.connection_pool.checkout(
+                        timeout=max(0, deadline - time.time())
+                    )
+                except ConnectionPoolTimeout:
+                    stopped_by = "time"
+                    break
+
+                documents += 1
+                try:
+                    service = LoincServiceImplementation(
+                        connection=connection,
+                        reference_data_registry=self.reference_data_registry,
+                        laboratory_loinc_code_cache=self.laboratory_loinc_code_cache,
+                    )
+                    get_loinc_output(text_dict, service, ner_version)
+                except Exception as err:
+                    failed += 1
+                    logging.warning(f"==> Warm-up document {doc_id} failed : {err}")
+                finally:
+                    self.connection_pool.release(connection)
+
+                self._update(documents=documents, failed=failed)
+
+            status = "COMPLETED"
+            error = None
+        except Exception as err:
+            logging.exception(f"==> Cache warm-up failed : {err}")
+            status = "FAILED"
+            error = str(err)
+
+        cache_after = self._get_cache_stats()
+        self._update(
+            status=status,
+            error=error,
+            stoppedBy=stopped_by if status == "COMPLETED" else None,
+            documents=documents,
+            failed=failed,
+            timeTaken=time.time() - start,
+            laboratoryEntriesAdded=(
+                cache_after["laboratory"]["size"] - cache_before["laboratory"]["size"]
+            ),
+            persistentEntriesWritten=(
+                cache_after["persistent"]["writes"] - cache_before["persistent"]["writes"]
+                if "persistent" in cache_after
+                else None
+            ),
+            cache=cache_after,
+        )
+        self._done.set()
+
+        summary = self.stats()
+        logging.info(f"==> Cache warm-up finished : {summary}")
+        return summary
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _update(self, **values):
+        with self._lock:
+            self._stats.update(values)
+
+    def _get_cache_stats(self) -> Dict:
+        cache_stats = {"laboratory": self.laboratory_loinc_code_cache.stats()}
+        persistent_cache = self.laboratory_loinc_code_cache.persistent_cache
+        if persistent_cache is not None:
+            cache_stats["persistent"] = persistent_cache.stats()
+        return cache_stats
+
+    @staticmethod
+    def _load_document(kind: str, payload: str) -> Tuple[Dict, int]:
+        if kind == "file":
+            with open(payload, "rb") as f:
+                body = loads_ner_output(f.read())
+        else:
+            body = loads_ner_output(payload)
+
+        return get_ner_result_from_body(body)
@@ -9,11 +9,68 @@ USER = os.getenv("LOINC_DB_USER")
 DATABASE = os.getenv("LOINC_DB_NAME")
 PASSWORD = os.getenv("LOINC_DB_PASSWD")
 
+# Connection pool, one connection per waitress thread by default.
+LOINC_THREADS = int(os.getenv("LOINC_THREADS", "4"))
+LOINC_DB_POOL_SIZE = int(os.getenv("LOINC_DB_POOL_SIZE", str(LOINC_THREADS)))
+LOINC_DB_POOL_TIMEOUT = float(os.getenv("LOINC_DB_POOL_TIMEOUT", "30"))
+
 LOINC_TABLE_NAME = os.getenv("LOINC_TABLE_NAME") # This gets assigned to the variables in "core\impl\classes\my_sql.py" also.
 UMLS_TABLE_NAME = os.getenv("UMLS_TABLE_NAME")
 
+# Loads the ACTIVE loinc rows in memory at startup, so laboratory codes are resolved without MySQL.
+LOINC_SNAPSHOT_ENABLED = os.getenv("LOINC_SNAPSHOT_ENABLED", "false").lower() == "true"
+
+# Maximum number of laboratory lookups kept in the cache shared by the requests, an entry
+# count, not a memory size (an entry keeps the best ranked code bean of a lookup).
+LAB_CACHE_MAX_ENTRIES = int(os.getenv("LAB_CACHE_MAX_ENTRIES", "50000"))
+
+# Bilateral CUI set built offline with "python -m core.impl.classes.bilateral_cui_set".
+BILATERAL_CUI_SET_PATH = os.getenv(
+    "BILATERAL_CUI_SET_PATH", os.path.join("resources", "bilateral_cui_set.npy")
+)
+
+# Component aliases (e.g. "bld glucose" -> "Glucose"), reloaded with the reference data.
+COMPONENT_ALIAS_PATH = os.getenv(
+    "COMPONENT_ALIAS_PATH", os.path.join("resources", "component_alias.csv")
+)
+
+# Optional SQLite file keeping the laboratory and radiology resolutions across restarts.
+RESOLUTION_CACHE_PATH = os.getenv("RESOLUTION_CACHE_PATH")
+# Release tag of the persisted resolutions, a checksum of the LOINC tables when not set.
+RESOLUTION_CACHE_RELEASE = os.getenv("RESOLUTION_CACHE_RELEASE")
+
+# Optional corpus of recorded NER outputs (directory or JSONL) replayed at startup to warm
+# the caches, within a time and document budget. The service is not ready until it is done.
+WARMUP_CORPUS_PATH = os.getenv("WARMUP_CORPUS_PATH")
+WARMUP_MAX_SECS = float(os.getenv("WARMUP_MAX_SECS", "60"))
+WARMUP_MAX_DOCUMENTS = int(os.getenv("WARMUP_MAX_DOCUMENTS", "1000"))
+
+# Readiness checks (/health/ready), seconds allowed to query MySQL and to reach a NER
+# replica, and seconds a result is reused between probes.
+READINESS_DB_TIMEOUT = float(os.getenv("READINESS_DB_TIMEOUT", "2"))
+READINESS_NER_TIMEOUT = float(os.getenv("READINESS_NER_TIMEOUT", "2"))
+READINESS_CACHE_SECS = float(os.getenv("READINESS_CACHE_SECS", "5"))
+
 # Loinc Configuration
 LOINC_HOST = "0.0.0.0"
 LOINC_PORT = 3001
 NER_ENDPOINT_URL = os.getenv("NER_ENDPOINT_URL")
+# NER_ENDPOINT_URL may list several replicas separated by commas.
+NER_ENDPOINT_URLS = [
+    url.strip() for url in (NER_ENDPOINT_URL or "").split(",") if url.strip() != ""
+]
+NER_CONNECT_TIMEOUT = float(os.getenv("NER_CONNECT_TIMEOUT", "5"))
+NER_READ_TIMEOUT = float(os.getenv("NER_READ_TIMEOUT", "120"))
+NER_MAX_RETRIES = int(os.getenv("NER_MAX_RETRIES", "2"))
+NER_RETRY_BACKOFF = float(os.getenv("NER_RETRY_BACKOFF", "0.5"))
+# Sends a second request to the next replica when the first one is slower than the p95.
+NER_HEDGING_ENABLED = os.getenv("NER_HEDGING_ENABLED", "false").lower() == "true"
+
+# Batch endpoint, maximum number of documents per call and number of concurrent NER calls.
+LOINC_BATCH_MAX_DOCUMENTS = int(os.getenv("LOINC_BATCH_MAX_DOCUMENTS", "1000"))
+NER_BATCH_CONCURRENCY = int(os.getenv("NER_BATCH_CONCURRENCY", str(LOINC_THREADS)))
+# Maximum number of NER calls of one batch running or queued at once, so concurrent batches share the NER workers.
+NER_BATCH_MAX_IN_FLIGHT = max(
+    1, int(os.getenv("NER_BATCH_MAX_IN_FLIGHT", str(max(1, NER_BATCH_CONCURRENCY // 2))))
+)
 # NER_ENDPOINT_URL = "https://hnlphcntemp.shaip.com/predict_hcc_str"
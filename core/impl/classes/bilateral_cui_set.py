@@ -0,0 +1,106 @@
+import argparse
+import logging
+import os
+import time
+from typing import Iterable
+
+import numpy as np
+
+from .my_sql import QueryMaster
+
+BILATERAL_KEYWORDS = ("bilateral", "bilaterally", "both", "b/l")
+
+
+def is_bilateral_text(text: str) -> bool:
+    text = text.lower()
+    return any(keyword in text for keyword in BILATERAL_KEYWORDS)
+
+
+class BilateralCuiSet:
+    """
+    Set of the CUIs having at least one bilateral UMLS text ("bilateral", "both",
+    "b/l"). Built offline from the UMLS table and stored as a sorted uint32 array,
+    so the radiology filter does not query UMLS at request time.
+    """
+
+    def __init__(self, cuis: Iterable[int] = ()) -> None:
+        self.cuis = frozenset(int(cui) for cui in cuis)
+
+    def __contains__(self, cui: int) -> bool:
+        return cui in self.cuis
+
+    def __len__(self) -> int:
+        return len(self.cuis)
+
+    @classmethod
+    def load(cls, path: str) -> "BilateralCuiSet":
+        """
+        Loads a set saved by `save`.
+
+        :param path: Path of the .npy file.
+        :returns: The bilateral CUI set.
+        """
+
+        start = time.time()
+        cui_set = cls(np.load(path).tolist())
+        logging.info(
+            f"==> Loaded {len(cui_set)} bilateral CUIs from {path} in {time.time() - start} secs"
+        )
+        return cui_set
+
+    def save(self, path: str):
+        """
+        Saves the set as a sorted uint32 array.
+
+        :param path: Path of the .npy file.
+        :returns: None.
+        """
+
+        np.save(path, np.array(sorted(self.cuis), dtype=np.uint32))
+
+    @classmethod
+    def build(cls, connection) -> "BilateralCuiSet":
+        """
+        Scans the UMLS table once and collects the CUIs with a bilateral text.
+
+        :param connection: MySQL connection.
+        :returns: The bilateral CUI set.
+        """
+
+        query_master = QueryMaster()
+        cuis = set()
+
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(query_master.get_bilateral_cui_candidates)
+            for res in statement:
+                text = res.get("text")
+                if text is not None and is_bilateral_text(text):
+                    cuis.add(int(str(res.get("cui")).strip().lstrip("Cc")))
+        finally:
+            statement.close()
+
+        return cls(cuis)
+
+
+if __name__ == "__main__":
+    import mysql.connector as Cn
+
+    from config import BILATERAL_CUI_SET_PATH, DATABASE, HOST, PASSWORD, USER
+
+    parser = argparse.ArgumentParser(
+        description="Builds the bilateral CUI set from the UMLS table."
+    )
+    parser.add_argument("--output", default=BILATERAL_CUI_SET_PATH)
+    args = parser.parse_args()
+
+    connection = Cn.connect(host=HOST, user=USER, database=DATABASE, passwd=PASSWORD)
+    start = time.time()
+    bilateral_cui_set = BilateralCuiSet.build(connection)
+    connection.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    bilateral_cui_set.save(args.output)
+    print(
+        f"Saved {len(bilateral_cui_set)} bilateral CUIs to {args.output} in {time.time() - start} secs"
+    )
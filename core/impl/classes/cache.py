@@ -1,141 +1,85 @@
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from typing import List, Set
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Set
 
-from .loinc_classes import LoincMethod, LoincSystem
+from .loinc_classes import LoincCodeBean, LoincMethod, LoincSystem, LoincUnit
 
 
-@dataclass
+@dataclass(frozen=True)
 class LaboratoryLoincCodeCacheDto:
-    present_systems: Set[str] = None
-    present_methods: Set[str] = None
-    property: str = None
-    component_set: Set[str] = None
+    """
+    Normalized signature of a laboratory lookup. Every attribute is lower cased
+    and stripped, and an attribute which is not used as a filter is None.
+    """
+
+    component_set: FrozenSet[str] = None
+    property: FrozenSet[str] = None
+    present_systems: FrozenSet[str] = None
     time: str = None
-    scale: str = None
+    scale: FrozenSet[str] = None
+    present_methods: FrozenSet[str] = None
 
-    def __hash__(self) -> int:
-        prime = 31
-        result = 1
 
-        result = prime * result + (
-            0 if self.component_set is None else id(self.component_set)
-        )
-        result = prime * result + (
-            0 if self.present_methods is None else id(self.present_methods)
-        )
-        result = prime * result + (
-            0 if self.present_systems is None else id(self.present_systems)
-        )
-        result = prime * result + (0 if self.property is None else hash(self.property))
-        result = prime * result + (0 if self.scale is None else hash(self.scale))
-        result = prime * result + (0 if self.time is None else hash(self.time))
-
-        return result
-
-    def __eq__(self, obj: object) -> bool:
-        if self == obj:
-            return True
-        if obj == None:
-            return False
-        if self.__class__ != obj.__class__:
-            return False
-
-        other = LaboratoryLoincCodeCacheDto()
-        if self.component_set is None:
-            if other.component_set is not None:
-                return False
-        elif self.component_set != other.component_set:
-            return False
-
-        if self.present_methods is None:
-            if other.present_methods is not None:
-                return False
-        elif self.present_methods != other.present_methods:
-            return False
-
-        if self.present_systems is None:
-            if other.present_systems is not None:
-                return False
-        elif self.present_systems != other.present_systems:
-            return False
-
-        if self.property is None:
-            if other.property is not None:
-                return False
-        elif self.property != other.property:
-            return False
-
-        if self.time is None:
-            if other.time is not None:
-                return False
-        elif self.time != other.time:
-            return False
-
-        if self.scale is None:
-            if other.scale is not None:
-                return False
-        elif self.scale != other.scale:
-            return False
-
-        return True
+@dataclass
+class LaboratoryLoincLookup:
+    """
+    A laboratory lookup of an entity, its cache signature and the attributes the
+    query is generated from.
+    """
+
+    cache_dto: LaboratoryLoincCodeCacheDto = None
+    component_set: Set[str] = None
+    unit_bean: LoincUnit = None
+    present_systems: List[LoincSystem] = None
+    time: str = None
+    present_methods: List[LoincMethod] = None
 
 
 class LaboratoryLoincCodeCache:
-    def __init__(self) -> None:
-        self.max_cache_limit = 50000
-        self.cache_map = dict()
+    """
+    Thread safe LRU cache of the laboratory lookups, shared by all the requests.
+    Only the best ranked code of a lookup is used, so only that one is kept.
+    A lookup missing from memory is read from the persistent cache, if any, and
+    the new lookups are written through to it.
+
+    The cap is a number of entries, not a memory size. Entries are tagged with
+    the reference data version they were resolved on: once the cache is cleared
+    for a new version, the lookups of the requests still running on an older
+    version are not cached.
+    """
+
+    def __init__(self, max_cache_limit: int = 50000, persistent_cache=None) -> None:
+        """
+        :param max_cache_limit: Maximum number of lookups (entries) kept in memory.
+        :param persistent_cache: Optional PersistentResolutionCache.
+        """
+
+        self.max_cache_limit = max_cache_limit
+        self.persistent_cache = persistent_cache
+        self.cache_map: "OrderedDict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Reference data version of the entries, set by clear().
+        self.version = 0
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_puts = 0
 
     def check_cache_is_available(
         self, component_set, property, present_systems, time, scale, present_methods
-    ):
+    ) -> Optional[List[LoincCodeBean]]:
+        """
+        :returns: The cached code beans of the lookup, None if it is not cached.
+        """
+
         cache_dto = self.get_laboratory_loinc_code_cache_dto(
             component_set, property, present_systems, time, scale, present_methods
         )
-        if cache_dto in self.cache_map.keys():
-            return cache_dto.get(cache_dto)
-
-    def get_laboratory_loinc_code_cache_dto(
-        self,
-        component_set: Set[str],
-        property: str,
-        present_systems: List[LoincSystem],
-        time: str,
-        scale: str,
-        present_methods: List[LoincMethod],
-    ):
-        cache_dto = LaboratoryLoincCodeCacheDto()
-
-        if component_set is not None:
-            component_set = self.convert_set_data_to_lower(component_set)
-            cache_dto.component_set = component_set
-
-        if property is not None:
-            cache_dto.property = property
-
-        if scale is not None:
-            cache_dto.scale = scale
-
-        if time is not None:
-            cache_dto.time = time
-
-        present_methods_set = set()
-        present_systems_set = set()
-
-        if present_systems is not None:
-            for system in present_systems:
-                present_systems_set.add(system.timexValue.lower())
-
-        if present_methods is not None:
-            for method in present_methods:
-                present_methods_set.add(method.timexValue.lower())
-
-        cache_dto.present_methods = present_methods_set
-        cache_dto.present_systems = present_systems
-
-        return cache_dto
-
-    def convert_set_data_to_lower(self, component_set: Set[str]):
-        return set(map(lambda x: x.lower(), component_set))
+        return self.get(cache_dto)
 
     def add_into_cache(
         self,
@@ -147,8 +91,157 @@ class LaboratoryLoincCodeCache:
         scale,
         present_methods,
     ):
-        if len(self.cache_map) <= self.max_cache_limit:
-            cache_dto = self.get_laboratory_loinc_code_cache_dto(
-                component_set, property, present_systems, time, scale, present_methods
-            )
-            self.cache_map.update({cache_dto: loinc_code_beans})
+        cache_dto = self.get_laboratory_loinc_code_cache_dto(
+            component_set, property, present_systems, time, scale, present_methods
+        )
+        self.put(cache_dto, loinc_code_beans)
+
+    def get(
+        self,
+        cache_dto: LaboratoryLoincCodeCacheDto,
+        version: int = None,
+        release: str = None,
+    ) -> Optional[List[LoincCodeBean]]:
+        """
+        :param cache_dto: Signature of the lookup.
+        :param version: Reference data version of the request, None if unknown. A
+            persistent cache hit of an older version is not kept in memory.
+        :param release: Release of the reference data of the request, for the persistent cache.
+        :returns: The cached code beans of the lookup, None if it is not cached.
+        """
+
+        with self._lock:
+            loinc_code_beans = self.cache_map.get(cache_dto)
+            if loinc_code_beans is not None:
+                self.cache_map.move_to_end(cache_dto)
+                self.hits += 1
+                return loinc_code_beans
+
+        if self.persistent_cache is not None:
+            loinc_code_beans = self.persistent_cache.get_laboratory(cache_dto, release)
+            if loinc_code_beans is not None:
+                self._put_in_memory(cache_dto, loinc_code_beans, version)
+                with self._lock:
+                    self.persistent_hits += 1
+                return loinc_code_beans
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(
+        self,
+        cache_dto: LaboratoryLoincCodeCacheDto,
+        loinc_code_beans: List[LoincCodeBean],
+        version: int = None,
+        release: str = None,
+    ):
+        """
+        :param cache_dto: Signature of the lookup.
+        :param loinc_code_beans: Code beans found for the lookup.
+        :param version: Reference data version the lookup was resolved on, None if unknown.
+        :param release: Release of that reference data, for the persistent cache.
+        :returns: None.
+        """
+
+        if self._is_stale(version):
+            with self._lock:
+                self.stale_puts += 1
+            return
+        if self.persistent_cache is not None:
+            self.persistent_cache.put_laboratory(cache_dto, loinc_code_beans[:1], release)
+        self._put_in_memory(cache_dto, loinc_code_beans, version)
+
+    def prime(
+        self,
+        entries: Mapping[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]],
+        version: int = None,
+    ):
+        """
+        Adds lookups resolved elsewhere, in memory only, they are not written to the
+        persistent cache again.
+
+        :param entries: Code beans of every signature, as returned by resolve_lookups.
+        :param version: Reference data version the lookups were resolved on, None if unknown.
+        :returns: None.
+        """
+
+        for cache_dto, loinc_code_beans in entries.items():
+            self._put_in_memory(cache_dto, loinc_code_beans, version)
+
+    def _is_stale(self, version: Optional[int]) -> bool:
+        return version is not None and version < self.version
+
+    def _put_in_memory(
+        self,
+        cache_dto: LaboratoryLoincCodeCacheDto,
+        loinc_code_beans: List[LoincCodeBean],
+        version: int = None,
+    ):
+        if self.max_cache_limit <= 0:
+            return
+
+        with self._lock:
+            # Checked again, clear() may have run since put() checked it.
+            if self._is_stale(version):
+                self.stale_puts += 1
+                return
+            self.cache_map[cache_dto] = list(loinc_code_beans[:1])
+            self.cache_map.move_to_end(cache_dto)
+
+            while len(self.cache_map) > self.max_cache_limit:
+                self.cache_map.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self, version: int = None):
+        """
+        Drops every entry.
+
+        :param version: New reference data version, the puts of older versions are then ignored.
+        :returns: None.
+        """
+
+        with self._lock:
+            self.cache_map.clear()
+            if version is not None:
+                self.version = max(self.version, version)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self.cache_map),
+                "maxSize": self.max_cache_limit,
+                "hits": self.hits,
+                "persistentHits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stalePuts": self.stale_puts,
+                "version": self.version,
+            }
+
+    def get_laboratory_loinc_code_cache_dto(
+        self,
+        component_set: Iterable[str],
+        property: Iterable[str],
+        present_systems: List[LoincSystem],
+        time: str,
+        scale: Iterable[str],
+        present_methods: List[LoincMethod],
+    ) -> LaboratoryLoincCodeCacheDto:
+        return LaboratoryLoincCodeCacheDto(
+            component_set=self.convert_set_data_to_lower(component_set),
+            property=self.convert_set_data_to_lower(property),
+            present_systems=self.convert_set_data_to_lower(
+                [system.timexValue for system in present_systems or []]
+            ),
+            time=time.strip().lower() if time is not None else None,
+            scale=self.convert_set_data_to_lower(scale),
+            present_methods=self.convert_set_data_to_lower(
+                [method.timexValue for method in present_methods or []]
+            ),
+        )
+
+    def convert_set_data_to_lower(self, set_data: Iterable[str]) -> Optional[FrozenSet[str]]:
+        if not set_data:
+            return None
+        return frozenset(x.strip().lower() for x in set_data)
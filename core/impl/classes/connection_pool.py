@@ -0,0 +1,255 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import mysql.connector as Cn
+
+
+class ConnectionPoolTimeout(Exception):
+    pass
+
+
+class MySQLConnectionPool:
+    """
+    Fixed size pool of MySQL connections. Every request checks out its own
+    connection, so the waitress threads never share one.
+
+    Connections are opened lazily, pinged before being handed out when they have
+    been idle for more than `ping_interval` seconds, and re-opened when the ping
+    fails, so a dropped connection only costs a reconnect.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 4,
+        checkout_timeout: float = 30,
+        ping_interval: float = 30,
+        connection_factory: Callable = None,
+        **connect_kwargs,
+    ) -> None:
+        self.pool_size = pool_size
+        self.checkout_timeout = checkout_timeout
+        self.ping_interval = ping_interval
+
+        if connection_factory is None:
+            connection_factory = lambda: Cn.connect(**connect_kwargs)
+        self.connection_factory = connection_factory
+
+        self._condition = threading.Condition()
+        self._idle = deque()
+        self._last_used: Dict[int, float] = dict()
+        self._opened = 0
+        # Connection of ping, outside of the pool so a busy pool does not fail it.
+        self._ping_connection = None
+        self._ping_thread: threading.Thread = None
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.reconnects = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """
+        Checks out a connection for the duration of the `with` block.
+
+        :param timeout: Seconds to wait for a free connection, defaults to checkout_timeout.
+        :returns: A live MySQL connection.
+        """
+
+        connection = self.checkout(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def checkout(self, timeout: float = None):
+        """
+        Takes a connection out of the pool, waiting for one to be released if all
+        of them are in use.
+
+        :param timeout: Seconds to wait for a free connection, defaults to checkout_timeout.
+        :returns: A live MySQL connection.
+        """
+
+        timeout = self.checkout_timeout if timeout is None else timeout
+        start = time.time()
+        deadline = start + timeout
+
+        with self._condition:
+            while len(self._idle) == 0 and self._opened >= self.pool_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise ConnectionPoolTimeout(
+                        f"No MySQL connection available after {timeout} secs"
+                    )
+                self._condition.wait(remaining)
+
+            connection = self._idle.popleft() if len(self._idle) != 0 else None
+            if connection is None:
+                # Reserve the slot before connecting outside of the lock.
+                self._opened += 1
+
+        try:
+            if connection is None:
+                connection = self.connection_factory()
+            else:
+                connection = self._ensure_alive(connection)
+        except Exception:
+            with self._condition:
+                self._opened -= 1
+                self._condition.notify()
+            raise
+
+        wait_time = time.time() - start
+        with self._condition:
+            self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        return connection
+
+    def release(self, connection):
+        """
+        Gives a connection back to the pool. Broken connections are dropped and
+        re-opened by the next checkout.
+
+        :param connection: Connection returned by checkout.
+        :returns: None.
+        """
+
+        try:
+            # Ends the read transaction so the next request sees fresh data.
+            connection.rollback()
+            is_alive = True
+        except Exception as err:
+            logging.warning(f"==> Dropping broken MySQL connection : {err}")
+            is_alive = False
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+        with self._condition:
+            if is_alive:
+                self._last_used[id(connection)] = time.time()
+                self._idle.append(connection)
+            else:
+                self._last_used.pop(id(connection), None)
+                self._opened -= 1
+            self._condition.notify()
+
+    def _ensure_alive(self, connection):
+        last_used = self._last_used.get(id(connection), 0)
+        if time.time() - last_used < self.ping_interval:
+            return connection
+
+        try:
+            connection.ping(reconnect=True, attempts=1, delay=0)
+            return connection
+        except Exception as err:
+            logging.warning(f"==> MySQL connection lost, reconnecting : {err}")
+            self._last_used.pop(id(connection), None)
+            try:
+                connection.close()
+            except Exception:
+                pass
+            self.reconnects += 1
+            return self.connection_factory()
+
+    def ping(self, timeout: float = None) -> float:
+        """
+        Runs a trivial query on a dedicated connection, opened on the first ping
+        and kept outside of the pool, so the ping does not wait for the requests
+        when every pooled connection is in use. Connecting and the query together
+        are limited to `timeout` seconds, the query is also limited on the server
+        side with MAX_EXECUTION_TIME. A ping that overruns keeps running in its
+        thread until MySQL answers, and the next pings fail at once until it is
+        over, so a hung server does not pile up ping threads.
+
+        :param timeout: Seconds allowed to the ping, defaults to checkout_timeout.
+        :returns: Seconds taken by the query, and by connecting if needed.
+        """
+
+        timeout = self.checkout_timeout if timeout is None else timeout
+        result = dict()
+
+        with self._condition:
+            if self._ping_thread is not None and self._ping_thread.is_alive():
+                raise ConnectionPoolTimeout("Previous MySQL ping still running")
+            thread = threading.Thread(
+                target=self._run_ping,
+                args=(timeout, result),
+                name="mysql-ping",
+                daemon=True,
+            )
+            self._ping_thread = thread
+
+        start = time.time()
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            raise ConnectionPoolTimeout(f"MySQL ping took more than {timeout} secs")
+        if "error" in result:
+            raise result["error"]
+        return time.time() - start
+
+    def _run_ping(self, timeout: float, result: Dict):
+        # Only one ping thread runs at a time, it owns the ping connection.
+        try:
+            if self._ping_connection is None:
+                self._ping_connection = self.connection_factory()
+            statement = self._ping_connection.cursor()
+            try:
+                statement.execute(
+                    f"SELECT /*+ MAX_EXECUTION_TIME({max(1, int(timeout * 1000))}) */ 1"
+                )
+                statement.fetchall()
+            finally:
+                statement.close()
+            self._ping_connection.rollback()
+        except Exception as err:
+            result["error"] = err
+            self._close_ping_connection()
+
+    def _close_ping_connection(self):
+        connection, self._ping_connection = self._ping_connection, None
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._condition:
+            if self._ping_thread is None or not self._ping_thread.is_alive():
+                self._close_ping_connection()
+            while len(self._idle) != 0:
+                connection = self._idle.popleft()
+                self._last_used.pop(id(connection), None)
+                self._opened -= 1
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                "poolSize": self.pool_size,
+                "opened": self._opened,
+                "idle": len(self._idle),
+                "inUse": self._opened - len(self._idle),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "reconnects": self.reconnects,
+                "avgWaitTime": (
+                    self.total_wait_time / self.checkouts if self.checkouts else 0.0
+                ),
+                "maxWaitTime": self.max_wait_time,
+            }
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import Dict, List, Tuple
 
 
-@dataclass
+@dataclass(slots=True)
 class Span:
     begin: int = None
     end: int = None
@@ -22,6 +22,8 @@ class Span:
         return result
 
     def __eq__(self, __value: object) -> bool:
+        if not isinstance(__value, Span):
+            return NotImplemented
         return self.begin == __value.begin and self.end == __value.end
 
     def is_overlap(self, oth_begin, oth_end) -> bool:
@@ -35,7 +37,7 @@ class Span:
         return (self.begin <= othBegin) and (othEnd <= self.end)
 
 
-@dataclass
+@dataclass(slots=True)
 class TextSpan:
     text: str = None
     begin_offset: int = None
@@ -53,10 +55,12 @@ class TextSpan:
         return hash(self.begin_offset)
 
     def __eq__(self, __value: object) -> bool:
+        if not isinstance(__value, TextSpan):
+            return NotImplemented
         return self.begin_offset == __value.begin_offset
 
 
-@dataclass
+@dataclass(slots=True)
 class CRFEntityMention:
     id: int = None
 
@@ -89,7 +93,7 @@ class CRFEntityMention:
     radiologyroute_list: List[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class EntityMentionDto:
     id: int = None
     begin_set: List[int] = None
@@ -100,37 +104,62 @@ class EntityMentionDto:
     sui_set: List[int] = None
     possible_entity_type_set: List = None
 
+    # The remapped copies of an entity share its id and only differ by their type.
     def __eq__(self, __value: object) -> bool:
-        self.id = __value.id
+        if not isinstance(__value, EntityMentionDto):
+            return NotImplemented
+        return self.id == __value.id and tuple(self.possible_entity_type_set or ()) == tuple(
+            __value.possible_entity_type_set or ()
+        )
 
     def __hash__(self) -> int:
-        return hash(self.id)
+        return hash((self.id, tuple(self.possible_entity_type_set or ())))
+
 
+@dataclass(slots=True)
+class ParsedEntity:
+    """
+    Entity of the NER output with its offsets and UMLS identifiers parsed once,
+    shared by the laboratory and radiology passes of a document.
+    """
 
-@dataclass
+    id: int = None
+    entity_type: str = None
+    begin: int = None
+    end: int = None
+    begins: Tuple[int, ...] = ()
+    ends: Tuple[int, ...] = ()
+    texts: Tuple[str, ...] = ()
+    cuis: Tuple[int, ...] = ()
+    tuis: Tuple[int, ...] = ()
+    suis: Tuple[int, ...] = ()
+    entity: Dict = None
+
+
+@dataclass(slots=True)
 class ModalityToken:
-    begin = None
-    end = None
-    covered_text = None
-    timex_value = None
+    begin: int = None
+    end: int = None
+    covered_text: str = None
+    timex_value: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ViewToken(ModalityToken):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class PharmaceuticalToken(ModalityToken):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyrouteToken(ModalityToken):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class Sentence:
     begin: int = None
     end: int = None
@@ -138,6 +167,8 @@ class Sentence:
     covered_text: str = None
 
     def __eq__(self, __value: object) -> bool:
+        if not isinstance(__value, Sentence):
+            return NotImplemented
         return self.begin == __value.begin and self.end == __value.end
 
     def __hash__(self) -> int:
@@ -0,0 +1,103 @@
+from bisect import bisect_left, bisect_right
+from typing import Generic, Iterable, List, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class IntervalIndex(Generic[T]):
+    """
+    Static index of [begin, end] offset intervals, built once per document.
+
+    Intervals are sorted by begin offset with a running maximum of the end offsets,
+    so containment and overlap queries are a binary search plus a scan of the
+    candidates, O(log n + k) on the mostly disjoint spans of a document. Results
+    are returned in insertion order.
+    """
+
+    def __init__(self, intervals: Iterable[Tuple[int, int, T]]) -> None:
+        entries = sorted(
+            (
+                (int(begin), int(end), position, item)
+                for position, (begin, end, item) in enumerate(intervals)
+            ),
+            key=lambda entry: (entry[0], entry[2]),
+        )
+
+        self.begins: List[int] = [entry[0] for entry in entries]
+        self.ends: List[int] = [entry[1] for entry in entries]
+        self.positions: List[int] = [entry[2] for entry in entries]
+        self.items: List[T] = [entry[3] for entry in entries]
+
+        self.max_ends: List[int] = []
+        max_end = None
+        for end in self.ends:
+            max_end = end if max_end is None or end > max_end else max_end
+            self.max_ends.append(max_end)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def enclosed(self, begin: int, end: int, strict_end: bool = False) -> List[T]:
+        """
+        Gets the intervals lying inside [begin, end].
+
+        :param begin: Begin offset of the query.
+        :param end: End offset of the query.
+        :param strict_end: If True the intervals must end strictly before `end`.
+        :returns: Items with begin <= item begin and item end <= end (< end if strict).
+        """
+
+        lo = bisect_left(self.begins, begin)
+        hi = bisect_right(self.begins, end)
+
+        found = []
+        for i in range(lo, hi):
+            item_end = self.ends[i]
+            if item_end < end or (not strict_end and item_end == end):
+                found.append(i)
+
+        return self._get_items(found)
+
+    def enclosing(self, begin: int, end: int, strict_end: bool = False) -> List[T]:
+        """
+        Gets the intervals containing [begin, end].
+
+        :param begin: Begin offset of the query.
+        :param end: End offset of the query.
+        :param strict_end: If True the intervals must end strictly after `end`.
+        :returns: Items with item begin <= begin and end <= item end (< item end if strict).
+        """
+
+        found = []
+        i = bisect_right(self.begins, begin) - 1
+        while i >= 0 and self._reaches(self.max_ends[i], end, strict_end):
+            if self._reaches(self.ends[i], end, strict_end):
+                found.append(i)
+            i -= 1
+
+        return self._get_items(found)
+
+    def overlapping(self, begin: int, end: int) -> List[T]:
+        """
+        Gets the intervals sharing at least one offset with [begin, end).
+
+        :param begin: Begin offset of the query.
+        :param end: End offset of the query.
+        :returns: Items with item begin < end and begin < item end.
+        """
+
+        found = []
+        i = bisect_left(self.begins, end) - 1
+        while i >= 0 and self.max_ends[i] > begin:
+            if self.ends[i] > begin:
+                found.append(i)
+            i -= 1
+
+        return self._get_items(found)
+
+    def _reaches(self, item_end: int, end: int, strict_end: bool) -> bool:
+        return item_end > end if strict_end else item_end >= end
+
+    def _get_items(self, found: List[int]) -> List[T]:
+        found.sort(key=lambda i: self.positions[i])
+        return [self.items[i] for i in found]
@@ -3,7 +3,7 @@ from typing import List, Set
 from .core_dto import TextSpan
 
 
-@dataclass
+@dataclass(slots=True)
 class LoincComponent:
     text: str = ""
     begin: int = -1
@@ -12,7 +12,7 @@ class LoincComponent:
     timex_value: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class LoincCodeBean:
     code: str = ""
     code_desciption: str = ""
@@ -24,14 +24,17 @@ class LoincCodeBean:
     method_type: str = ""
     textSpans: Set[TextSpan] = field(default_factory=set)
 
+    # Beans are identified by their evidence, whatever the iteration order of the spans.
     def __eq__(self, __value: object) -> bool:
-        return list(self.textSpans) == list(__value.textSpans)
+        if not isinstance(__value, LoincCodeBean):
+            return NotImplemented
+        return frozenset(self.textSpans) == frozenset(__value.textSpans)
 
     def __hash__(self) -> int:
-        return hash(list(self.textSpans)[0])
+        return hash(frozenset(self.textSpans))
 
 
-@dataclass
+@dataclass(slots=True)
 class LoincUnit:
     text: str = ""
     begin: int = -1
@@ -39,12 +42,12 @@ class LoincUnit:
     timexValue: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class LoincSystem(LoincUnit):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class LoincMethod(LoincUnit):
     pass
 
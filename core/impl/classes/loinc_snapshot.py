@@ -0,0 +1,233 @@
+import logging
+import sys
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .loinc_classes import LoincCodeBean
+from .my_sql import QueryMaster
+
+# Position of every searchable attribute inside a snapshot row.
+CODE = 0
+CODE_DESCRIPTION = 1
+COMPONENT = 2
+PROPERTY = 3
+TIME_ASPCT = 4
+SYSTEM = 5
+SCALE_TYP = 6
+METHOD_TYP = 7
+
+INDEXED_COLUMNS = (COMPONENT, PROPERTY, TIME_ASPCT, SYSTEM, SCALE_TYP, METHOD_TYP)
+
+
+class LoincMasterSnapshot:
+    """
+    In-memory copy of the ACTIVE rows of the `loinc` table.
+
+    Rows are kept in the order of "common_test_rank, common_order_rank,
+    common_si_test_rank", so the row number of a match is also its rank and the
+    first match of a lookup is the code the SQL query would have returned first.
+    """
+
+    def __init__(self) -> None:
+        self.rows: List[Tuple[str, ...]] = []
+        self.code_index: Dict[str, int] = dict()
+        self.normalized_rows: List[Tuple[str, ...]] = []
+        self.indexes: Dict[int, Dict[str, array]] = {
+            column: dict() for column in INDEXED_COLUMNS
+        }
+        self.loaded_at: float = None
+
+    @classmethod
+    def load(cls, connection) -> "LoincMasterSnapshot":
+        """
+        Loads the ACTIVE LOINC rows from the database.
+
+        :param connection: MySQL connection.
+        :returns: The loaded snapshot.
+        """
+
+        snapshot = cls()
+        query_master = QueryMaster()
+
+        start = time.time()
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(query_master.get_loinc_snapshot_data)
+            for res in statement:
+                snapshot.add_row(
+                    code=res.get("loinc_num"),
+                    code_description=res.get("long_common_name"),
+                    component=res.get("component"),
+                    property=res.get("property"),
+                    time_aspct=res.get("time_aspct"),
+                    system=res.get("system"),
+                    scale_typ=res.get("scale_typ"),
+                    method_typ=res.get("method_typ"),
+                )
+        finally:
+            statement.close()
+
+        snapshot.loaded_at = time.time()
+        logging.info(
+            f"==> Loaded LOINC snapshot with {len(snapshot)} rows in {snapshot.loaded_at - start} secs"
+        )
+        return snapshot
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def add_row(
+        self,
+        code: str,
+        code_description: str,
+        component: str,
+        property: str,
+        time_aspct: str,
+        system: str,
+        scale_typ: str,
+        method_typ: str,
+    ):
+        """
+        Appends a row to the snapshot. Rows must be added in rank order.
+        """
+
+        row = tuple(
+            sys.intern(value) if value is not None else ""
+            for value in (
+                code,
+                code_description,
+                component,
+                property,
+                time_aspct,
+                system,
+                scale_typ,
+                method_typ,
+            )
+        )
+        normalized_row = tuple(sys.intern(self.normalize(value)) for value in row)
+
+        row_num = len(self.rows)
+        self.rows.append(row)
+        self.code_index[row[CODE]] = row_num
+        self.normalized_rows.append(normalized_row)
+
+        for column in INDEXED_COLUMNS:
+            postings = self.indexes[column].get(normalized_row[column])
+            if postings is None:
+                postings = array("I")
+                self.indexes[column][normalized_row[column]] = postings
+            postings.append(row_num)
+
+    @staticmethod
+    def normalize(value: str) -> str:
+        """
+        Normalizes a value the way MySQL compares them (case and trailing space
+        insensitive). Components coming from the services are SQL escaped.
+        """
+
+        if value is None:
+            return ""
+        return str(value).replace("\\'", "'").strip().lower()
+
+    def find_codes(
+        self,
+        component_set: Iterable[str],
+        property_set: Optional[Iterable[str]] = None,
+        system_set: Optional[Iterable[str]] = None,
+        time: Optional[str] = None,
+        scale_set: Optional[Iterable[str]] = None,
+        method_set: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[LoincCodeBean]:
+        """
+        Finds the LOINC codes matching the given attributes, best ranked first.
+        An attribute that is None (or empty) is not used as a filter, exactly
+        like the generated SQL query.
+
+        :param component_set: Allowed components.
+        :param property_set: Allowed properties.
+        :param system_set: Allowed systems.
+        :param time: Time aspect.
+        :param scale_set: Allowed scale types.
+        :param method_set: Allowed method types.
+        :param limit: Maximum number of codes to return.
+
+        :returns: List of matching code beans.
+        """
+
+        criteria = {}
+        for column, values in (
+            (COMPONENT, component_set),
+            (PROPERTY, property_set),
+            (SYSTEM, system_set),
+            (TIME_ASPCT, [time] if time is not None else None),
+            (SCALE_TYP, scale_set),
+            (METHOD_TYP, method_set),
+        ):
+            if values:
+                criteria[column] = {self.normalize(value) for value in values}
+
+        if len(criteria) == 0:
+            return []
+
+        # The most selective attribute drives the scan, the rest are checked on the row.
+        driver_column = None
+        driver_postings = None
+        driver_size = None
+        for column, values in criteria.items():
+            postings = [
+                self.indexes[column][value]
+                for value in values
+                if value in self.indexes[column]
+            ]
+            size = sum(len(it) for it in postings)
+            if size == 0:
+                return []
+            if driver_size is None or size < driver_size:
+                driver_column, driver_postings, driver_size = column, postings, size
+
+        if len(driver_postings) == 1:
+            candidates = driver_postings[0]
+        else:
+            candidates = sorted(set().union(*driver_postings))
+
+        other_criteria = [
+            (column, values)
+            for column, values in criteria.items()
+            if column != driver_column
+        ]
+
+        loinc_code_beans = []
+        for row_num in candidates:
+            normalized_row = self.normalized_rows[row_num]
+            if all(normalized_row[column] in values for column, values in other_criteria):
+                loinc_code_beans.append(self._get_code_bean(row_num))
+                if limit is not None and len(loinc_code_beans) >= limit:
+                    break
+
+        return loinc_code_beans
+
+    def get_code_bean(self, code: str) -> Optional[LoincCodeBean]:
+        """
+        :param code: LOINC code.
+        :returns: Code bean of the code, None if it is not an ACTIVE code.
+        """
+
+        row_num = self.code_index.get(code)
+        if row_num is None:
+            return None
+        return self._get_code_bean(row_num)
+
+    def _get_code_bean(self, row_num: int) -> LoincCodeBean:
+        row = self.rows[row_num]
+        return LoincCodeBean(
+            code=row[CODE],
+            code_desciption=row[CODE_DESCRIPTION],
+            component=row[COMPONENT],
+            property=row[PROPERTY],
+            time_aspct=row[TIME_ASPCT],
+            system=row[SYSTEM],
+            scale_type=row[SCALE_TYP],
+            method_type=row[METHOD_TYP],
+        )
@@ -7,7 +7,7 @@ import mysql.connector as Cn
 from .loinc_classes import LoincCodeBean
 from .radiology_classes import RadiologyTermMappingTableDto
 from .core_dto import TextSpan
-from typing import Set
+from typing import Dict, List, Set
 
 
 @dataclass(frozen=True)
@@ -34,22 +34,53 @@ class QueryMaster:
     cui_map_id_query = (
         "Select * from " + DB_NAME + ".radiology_cui_mapping where is_active = 1 and "
     )
+    radiology_cui_mapping_query = (
+        "Select * from " + DB_NAME + ".radiology_cui_mapping where is_active = 1"
+    )
+    radiology_term_mapping_query = (
+        "Select * from " + DB_NAME + ".radiology_term_mapping where is_active = 1"
+    )
     term_map_id_query = (
         "Select * from " + DB_NAME + ".radiology_term_mapping where is_active = 1 and "
     )
     get_loinc_data_using_code = (
         "select * from " + DB_NAME + ".loinc where status='ACTIVE' and loinc_num = ?"
     )
+    get_loinc_data_using_codes = (
+        "select * from " + DB_NAME + ".loinc where status='ACTIVE' and loinc_num in "
+    )
     get_loinc_laboratory_data = (
         "select * from " + DB_NAME + ".loinc where status='ACTIVE'"
     )
+    get_loinc_snapshot_data = (
+        "select loinc_num, long_common_name, component, property, time_aspct, `system`, scale_typ, method_typ from "
+        + DB_NAME
+        + ".loinc where status='ACTIVE' order by common_test_rank,common_order_rank,common_si_test_rank"
+    )
+
+    # Checksums of the tables the laboratory and radiology resolutions are read from.
+    loinc_release_checksum_query = (
+        "CHECKSUM TABLE "
+        + DB_NAME
+        + ".loinc, "
+        + DB_NAME
+        + ".radiology_cui_mapping, "
+        + DB_NAME
+        + ".radiology_term_mapping"
+    )
 
     get_all_radiology_cui = (
         "Select * from " + DB_NAME + ".radiology_cui_map where is_active = 1"
     )
 
+    # The cui column may hold "C0011847" or 11847, both forms are bound.
     get_text_of_cui = (
-        "Select distinct text From " + UMLS_DB_NAME + ".umls_test1 where cui = ?"
+        "Select distinct text From " + UMLS_DB_NAME + ".umls_test1 where cui in (%s, %s)"
+    )
+    get_bilateral_cui_candidates = (
+        "Select distinct cui, text From "
+        + UMLS_DB_NAME
+        + ".umls_test1 where text like '%bilateral%' or text like '%both%' or text like '%b/l%'"
     )
 
 
@@ -91,9 +122,17 @@ class QueryMySQL:
         return loinc_code_beans
 
     def check_bilateral_in_text(self, cui: int):
-        self.ps_get_umls_text_from_cui.replace("?", str(cui))
+        """
+        Fallback of the bilateral CUI set, when it is not built. Matches the CUI
+        like BilateralCuiSet.build, with or without its "C" prefix.
+
+        :param cui: Numerical part of the CUI.
+        :returns: True if one of the UMLS texts of the CUI is bilateral.
+        """
+
+        cui = int(cui)
         start = time.time()
-        self.statement.execute(self.ps_get_umls_text_from_cui)
+        self.statement.execute(self.ps_get_umls_text_from_cui, (f"C{cui:07d}", str(cui)))
         end = time.time()
 
         is_bilateral_found = False
@@ -177,9 +216,9 @@ class QueryMySQL:
         return map_id_set
 
     def get_loinc_master_data_from_code(self, code: str, text_span: Set[TextSpan]):
-        self.ps_get_loinc_data_from_code = self.ps_get_loinc_data_from_code.replace("?", code)
+        query = self.ps_get_loinc_data_from_code.replace("?", "'" + code + "'")
         start = time.time()
-        self.statement.execute(self.ps_get_loinc_data_from_code)
+        self.statement.execute(query)
         end = time.time()
         loinc_code_bean = None 
         for resultSet in self.statement:
@@ -205,6 +244,47 @@ class QueryMySQL:
 
         return loinc_code_bean
 
+    def get_loinc_master_data_from_codes(
+        self, code_to_text_spans: Dict[str, Set[TextSpan]]
+    ) -> List[LoincCodeBean]:
+        """
+        Gets the LOINC master data of all the codes with a single query.
+
+        :param code_to_text_spans: Text spans of every code.
+        :returns: Code beans of the codes found, with their text spans.
+        """
+
+        if len(code_to_text_spans) == 0:
+            return []
+
+        codes = list(code_to_text_spans.keys())
+        query = (
+            self.query_master.get_loinc_data_using_codes
+            + "("
+            + ", ".join(["%s"] * len(codes))
+            + ")"
+        )
+        start = time.time()
+        self.statement.execute(query, codes)
+        end = time.time()
+
+        code_to_loinc_code_bean = dict()
+        for resultSet in self.statement:
+            code = resultSet.get("loinc_num")
+            code_to_loinc_code_bean[code] = LoincCodeBean(
+                code=code,
+                code_desciption=resultSet.get("long_common_name"),
+                component=resultSet.get("component"),
+                property=resultSet.get("property"),
+                time_aspct=resultSet.get("time_aspct"),
+                system=resultSet.get("system"),
+                scale_type=resultSet.get("scale_typ"),
+                method_type=resultSet.get("method_typ"),
+                textSpans=code_to_text_spans.get(code),
+            )
+
+        return list(code_to_loinc_code_bean.values())
+
 
 if __name__ == "__main__":
     query_sql = QueryMySQL()
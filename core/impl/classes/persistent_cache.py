@@ -0,0 +1,305 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+from .cache import LaboratoryLoincCodeCacheDto
+from .loinc_classes import LoincCodeBean
+from .radiology_classes import RadiologyTermMappingTableDto
+
+# Kinds of resolution kept in the cache.
+LABORATORY = "laboratory"
+RADIOLOGY_CUI = "radiology_cui"
+RADIOLOGY_TERM = "radiology_term"
+LOINC_CODE = "loinc_code"
+
+# Attributes of a LoincCodeBean stored in the cache, the text spans are per document.
+LOINC_CODE_BEAN_FIELDS = (
+    "code",
+    "code_desciption",
+    "component",
+    "property",
+    "time_aspct",
+    "system",
+    "scale_type",
+    "method_type",
+)
+
+RADIOLOGY_TERM_MAPPING_FIELDS = (
+    "map_id",
+    "term1",
+    "term2",
+    "term3",
+    "term4",
+    "term5",
+    "term6",
+    "term7",
+    "code",
+    "totalTerms",
+)
+
+
+class PersistentResolutionCache:
+    """
+    On-disk cache of the laboratory and radiology resolutions, kept across restarts
+    in a SQLite file in WAL mode.
+
+    Every entry is tagged with the LOINC release it was resolved against
+    (ReferenceData.release). Only the entries of the current release are read,
+    and only the resolutions made on the current release are written, so a
+    request still running on the previous reference data cannot write its
+    results under the new release. Setting a new release drops the entries of
+    the previous ones, setting None disables the cache. Nothing is read at
+    startup, entries are read on demand through a memory mapped file.
+    """
+
+    MMAP_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.release: str = None
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(f"PRAGMA mmap_size={self.MMAP_SIZE}")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS resolution ("
+            "kind TEXT NOT NULL, signature TEXT NOT NULL, release TEXT NOT NULL, "
+            "value TEXT NOT NULL, PRIMARY KEY (kind, signature)) WITHOUT ROWID"
+        )
+
+        # Entries of the current release per kind, counted when the release is set
+        # and kept up to date by put, so stats does not scan the table.
+        self._entries: Dict[str, int] = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.stale_writes = 0
+
+    def set_release(self, release: Optional[str]):
+        """
+        Tags the new entries with a release and drops the entries of the others.
+
+        :param release: Release tag, ReferenceData.release. None disables the cache
+            until a release is set again, the entries are kept.
+        :returns: None.
+        """
+
+        if release is None:
+            with self._lock:
+                self.release = None
+            logging.warning(f"==> Persistent cache {self.path} disabled, the LOINC release is unknown")
+            return
+
+        with self._lock:
+            deleted = self._connection.execute(
+                "DELETE FROM resolution WHERE release != ?", (release,)
+            ).rowcount
+            self._entries = dict(
+                self._connection.execute(
+                    "SELECT kind, COUNT(*) FROM resolution GROUP BY kind"
+                ).fetchall()
+            )
+            self.release = release
+
+        logging.info(
+            f"==> Persistent cache {self.path} on release {release}, {deleted} stale entries dropped"
+        )
+
+    def get(self, kind: str, signature: str, release: Optional[str]) -> Optional[Any]:
+        """
+        :param kind: Kind of resolution.
+        :param signature: Signature of the resolution.
+        :param release: Release of the reference data of the request.
+        :returns: The cached value, None if it is not cached for this release.
+        """
+
+        with self._lock:
+            if release is None or release != self.release:
+                return None
+            row = self._connection.execute(
+                "SELECT value FROM resolution WHERE kind = ? AND signature = ? AND release = ?",
+                (kind, signature, release),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def put(self, kind: str, signature: str, value: Any, release: Optional[str]):
+        """
+        :param kind: Kind of resolution.
+        :param signature: Signature of the resolution.
+        :param value: JSON serializable value.
+        :param release: Release of the reference data the value was resolved on,
+            the value is dropped if it is not the current release.
+        :returns: None.
+        """
+
+        data = json.dumps(value)
+        with self._lock:
+            if release is None or release != self.release:
+                if self.release is not None:
+                    self.stale_writes += 1
+                return
+            inserted = self._connection.execute(
+                "INSERT OR IGNORE INTO resolution (kind, signature, release, value) VALUES (?, ?, ?, ?)",
+                (kind, signature, release, data),
+            ).rowcount
+            if inserted == 0:
+                self._connection.execute(
+                    "UPDATE resolution SET release = ?, value = ? WHERE kind = ? AND signature = ?",
+                    (release, data, kind, signature),
+                )
+            else:
+                self._entries[kind] = self._entries.get(kind, 0) + 1
+            self.writes += 1
+
+    def get_laboratory(
+        self, cache_dto: LaboratoryLoincCodeCacheDto, release: Optional[str]
+    ) -> Optional[List[LoincCodeBean]]:
+        """
+        :param cache_dto: Signature of a laboratory lookup.
+        :param release: Release of the reference data of the request.
+        :returns: The cached code beans of the lookup, None if it is not cached.
+        """
+
+        rows = self.get(LABORATORY, self.get_laboratory_signature(cache_dto), release)
+        if rows is None:
+            return None
+        return [self.to_loinc_code_bean(row) for row in rows]
+
+    def put_laboratory(
+        self,
+        cache_dto: LaboratoryLoincCodeCacheDto,
+        loinc_code_beans: List[LoincCodeBean],
+        release: Optional[str],
+    ):
+        self.put(
+            LABORATORY,
+            self.get_laboratory_signature(cache_dto),
+            [self.from_loinc_code_bean(bean) for bean in loinc_code_beans],
+            release,
+        )
+
+    def get_radiology_map_ids(
+        self, cui_list: Sequence[int], release: Optional[str]
+    ) -> Optional[List[str]]:
+        """
+        :param cui_list: CUI combination, e.g. (method CUI, system CUI).
+        :param release: Release of the reference data of the request.
+        :returns: The cached map_ids of radiology_cui_mapping, None if not cached.
+        """
+
+        return self.get(RADIOLOGY_CUI, json.dumps([int(cui) for cui in cui_list]), release)
+
+    def put_radiology_map_ids(
+        self, cui_list: Sequence[int], map_ids: List[str], release: Optional[str]
+    ):
+        self.put(RADIOLOGY_CUI, json.dumps([int(cui) for cui in cui_list]), map_ids, release)
+
+    def get_radiology_term_mapping(
+        self, map_ids: Sequence[str], release: Optional[str]
+    ) -> Optional[List[RadiologyTermMappingTableDto]]:
+        """
+        :param map_ids: map_ids found in radiology_cui_mapping.
+        :param release: Release of the reference data of the request.
+        :returns: The cached radiology_term_mapping rows, None if not cached.
+        """
+
+        rows = self.get(RADIOLOGY_TERM, json.dumps(list(map_ids)), release)
+        if rows is None:
+            return None
+        return [
+            RadiologyTermMappingTableDto(**dict(zip(RADIOLOGY_TERM_MAPPING_FIELDS, row)))
+            for row in rows
+        ]
+
+    def put_radiology_term_mapping(
+        self,
+        map_ids: Sequence[str],
+        rows: List[RadiologyTermMappingTableDto],
+        release: Optional[str],
+    ):
+        self.put(
+            RADIOLOGY_TERM,
+            json.dumps(list(map_ids)),
+            [
+                [getattr(row, field) for field in RADIOLOGY_TERM_MAPPING_FIELDS]
+                for row in rows
+            ],
+            release,
+        )
+
+    def get_loinc_code(self, code: str, release: Optional[str]) -> Optional[LoincCodeBean]:
+        """
+        :param code: LOINC code.
+        :param release: Release of the reference data of the request.
+        :returns: The cached master data of the code, None if not cached.
+        """
+
+        row = self.get(LOINC_CODE, code, release)
+        if row is None:
+            return None
+        return self.to_loinc_code_bean(row)
+
+    def put_loinc_code(self, loinc_code_bean: LoincCodeBean, release: Optional[str]):
+        self.put(
+            LOINC_CODE,
+            loinc_code_bean.code,
+            self.from_loinc_code_bean(loinc_code_bean),
+            release,
+        )
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "path": self.path,
+                "release": self.release,
+                "entries": dict(self._entries) if self.release is not None else dict(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "staleWrites": self.stale_writes,
+            }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def get_laboratory_signature(cache_dto: LaboratoryLoincCodeCacheDto) -> str:
+        return json.dumps(
+            [
+                sorted(value) if isinstance(value, frozenset) else value
+                for value in (
+                    cache_dto.component_set,
+                    cache_dto.property,
+                    cache_dto.present_systems,
+                    cache_dto.time,
+                    cache_dto.scale,
+                    cache_dto.present_methods,
+                )
+            ]
+        )
+
+    @staticmethod
+    def from_loinc_code_bean(loinc_code_bean: LoincCodeBean) -> List:
+        return [getattr(loinc_code_bean, field) for field in LOINC_CODE_BEAN_FIELDS]
+
+    @staticmethod
+    def to_loinc_code_bean(row: List) -> LoincCodeBean:
+        return LoincCodeBean(**dict(zip(LOINC_CODE_BEAN_FIELDS, row)))
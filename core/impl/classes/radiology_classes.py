@@ -3,7 +3,7 @@ from typing import List, Set
 from .core_dto import TextSpan, EntityMentionDto
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyLoincCodeBean:
     code: str = None
     code_description: str = None
@@ -16,10 +16,12 @@ class RadiologyLoincCodeBean:
         return hash(self.code)
 
     def __eq__(self, __value: object) -> bool:
+        if not isinstance(__value, RadiologyLoincCodeBean):
+            return NotImplemented
         return self.code == __value.code
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyLoincPropertyDto:
     text: str = None
     begin: int = None
@@ -27,33 +29,34 @@ class RadiologyLoincPropertyDto:
     timexValue: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyLoincModality(RadiologyLoincPropertyDto):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyLoincPharmaceutical(RadiologyLoincPropertyDto):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyLoincRadiologyroute(RadiologyLoincPropertyDto):
     pass
 
 
+@dataclass(slots=True)
 class RadiologyLoincView(RadiologyLoincPropertyDto):
     pass
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologySystemDto:
     entity_mention_dto: EntityMentionDto = None
     min_distance: int = None
     max_distance: int = None
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyComponentDto:
     raiology_loinc_modality_list: List[RadiologyLoincModality] = None
     raiology_loinc_pharmaceutical_list: List[RadiologyLoincPharmaceutical] = None
@@ -61,14 +64,14 @@ class RadiologyComponentDto:
     raiology_loinc_view_list: List[RadiologyLoincView] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyMethodDto:
     method_entity_mention: EntityMentionDto
     radiology_system_dto_list: List[RadiologySystemDto]
     radiology_component_dto: RadiologyComponentDto
 
 
-@dataclass
+@dataclass(slots=True)
 class RadiologyTermMappingTableDto:
     map_id: str = None
     term1: str = None
@@ -0,0 +1,233 @@
+import logging
+import re
+import time
+from itertools import combinations
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .my_sql import QueryMaster, QueryMySQL
+from .radiology_classes import RadiologyTermMappingTableDto
+
+CUI_COLUMN_PATTERN = re.compile(r"^cui(\d+)$")
+
+
+class RadiologyCuiMappingIndex:
+    """
+    In-memory copy of the active rows of `radiology_cui_mapping`, indexed by the
+    number of CUIs of the row and the set of its CUIs.
+
+    A lookup with n CUIs matches the rows whose n first CUI columns are all in the
+    given CUIs and whose next CUI column is empty, exactly like the query built by
+    RadiologyLoincCodeAlgorithm.get_map_id_from_radiology_cui_mapping.
+    """
+
+    def __init__(self) -> None:
+        self.map_id_index: Dict[Tuple[int, FrozenSet[int]], List[Tuple[int, str]]] = dict()
+        self.total_rows = 0
+        self.loaded_at: float = None
+
+    @classmethod
+    def load(cls, connection) -> "RadiologyCuiMappingIndex":
+        """
+        Loads the active rows of radiology_cui_mapping.
+
+        :param connection: MySQL connection.
+        :returns: The loaded index.
+        """
+
+        index = cls()
+        query_master = QueryMaster()
+
+        start = time.time()
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(query_master.radiology_cui_mapping_query)
+            cui_columns = None
+            for result_set in statement:
+                if cui_columns is None:
+                    cui_columns = sorted(
+                        (
+                            column
+                            for column in result_set.keys()
+                            if CUI_COLUMN_PATTERN.match(column)
+                        ),
+                        key=lambda column: int(CUI_COLUMN_PATTERN.match(column).group(1)),
+                    )
+                index.add_row(
+                    result_set.get("map_id"),
+                    [result_set.get(column) for column in cui_columns],
+                )
+        finally:
+            statement.close()
+
+        index.loaded_at = time.time()
+        logging.info(
+            f"==> Loaded radiology_cui_mapping index with {index.total_rows} rows in {index.loaded_at - start} secs"
+        )
+        return index
+
+    def add_row(self, map_id: str, cuis: Sequence):
+        """
+        Adds a row of the table, rows must be added in the table order.
+
+        :param map_id: map_id of the row.
+        :param cuis: Values of the cui1, cui2, ... columns, None for an empty column.
+        :returns: None.
+        """
+
+        prefix = []
+        for cui in cuis:
+            # Like "cuiN is null", an empty string is a value, which no CUI matches.
+            if cui is None:
+                break
+            try:
+                prefix.append(int(cui))
+            except ValueError:
+                logging.info(f"==> Skipping radiology_cui_mapping row {map_id}, invalid CUI {cui}")
+                return
+
+        if len(prefix) == 0:
+            return
+
+        key = (len(prefix), frozenset(prefix))
+        self.map_id_index.setdefault(key, []).append((self.total_rows, map_id))
+        self.total_rows += 1
+
+    def get_map_ids(self, cui_list: Sequence[int]) -> List[str]:
+        """
+        Gets the map_ids of a CUI combination.
+
+        :param cui_list: CUI combination, e.g. [method CUI, system CUI].
+        :returns: The matching map_ids in table order.
+        """
+
+        length = len(cui_list)
+        cui_set = frozenset(int(cui) for cui in cui_list)
+
+        matches = []
+        for size in range(1, min(length, len(cui_set)) + 1):
+            for subset in combinations(cui_set, size):
+                matches.extend(self.map_id_index.get((length, frozenset(subset)), ()))
+
+        if len(matches) > 1:
+            matches.sort()
+        return [map_id for _, map_id in matches]
+
+    def find_map_ids(
+        self, cui_combinations: Iterable[Sequence[int]]
+    ) -> Tuple[Optional[Sequence[int]], List[str]]:
+        """
+        Resolves the combinations in order and stops at the first one with a match.
+
+        :param cui_combinations: CUI combinations in priority order.
+        :returns: The matching combination and its map_ids, (None, []) if none match.
+        """
+
+        for cui_list in cui_combinations:
+            map_ids = self.get_map_ids(cui_list)
+            if len(map_ids) != 0:
+                return cui_list, map_ids
+        return None, []
+
+
+class RadiologyTermMappingIndex:
+    """
+    In-memory copy of the active rows of `radiology_term_mapping`, grouped by
+    map_id. Terms are lower cased and interned to integer ids, every row is kept as
+    a fixed size array of term ids (-1 for an empty term), so the match count of
+    all the candidate rows is a single vectorized operation.
+    """
+
+    TERM_COLUMNS = 7
+
+    def __init__(self) -> None:
+        self.rows: List[RadiologyTermMappingTableDto] = []
+        self.term_id_map: Dict[str, int] = dict()
+        self.map_id_rows: Dict[str, np.ndarray] = dict()
+        self.term_id_matrix: np.ndarray = np.empty((0, self.TERM_COLUMNS), dtype=np.int32)
+        self.loaded_at: float = None
+
+    @classmethod
+    def load(cls, connection) -> "RadiologyTermMappingIndex":
+        """
+        Loads the active rows of radiology_term_mapping.
+
+        :param connection: MySQL connection.
+        :returns: The loaded index.
+        """
+
+        start = time.time()
+        query_my_sql = QueryMySQL(connection=connection)
+        rows = query_my_sql.get_radiology_term_mapping(
+            query_my_sql.query_master.radiology_term_mapping_query
+        )
+
+        index = cls()
+        index.build(rows)
+        index.loaded_at = time.time()
+        logging.info(
+            f"==> Loaded radiology_term_mapping index with {len(rows)} rows in {index.loaded_at - start} secs"
+        )
+        return index
+
+    def build(self, rows: List[RadiologyTermMappingTableDto]):
+        """
+        Builds the index from the table rows, in table order.
+
+        :param rows: Rows of radiology_term_mapping.
+        :returns: None.
+        """
+
+        term_id_matrix = np.full((len(rows), self.TERM_COLUMNS), -1, dtype=np.int32)
+        map_id_rows: Dict[str, List[int]] = dict()
+
+        for row_num, dto in enumerate(rows):
+            terms = (dto.term1, dto.term2, dto.term3, dto.term4, dto.term5, dto.term6, dto.term7)
+            for column, term in enumerate(terms):
+                if term is not None:
+                    term_id_matrix[row_num, column] = self.term_id_map.setdefault(
+                        term.lower(), len(self.term_id_map)
+                    )
+            map_id_rows.setdefault(dto.map_id, []).append(row_num)
+
+        self.rows = rows
+        self.term_id_matrix = term_id_matrix
+        self.map_id_rows = {
+            map_id: np.array(row_nums, dtype=np.int64)
+            for map_id, row_nums in map_id_rows.items()
+        }
+
+    def get_row_nums(self, cui_map_id_list: Iterable[str]) -> np.ndarray:
+        """
+        :param cui_map_id_list: map_ids found in radiology_cui_mapping.
+        :returns: Row numbers of these map_ids in table order.
+        """
+
+        row_nums = [
+            self.map_id_rows[map_id]
+            for map_id in set(cui_map_id_list)
+            if map_id in self.map_id_rows
+        ]
+        if len(row_nums) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(row_nums))
+
+    def get_match_counts(self, row_nums: np.ndarray, components: Iterable[str]) -> np.ndarray:
+        """
+        Counts, for every row, the terms which are one of the (lower cased) components.
+
+        :param row_nums: Row numbers returned by get_row_nums.
+        :param components: Lower cased component texts.
+        :returns: Match count of every row.
+        """
+
+        component_ids = [
+            self.term_id_map[component]
+            for component in components
+            if component in self.term_id_map
+        ]
+        if len(component_ids) == 0:
+            return np.zeros(len(row_nums), dtype=np.int64)
+
+        return np.isin(self.term_id_matrix[row_nums], component_ids).sum(axis=1)
@@ -0,0 +1,462 @@
+import csv
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
+
+from .bilateral_cui_set import BilateralCuiSet
+from .loinc_snapshot import LoincMasterSnapshot
+from .my_sql import QueryMaster
+from .radiology_index import RadiologyCuiMappingIndex, RadiologyTermMappingIndex
+
+# CUIs of the entities that can be used as a radiology method.
+METHOD_QUALIFIED_CUIS = "41618,220934,1456803,1875843,2368378,243032,162481,34571,43309,1306645,1962945,3244296,24485,1552358,16356,40405,1552357,16356,34571,43309,1306645,1962945,3244296,10000553,10001564,34606,34607,2368359,3665374,10001564,34606,34607,2368359,3665374,40399,24671,260913,24671,260913,729296,1514967,40404,16356,16356,3463807,1510486,40405,1552357,31001,1536105,1441535,34571,43309,1306645,1962945,3244296,16356,16356,10000553,24487,34571,43309,1306645,1962945,3244296,729296,1514967,32743,376335,40405,1552357,31001,1536105,1441535,24671,260913,10002881,10001564,34606,34607,2368359,3665374,40399,40405,1552357,41618,220934,1456803,1875843,2368378,2748260,2367013,40405,1552357,11321,41618,220934,1456803,1875843,2368378,24671,260913,32743,31001,40405,1552357,1536105,1441535,40405,1552357,31001,1536105,1441535"
+
+
+def _empty_mapping() -> Mapping:
+    return MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    """
+    Immutable set of the reference tables used by the laboratory and radiology
+    services. A new instance is built on every (re)load, requests keep using the
+    instance they started with.
+    """
+
+    version: int = 0
+    loaded_at: float = None
+    unit_property_map: Mapping[str, str] = field(default_factory=_empty_mapping)
+    unit_scale_map: Mapping[str, str] = field(default_factory=_empty_mapping)
+    unit_property_set_map: Mapping[str, FrozenSet[str]] = field(default_factory=_empty_mapping)
+    unit_scale_set_map: Mapping[str, FrozenSet[str]] = field(default_factory=_empty_mapping)
+    system_set: FrozenSet[str] = frozenset()
+    method_set: FrozenSet[str] = frozenset()
+    cui_component_map: Mapping[int, FrozenSet[str]] = field(default_factory=_empty_mapping)
+    method_qualified_cui_set: FrozenSet[int] = frozenset()
+    loinc_snapshot: Optional[LoincMasterSnapshot] = None
+    radiology_cui_mapping_index: Optional[RadiologyCuiMappingIndex] = None
+    radiology_term_mapping_index: Optional[RadiologyTermMappingIndex] = None
+    bilateral_cui_set: Optional[BilateralCuiSet] = None
+    component_alias_map: Mapping[str, str] = field(default_factory=_empty_mapping)
+    # Release tag of the LOINC tables, the persisted resolutions are tagged with it.
+    release: Optional[str] = None
+    load_errors: Tuple[str, ...] = field(default_factory=tuple)
+
+
+def normalize_component(component: str) -> str:
+    """
+    Key of a component in the component alias map: lower cased, with the
+    whitespace collapsed to single spaces.
+    """
+
+    return " ".join(component.lower().split())
+
+
+class ReferenceDataLoader:
+    def __init__(
+        self,
+        load_loinc_snapshot: bool = False,
+        bilateral_cui_set_path: str = None,
+        component_alias_path: str = None,
+        release: str = None,
+        release_checksum_enabled: bool = False,
+    ) -> None:
+        """
+        :param release: Fixed release tag of the LOINC tables, e.g. the LOINC version.
+        :param release_checksum_enabled: When no release is given, tags the reference
+            data with a checksum of the LOINC tables instead.
+        """
+
+        self.query_master = QueryMaster()
+        self.load_loinc_snapshot = load_loinc_snapshot
+        self.bilateral_cui_set_path = bilateral_cui_set_path
+        self.component_alias_path = component_alias_path
+        self.release = release
+        self.release_checksum_enabled = release_checksum_enabled
+
+    def load(self, connection, version: int) -> ReferenceData:
+        """
+        Reads all the reference tables. A table that fails to load is reported in
+        `load_errors` and left empty, like the services used to do.
+
+        :param connection: MySQL connection.
+        :param version: Version number of the new reference data.
+        :returns: The loaded reference data.
+        """
+
+        load_errors: List[str] = []
+
+        unit_property_set_map: Dict[str, Set[str]] = dict()
+        unit_scale_set_map: Dict[str, Set[str]] = dict()
+        system_set: Set[str] = set()
+        method_set: Set[str] = set()
+        cui_component_map: Dict[int, Set[str]] = dict()
+        loinc_snapshot = None
+        radiology_cui_mapping_index = None
+        radiology_term_mapping_index = None
+        bilateral_cui_set = None
+        component_alias_map: Dict[str, str] = dict()
+        release = self.release
+
+        if not release and self.release_checksum_enabled:
+            try:
+                release = self._load_release_checksum(connection)
+            except Exception as err:
+                # Only the persistent cache needs the release, it stays disabled.
+                logging.error(f"==> Error while computing the LOINC release checksum : {err}")
+                release = None
+
+        for name, loader in (
+            (
+                "unit_to_property_and_scale_map",
+                lambda: self._load_unit_to_property_and_scale_map(
+                    connection, unit_property_set_map, unit_scale_set_map
+                ),
+            ),
+            (
+                "unique_system_and_method_set",
+                lambda: self._load_unique_system_and_method_set(
+                    connection, system_set, method_set
+                ),
+            ),
+            (
+                "cui_to_component_map",
+                lambda: self._load_cui_to_component_map(connection, cui_component_map),
+            ),
+        ):
+            try:
+                loader()
+            except Exception as err:
+                logging.error(f"==> Error while loading {name} : {err}")
+                load_errors.append(f"{name}: {err}")
+
+        try:
+            radiology_cui_mapping_index = RadiologyCuiMappingIndex.load(connection)
+        except Exception as err:
+            logging.error(f"==> Error while loading radiology_cui_mapping_index : {err}")
+            load_errors.append(f"radiology_cui_mapping_index: {err}")
+
+        try:
+            radiology_term_mapping_index = RadiologyTermMappingIndex.load(connection)
+        except Exception as err:
+            logging.error(f"==> Error while loading radiology_term_mapping_index : {err}")
+            load_errors.append(f"radiology_term_mapping_index: {err}")
+
+        if self.bilateral_cui_set_path is not None:
+            if os.path.exists(self.bilateral_cui_set_path):
+                try:
+                    bilateral_cui_set = BilateralCuiSet.load(self.bilateral_cui_set_path)
+                except Exception as err:
+                    logging.error(f"==> Error while loading bilateral_cui_set : {err}")
+                    load_errors.append(f"bilateral_cui_set: {err}")
+            else:
+                logging.warning(
+                    f"==> Bilateral CUI set not found at {self.bilateral_cui_set_path}, the UMLS table will be queried instead"
+                )
+
+        if self.component_alias_path is not None:
+            if os.path.exists(self.component_alias_path):
+                try:
+                    self._load_component_alias_map(
+                        self.component_alias_path, component_alias_map
+                    )
+                except Exception as err:
+                    logging.error(f"==> Error while loading component_alias_map : {err}")
+                    load_errors.append(f"component_alias_map: {err}")
+            else:
+                logging.warning(
+                    f"==> Component alias table not found at {self.component_alias_path}, the components are used as written"
+                )
+
+        if self.load_loinc_snapshot:
+            try:
+                loinc_snapshot = LoincMasterSnapshot.load(connection)
+            except Exception as err:
+                logging.error(f"==> Error while loading loinc_snapshot : {err}")
+                load_errors.append(f"loinc_snapshot: {err}")
+
+        return ReferenceData(
+            version=version,
+            loaded_at=time.time(),
+            unit_property_map=MappingProxyType(
+                {
+                    key: self._get_seperate_string(value)
+                    for key, value in unit_property_set_map.items()
+                }
+            ),
+            unit_scale_map=MappingProxyType(
+                {
+                    key: self._get_seperate_string(value)
+                    for key, value in unit_scale_set_map.items()
+                }
+            ),
+            unit_property_set_map=MappingProxyType(
+                {key: frozenset(value) for key, value in unit_property_set_map.items()}
+            ),
+            unit_scale_set_map=MappingProxyType(
+                {key: frozenset(value) for key, value in unit_scale_set_map.items()}
+            ),
+            system_set=frozenset(system_set),
+            method_set=frozenset(method_set),
+            cui_component_map=MappingProxyType(
+                {key: frozenset(value) for key, value in cui_component_map.items()}
+            ),
+            method_qualified_cui_set=frozenset(
+                int(single_cui) for single_cui in METHOD_QUALIFIED_CUIS.split(",")
+            ),
+            loinc_snapshot=loinc_snapshot,
+            radiology_cui_mapping_index=radiology_cui_mapping_index,
+            radiology_term_mapping_index=radiology_term_mapping_index,
+            bilateral_cui_set=bilateral_cui_set,
+            component_alias_map=MappingProxyType(component_alias_map),
+            release=release or None,
+            load_errors=tuple(load_errors),
+        )
+
+    def _load_unit_to_property_and_scale_map(
+        self,
+        connection,
+        unit_property_set_map: Dict[str, Set[str]],
+        unit_scale_set_map: Dict[str, Set[str]],
+    ):
+        """
+        Loads the unit to property and unit to scale dictionaries.
+
+        :param connection: MySQL connection.
+        :returns: None.
+        """
+
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(self.query_master.unit_to_property_and_scale_map_query)
+
+            for res in statement:
+                unit = res.get("example_units").strip().lower()
+                property = res.get("property").strip()
+                scale = res.get("scale_typ").strip()
+
+                unit_property_set_map.setdefault(unit, set()).add(property)
+                unit_scale_set_map.setdefault(unit, set()).add(scale)
+        finally:
+            statement.close()
+
+    def _load_cui_to_component_map(
+        self, connection, cui_component_map: Dict[int, Set[str]]
+    ):
+        """
+        Loads the cui_to_component dictionary.
+
+        :param connection: MySQL connection.
+        :returns: None.
+        """
+
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(self.query_master.component_to_cui_list_query)
+
+            for rs in statement:
+                component = rs.get("component").strip()
+                cuis = rs.get("cui_list")
+
+                component = component.replace("'", "\\'")
+                cuis = cuis.strip().replace("[", "").replace("]", "")
+
+                for cui in cuis.split(","):
+                    cui_component_map.setdefault(int(cui.strip()), set()).add(component)
+        finally:
+            statement.close()
+
+    def _load_unique_system_and_method_set(
+        self, connection, system_set: Set[str], method_set: Set[str]
+    ):
+        """
+        Loads the unique system and method sets.
+
+        :param connection: MySQL connection.
+        :returns: None.
+        """
+
+        statement1 = connection.cursor(dictionary=True)
+        try:
+            statement1.execute(self.query_master.unique_system_query)
+            for rs in statement1:
+                system_set.add(rs.get("system").lower())
+        finally:
+            statement1.close()
+
+        statement2 = connection.cursor(dictionary=True)
+        try:
+            statement2.execute(self.query_master.unique_method_query)
+            for rs in statement2:
+                method_set.add(rs.get("method_typ").lower())
+        finally:
+            statement2.close()
+
+    def _load_release_checksum(self, connection) -> str:
+        """
+        Computes the release tag of the LOINC tables.
+
+        :param connection: MySQL connection.
+        :returns: Checksum of the loinc and radiology mapping tables.
+        """
+
+        start = time.time()
+        statement = connection.cursor(dictionary=True)
+        try:
+            statement.execute(self.query_master.loinc_release_checksum_query)
+            checksums = sorted(
+                f"{res.get('Table')}:{res.get('Checksum')}" for res in statement
+            )
+        finally:
+            statement.close()
+
+        release = hashlib.sha1(";".join(checksums).encode("utf-8")).hexdigest()
+        logging.info(
+            f"==> LOINC release checksum {release} computed in {time.time() - start} secs"
+        )
+        return release
+
+    def _load_component_alias_map(
+        self, path: str, component_alias_map: Dict[str, str]
+    ):
+        """
+        Loads the component alias table, a CSV file with the columns "alias" and
+        "component".
+
+        :param path: Path of the CSV file.
+        :returns: None.
+        """
+
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                alias = (row.get("alias") or "").strip()
+                component = (row.get("component") or "").strip()
+                if alias == "" or component == "":
+                    continue
+                component_alias_map[normalize_component(alias)] = component
+
+        logging.info(
+            f"==> Loaded {len(component_alias_map)} component aliases from {path}"
+        )
+
+    def _get_seperate_string(self, set_item: Set[str]):
+        data = ""
+        for s in set_item:
+            data += "'" + s + "',"
+        data = data[0 : len(data) - 1]
+        return data
+
+
+class ReferenceDataRegistry:
+    """
+    Process-wide holder of the current ReferenceData. Loaded once at startup and
+    swapped atomically by `refresh`.
+    """
+
+    def __init__(
+        self,
+        load_loinc_snapshot: bool = False,
+        bilateral_cui_set_path: str = None,
+        component_alias_path: str = None,
+        release: str = None,
+        release_checksum_enabled: bool = False,
+    ) -> None:
+        self.loader = ReferenceDataLoader(
+            load_loinc_snapshot=load_loinc_snapshot,
+            bilateral_cui_set_path=bilateral_cui_set_path,
+            component_alias_path=component_alias_path,
+            release=release,
+            release_checksum_enabled=release_checksum_enabled,
+        )
+        self._lock = threading.Lock()
+        self._reference_data: ReferenceData = None
+
+    @property
+    def current(self) -> ReferenceData:
+        """
+        :returns: The reference data in use.
+        """
+
+        if self._reference_data is None:
+            raise RuntimeError("Reference data is not loaded, call refresh() first.")
+        return self._reference_data
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._reference_data is not None
+
+    def refresh(self, connection) -> ReferenceData:
+        """
+        Reloads every reference table and makes the new data current.
+
+        :param connection: MySQL connection.
+        :returns: The new reference data.
+        """
+
+        with self._lock:
+            version = 1 if self._reference_data is None else self._reference_data.version + 1
+            start = time.time()
+            reference_data = self.loader.load(connection, version=version)
+            self._reference_data = reference_data
+
+        logging.info(
+            f"==> Reference data version {version} loaded in {time.time() - start} secs, errors: {reference_data.load_errors}"
+        )
+        return reference_data
+
+    def stats(self) -> Dict:
+        """
+        :returns: Version, load errors and size of the tables of the current reference data.
+        """
+
+        reference_data = self._reference_data
+        if reference_data is None:
+            return {"loaded": False}
+
+        loinc_snapshot = reference_data.loinc_snapshot
+        radiology_cui_mapping_index = reference_data.radiology_cui_mapping_index
+        radiology_term_mapping_index = reference_data.radiology_term_mapping_index
+        bilateral_cui_set = reference_data.bilateral_cui_set
+
+        return {
+            "loaded": True,
+            "version": reference_data.version,
+            "loadedAt": reference_data.loaded_at,
+            "release": reference_data.release,
+            "errors": list(reference_data.load_errors),
+            "units": len(reference_data.unit_property_set_map),
+            "systems": len(reference_data.system_set),
+            "methods": len(reference_data.method_set),
+            "cuiComponents": len(reference_data.cui_component_map),
+            "componentAliases": len(reference_data.component_alias_map),
+            "loincSnapshot": (
+                {"rows": len(loinc_snapshot), "loadedAt": loinc_snapshot.loaded_at}
+                if loinc_snapshot is not None
+                else None
+            ),
+            "radiologyCuiMappingIndex": (
+                {
+                    "rows": radiology_cui_mapping_index.total_rows,
+                    "loadedAt": radiology_cui_mapping_index.loaded_at,
+                }
+                if radiology_cui_mapping_index is not None
+                else None
+            ),
+            "radiologyTermMappingIndex": (
+                {
+                    "rows": len(radiology_term_mapping_index.rows),
+                    "loadedAt": radiology_term_mapping_index.loaded_at,
+                }
+                if radiology_term_mapping_index is not None
+                else None
+            ),
+            "bilateralCuiSet": (
+                {"cuis": len(bilateral_cui_set)} if bilateral_cui_set is not None else None
+            ),
+        }
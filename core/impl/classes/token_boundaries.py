@@ -0,0 +1,55 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import List
+
+# Same characters as str.strip() (str.isspace).
+WHITESPACE_RUN = re.compile(r"\s+")
+
+
+class TokenBoundaries:
+    """
+    Token boundaries of a sentence, built once per sentence.
+
+    Keeps the offsets of the spaces and the runs of whitespace of the text, so the
+    number of tokens between two document offsets, as counted by
+    len(text[begin:end].strip().split(" ")), is a few binary searches instead of
+    a slice and a split.
+    """
+
+    def __init__(self, text: str, offset: int = 0) -> None:
+        """
+        :param text: Covered text of the sentence.
+        :param offset: Document offset of the first character of the text.
+        """
+
+        self.offset = offset
+        self.length = len(text)
+        self.spaces: List[int] = [i for i, char in enumerate(text) if char == " "]
+
+        self.run_begins: List[int] = []
+        self.run_ends: List[int] = []
+        for match in WHITESPACE_RUN.finditer(text):
+            self.run_begins.append(match.start())
+            self.run_ends.append(match.end())
+
+    def token_distance(self, begin: int, end: int) -> int:
+        """
+        :param begin: Document offset where the gap starts.
+        :param end: Document offset where the gap ends.
+        :returns: Number of space separated tokens of the stripped text between the offsets.
+        """
+
+        begin = min(max(begin - self.offset, 0), self.length)
+        end = min(max(end - self.offset, 0), self.length)
+
+        # Leading and trailing whitespace are stripped.
+        i = bisect_right(self.run_begins, begin) - 1
+        if i >= 0 and begin < self.run_ends[i]:
+            begin = self.run_ends[i]
+        i = bisect_right(self.run_begins, end - 1) - 1
+        if i >= 0 and end - 1 < self.run_ends[i]:
+            end = self.run_begins[i]
+
+        if end <= begin:
+            return 1
+        return 1 + bisect_left(self.spaces, end) - bisect_left(self.spaces, begin)
@@ -1,8 +1,66 @@
 from .classes.core_dto import *
-from typing import Dict, List, Set
+from .classes.interval_index import IntervalIndex
+from typing import Dict, Iterable, List, Set
+
+
+def parse_umls_ids(values: Iterable[str], prefix: str) -> List[int]:
+    """
+    Parses UMLS identifiers of the form "C0011847" (or "T116, T123") to their
+    numerical part.
+
+    :param values: Identifiers, each value may hold several comma separated ones.
+    :param prefix: Prefix of the identifiers, "C", "T" or "S".
+    :returns: Numerical parts in the order of the values.
+    """
+
+    ids = []
+    for value in values:
+        for it in value.split(","):
+            ids.append(int(it.strip().split(prefix)[-1]))
+    return ids
 
 
 class CoreServiceImplementation:
+    def get_parsed_entities(self, cDoc) -> List[ParsedEntity]:
+        """
+        Normalization stage of a document, parses the offsets and the CUI/TUI/SUI
+        strings of every entity once for all the passes.
+
+        :param cDoc: NER Json data.
+        :returns: Parsed entities in the order of the "entities" key.
+        """
+
+        parsed_entities = []
+        for entity in cDoc["entities"]:
+            cuis = []
+            tuis = []
+            suis = []
+            for it in entity["metadata"]["normalization"]:
+                cuis += parse_umls_ids(it["cuis"], "C")
+                tuis += parse_umls_ids(it["tuis"], "T")
+                suis += parse_umls_ids(it["suis"], "S")
+
+            begins = tuple(int(it["begin"]) for it in entity["textSpan"])
+            ends = tuple(int(it["end"]) for it in entity["textSpan"])
+
+            parsed_entities.append(
+                ParsedEntity(
+                    id=int(entity["id"]),
+                    entity_type=entity["type"],
+                    begin=begins[0],
+                    end=ends[-1],
+                    begins=begins,
+                    ends=ends,
+                    texts=tuple(it["text"] for it in entity["textSpan"]),
+                    cuis=tuple(cuis),
+                    tuis=tuple(tuis),
+                    suis=tuple(suis),
+                    entity=entity,
+                )
+            )
+
+        return parsed_entities
+
     def get_status_data(self, cDoc) -> Dict[Span, int]:
         status_boundary_to_span_status = {}
         if "status" in cDoc.keys():
@@ -42,48 +100,49 @@ class CoreServiceImplementation:
 
         return sec_beg_end_to_name
 
-    def get_crf_entity_data(self, cDoc) -> Dict[Span, CRFEntityMention]:
+    def get_crf_entity_data(
+        self, cDoc, parsed_entities: List[ParsedEntity] = None
+    ) -> Dict[Span, CRFEntityMention]:
         """
         Get the Entity Data and fill then into the class CRFEntityMention.
 
         :param cDoc: NER Json data.
+        :param parsed_entities: Output of get_parsed_entities, computed if not given.
         :returns: Dictionary with key as the Span and the item being the Entity. 
         """
 
+        if parsed_entities is None:
+            parsed_entities = self.get_parsed_entities(cDoc)
+
         crf_beg_end_to_crf_mention: Dict[Span, CRFEntityMention] = dict()
 
+        token_index = IntervalIndex(
+            (int(token["begin"]), int(token["end"]), token)
+            for token in cDoc["contextTokens"]
+        )
+
         # Iterate through all the entities in the "entities" key in cDoc
-        for entity in cDoc["entities"]:
-            cui_list = []
-            for it in entity["metadata"]["normalization"]:
-                for cui in it["cuis"]:
-                    cui_list += [int(c.strip().split("C")[1]) for c in cui.split(",")]
-            tui_list = []
-            for it in entity["metadata"]["normalization"]:
-                for tui in it["tuis"]:
-                    tui_list += [int(t.strip().split("T")[1]) for t in tui.split(",")]
-            sui_list = []
-            for it in entity["metadata"]["normalization"]:
-                for sui in it["suis"]:
-                    sui_list += [int(s.strip().split("S")[1]) for s in sui.split(",")]
+        for parsed_entity in parsed_entities:
+            entity = parsed_entity.entity
             crf_entity = CRFEntityMention(
-                id=int(entity["id"]),
-                begin=[int(it["begin"]) for it in entity["textSpan"]][0],
-                end=[int(it["end"]) for it in entity["textSpan"]][-1],
-                entity_type=entity["type"],
+                id=parsed_entity.id,
+                begin=parsed_entity.begin,
+                end=parsed_entity.end,
+                entity_type=parsed_entity.entity_type,
                 confidence=float(entity["confidence"]),
                 status=entity["status"],
-                cui_list=cui_list,
-                sui_list=sui_list,
-                tui_list=tui_list,
+                cui_list=parsed_entity.cuis,
+                sui_list=parsed_entity.suis,
+                tui_list=parsed_entity.tuis,
                 # unit_list=[it for it in entity["metadata"]["drugData"]["unit"]],
                 # dosage_list=[it for it in entity["metadata"]["drugData"]["dose"]],
                 # freq_list=[it for it in entity["metadata"]["drugData"]["frequency"]],
                 # form_list=[it for it in entity["metadata"]["drugData"]["form"]],
                 # strength_list=[it for it in entity["metadata"]["drugData"]["strength"]],
-                method_list=[it for it in entity["metadata"]["labData"]["method"]],
-                system_list=[it for it in entity["metadata"]["labData"]["system"]],
-                value_list=[it for it in entity["metadata"]["labData"]["value"]],
+                # Shared with the NER output, the lists are only read.
+                method_list=entity["metadata"]["labData"]["method"],
+                system_list=entity["metadata"]["labData"]["system"],
+                value_list=entity["metadata"]["labData"]["value"],
             )
 
             modality_list = []
@@ -91,20 +150,19 @@ class CoreServiceImplementation:
             pharmaceutical_list = []
             radiologyroute_list = []
             unit_list = []
-            for token in cDoc["contextTokens"]:
-                if int(token["begin"]) <= crf_entity.begin and crf_entity.end < int(
-                    token["end"]
-                ):
-                    if token["type"] == "ModalityToken":
-                        modality_list.append(token)
-                    elif token["type"] == "ViewToken":
-                        view_list.append(token)
-                    elif token["type"] == "PharmaceuticalToken":
-                        pharmaceutical_list.append(token)
-                    elif token["type"] == "RadiologyrouteToken":
-                        radiologyroute_list.append(token)
-                    elif token["type"] == "UnitToken":
-                        unit_list.append(token)
+            for token in token_index.enclosing(
+                crf_entity.begin, crf_entity.end, strict_end=True
+            ):
+                if token["type"] == "ModalityToken":
+                    modality_list.append(token)
+                elif token["type"] == "ViewToken":
+                    view_list.append(token)
+                elif token["type"] == "PharmaceuticalToken":
+                    pharmaceutical_list.append(token)
+                elif token["type"] == "RadiologyrouteToken":
+                    radiologyroute_list.append(token)
+                elif token["type"] == "UnitToken":
+                    unit_list.append(token)
 
             crf_entity.modality_list = modality_list
             crf_entity.view_list = view_list
@@ -118,20 +176,31 @@ class CoreServiceImplementation:
 
         return crf_beg_end_to_crf_mention
 
-    def get_entity_mention_data(self, cDoc) -> Dict[Sentence, Set[EntityMentionDto]]:
+    def get_entity_mention_data(
+        self, cDoc, parsed_entities: List[ParsedEntity] = None
+    ) -> Dict[Sentence, Set[EntityMentionDto]]:
         """
         Get the entity data from sentence level. 
 
         :param cDoc: NER JSON data.
+        :param parsed_entities: Output of get_parsed_entities, computed if not given.
         :returns: Dictionary with key being the sentence and the values being the entities present in the sentence. 
         """
 
+        if parsed_entities is None:
+            parsed_entities = self.get_parsed_entities(cDoc)
+
         document = cDoc["content"]
         sent_entity_mention_map = {}
         entity_mention_dto_set = set()
 
         sentence_list = cDoc["sentences"]
 
+        entity_index = IntervalIndex(
+            (parsed_entity.begin, parsed_entity.end, parsed_entity)
+            for parsed_entity in parsed_entities
+        )
+
         for sent in sentence_list:
             sent_obj = Sentence(
                 begin=int(sent["begin"]),
@@ -139,7 +208,7 @@ class CoreServiceImplementation:
                 sentence_num=int(sent["id"]),
             )
             ent_mention = self.get_entity_mention_of_sentence(
-                sent_obj, cDoc["entities"]
+                sent_obj, parsed_entities, entity_index
             )
             sent_wise_entity_mention_dto = set()
 
@@ -154,60 +223,40 @@ class CoreServiceImplementation:
         return sent_entity_mention_map
 
     def get_entity_mention_of_sentence(
-        self, sentence_ent: Sentence, all_entities
+        self,
+        sentence_ent: Sentence,
+        all_entities: List[ParsedEntity],
+        entity_index: IntervalIndex = None,
     ) -> Set[EntityMentionDto]:
         """
         Get the entites in a sentence. 
 
         :param sentence_ent: Current sentence being processed.
+        :param all_entities: Parsed entities of the document.
+        :param entity_index: Interval index of the entities, used to only look at the entities inside the sentence.
         :returns: All the entities in the present sentence. 
         """
 
-        # Entity List should be : "entities"
-
         sent_begin = sentence_ent.begin
         sent_end = sentence_ent.end
-        sent_id = sentence_ent.sentence_num
 
         em_set = set()
 
-        for entity in all_entities:
-            ent_begin = [int(it["begin"]) for it in entity["textSpan"]][0]
-            ent_end = [int(it["end"]) for it in entity["textSpan"]][-1]
-            if sent_begin <= ent_begin and ent_end < sent_end:
-                begin_lst = [int(it["begin"]) for it in entity["textSpan"]]
-                end_lst = [int(it["end"]) for it in entity["textSpan"]]
-                text_set = [it["text"] for it in entity["textSpan"]]
-                cui_list = []
-                for it in entity["metadata"]["normalization"]:
-                    for cui in it["cuis"]:
-                        cui_list += [
-                            int(c.strip().split("C")[1]) for c in cui.split(",")
-                        ]
-                tui_list = []
-                for it in entity["metadata"]["normalization"]:
-                    for tui in it["tuis"]:
-                        tui_list += [
-                            int(t.strip().split("T")[1]) for t in tui.split(",")
-                        ]
-                sui_list = []
-                for it in entity["metadata"]["normalization"]:
-                    for sui in it["suis"]:
-                        sui_list += [
-                            int(s.strip().split("S")[1]) for s in sui.split(",")
-                        ]
-                id = entity["id"]
-                possible_types = [entity["type"]]
+        if entity_index is not None:
+            all_entities = entity_index.enclosed(sent_begin, sent_end, strict_end=True)
 
+        for parsed_entity in all_entities:
+            if sent_begin <= parsed_entity.begin and parsed_entity.end < sent_end:
+                # The parsed values are shared, no consumer modifies them.
                 new_ent = EntityMentionDto(
-                    id=id,
-                    begin_set=begin_lst,
-                    end_set=end_lst,
-                    text_set=text_set,
-                    cui_set=cui_list,
-                    tui_set=tui_list,
-                    sui_set=sui_list,
-                    possible_entity_type_set=possible_types,
+                    id=parsed_entity.id,
+                    begin_set=parsed_entity.begins,
+                    end_set=parsed_entity.ends,
+                    text_set=parsed_entity.texts,
+                    cui_set=parsed_entity.cuis,
+                    tui_set=parsed_entity.tuis,
+                    sui_set=parsed_entity.suis,
+                    possible_entity_type_set=[parsed_entity.entity_type],
                 )
 
                 em_set.add(new_ent)
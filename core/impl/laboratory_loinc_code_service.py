@@ -1,8 +1,12 @@
 import copy
 import logging
-from typing import Dict, List, Set
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Set
 
-from .classes.cache import LaboratoryLoincCodeCache
+from .classes.cache import (
+    LaboratoryLoincCodeCache,
+    LaboratoryLoincCodeCacheDto,
+    LaboratoryLoincLookup,
+)
 from .classes.loinc_classes import (
     LoincCodeBean,
     LoincComponent,
@@ -11,142 +15,54 @@ from .classes.loinc_classes import (
     LoincUnit,
     TextSpan,
 )
+from .classes.loinc_snapshot import LoincMasterSnapshot
 from .classes.my_sql import QueryMaster, QueryMySQL
+from .classes.reference_data import ReferenceData
 
 
 class LaboratoryLoincCodeService:
-    def __init__(self, connection) -> None:
+    # Maximum number of components of a query of _find_loinc_codes_bulk.
+    BULK_QUERY_COMPONENTS = 500
+
+    def __init__(
+        self,
+        connection,
+        reference_data: ReferenceData,
+        laboratory_loinc_code_cache: LaboratoryLoincCodeCache = None,
+    ) -> None:
         self.query_master: QueryMaster = QueryMaster()
         self.query_my_sql: QueryMySQL = QueryMySQL(connection=connection)
 
-        self.unit_property_map: Dict[str, str] = dict()
-        self.unit_scale_map: Dict[str, str] = dict()
-        self.system_set: Set[str] = set()
-        self.method_set: Set[str] = set()
-        self.cui_component_map: Dict[int, Set[str]] = dict()
-
-        self.laboratory_loinc_code_cache = LaboratoryLoincCodeCache()
-
-        self.init_loinc_service(connection=connection)
-
-    def init_loinc_service(self, connection):
-        """
-        Initializes certain functions that will be required to proccess Laboratory Loinc Codes.
-
-        :param connection: MySQL connection.
-        :returns: None.
-        """
-        try:
-            self._load_unit_to_property_and_scale_map(connection)
-            self._load_unique_system_and_method_set(connection)
-            self._load_cui_to_component_map(connection)
-        except Exception as err:
-            logging.info(f"==> Error : {err}")
-            return
-
-    def _load_unit_to_property_and_scale_map(self, connection):
-        """
-        Loads the unit_to_property_and_scale dictionary.
-
-        :param connection: MySQL connection.
-        :returns: None.
-        """
-        statement = connection.cursor(dictionary=True)
-
-        unit_property_set_map = dict()
-        unit_scale_set_map = dict()
-
-        try:
-            statement.execute(self.query_master.unit_to_property_and_scale_map_query)
-
-            for res in statement:
-                unit = res.get("example_units").strip().lower()
-                property = res.get("property").strip()
-                scale = res.get("scale_typ").strip()
-
-                if unit in unit_property_set_map.keys():
-                    unit_property_set_map[unit].add(property)
-                else:
-                    property_set = set()
-                    property_set.add(property)
-                    unit_property_set_map[unit] = property_set
-
-                if unit in unit_scale_set_map.keys():
-                    unit_scale_set_map[unit].add(scale)
-                else:
-                    scale_set = set()
-                    scale_set.add(scale)
-                    unit_scale_set_map[unit] = scale_set
-
-            for key, value in unit_property_set_map.items():
-                self.unit_property_map.update({key: self._get_seperate_string(value)})
-
-            for key, value in unit_scale_set_map.items():
-                self.unit_scale_map.update({key: self._get_seperate_string(value)})
-
-            statement.close()
-
-        except Exception as err:
-            statement.close()
-            return
-
-    def _load_cui_to_component_map(self, connection):
-        """
-        Loads the cui_to_component dictionary.
-
-        :param connection: MySQL connection.
-        :returns: None.
-        """
-        statement = connection.cursor(dictionary=True)
-
-        statement.execute(self.query_master.component_to_cui_list_query)
-
-        for rs in statement:
-            component = rs.get("component").strip()
-            cuis = rs.get("cui_list")
-
-            component = component.replace("'", "\\'")
-            cuis = cuis.strip().replace("[", "").replace("]", "")
-            cui_list = cuis.split(",")
-
-            for cui in cui_list:
-                cui = cui.strip()
-                cui_int = int(cui)
-                if cui_int in self.cui_component_map.keys():
-                    self.cui_component_map[cui_int].add(component)
-                else:
-                    component_set = set()
-                    component_set.add(component)
-                    self.cui_component_map.update({cui_int: component_set})
+        self.init_loinc_service(reference_data)
 
-        statement.close()
+        if laboratory_loinc_code_cache is None:
+            laboratory_loinc_code_cache = LaboratoryLoincCodeCache()
+        self.laboratory_loinc_code_cache = laboratory_loinc_code_cache
 
-    def _load_unique_system_and_method_set(self, connection):
+    def init_loinc_service(self, reference_data: ReferenceData):
         """
-        Loads the unique_system_and_method dictionary.
+        Initializes the reference data that will be required to proccess Laboratory Loinc Codes.
 
-        :param connection: MySQL connection.
+        :param reference_data: Reference data loaded at startup.
         :returns: None.
         """
 
-        try:
-            statement1 = connection.cursor(dictionary=True)
-            statement1.execute(self.query_master.unique_system_query)
-            for rs in statement1:
-                system = rs.get("system")
-                self.system_set.add(system.lower())
+        self.reference_data = reference_data
+        self.loinc_snapshot: LoincMasterSnapshot = reference_data.loinc_snapshot
 
-            statement1.close()
-
-            statement2 = connection.cursor(dictionary=True)
-            statement2.execute(self.query_master.unique_method_query)
-            for rs in statement2:
-                method = rs.get("method_typ")
-                self.method_set.add(method.lower())
-
-            statement2.close()
-        except Exception as err:
-            return
+        self.unit_property_map: Mapping[str, str] = reference_data.unit_property_map
+        self.unit_scale_map: Mapping[str, str] = reference_data.unit_scale_map
+        self.unit_property_set_map: Mapping[str, FrozenSet[str]] = (
+            reference_data.unit_property_set_map
+        )
+        self.unit_scale_set_map: Mapping[str, FrozenSet[str]] = (
+            reference_data.unit_scale_set_map
+        )
+        self.system_set: FrozenSet[str] = reference_data.system_set
+        self.method_set: FrozenSet[str] = reference_data.method_set
+        self.cui_component_map: Mapping[int, FrozenSet[str]] = (
+            reference_data.cui_component_map
+        )
 
     def start_suggesting_code(
         self,
@@ -172,119 +88,330 @@ class LaboratoryLoincCodeService:
 
         code_bean = LoincCodeBean()
 
-        if component_bean is not None:
-            component = component_bean.timex_value
-            new_component = component.replace("'", "\\'")
+        lookups = self.get_lookups(
+            component_bean, unit_bean, system_beans, time, method_beans
+        )
+        if len(lookups) == 0:
+            return code_bean
+
+        property = self._get_property_from_unit(unit_bean)
+        present_systems = lookups[0].present_systems
+        present_methods = lookups[0].present_methods
+
+        loinc_code_beans = self._get_loinc_code_beans(lookups[0])
+        if len(loinc_code_beans) != 0:
+            logging.info(f"==> Loinc codes found !, extracting evidence and returning 1st item: {loinc_code_beans}")
+            code_bean = copy.deepcopy(loinc_code_beans[0])
+            self._extract_evidence_from_query(
+                code_bean,
+                component_bean,
+                unit_bean,
+                property,
+                present_systems,
+                present_methods,
+            )
 
-            component_set = set()
-            component_set.add(new_component)
+        else:
+            logging.info(f"==> Loinc code not found, trying other methods ...")
+            # The components of the CUIs are all tried, the last one found is kept.
+            for lookup in lookups[1:]:
+                loinc_code_beans = self._get_loinc_code_beans(lookup)
+                if len(loinc_code_beans) != 0:
+                    logging.info(f"==> Loinc codes found !, extracting evidence and returning 1st item: {loinc_code_beans}")
+                    code_bean = copy.deepcopy(loinc_code_beans[0])
+                    self._extract_evidence_from_query(
+                        code_bean,
+                        component_bean,
+                        unit_bean,
+                        property,
+                        present_systems,
+                        present_methods,
+                    )
+                else : 
+                    logging.info(f"==>Loinc codes not found.")
 
-            property = self._get_property_from_unit(unit_bean)
-            present_systems = self._get_present_system(system_beans)
-            time = self._get_time_from_time(time)
-            scale = self._get_scale_from_unit(unit_bean)
-            present_methods = self._get_present_method(method_beans)
+        return code_bean
 
-            system = self._get_seperate_string_from_system(present_systems)
-            method = self._get_seperate_string_from_method(present_methods)
+    def get_lookups(
+        self,
+        component_bean: LoincComponent,
+        unit_bean: LoincUnit,
+        system_beans: List[LoincSystem],
+        time: str,
+        method_beans: List[LoincMethod],
+    ) -> List[LaboratoryLoincLookup]:
+        """
+        Gets the lookups of an entity, in the order start_suggesting_code tries them.
 
+        :param component_bean: Bean containing the component details.
+        :param unit_bean : Unit bean of that component.
+        :param system_beans : System beans of that component.
+        :param time : The provided time component for the entity.
+        :param method_beans : The provided method beans of the entity.
 
-            loinc_code_beans = []
-            loinc_code_beans = (
-                self.laboratory_loinc_code_cache.check_cache_is_available(
-                    component_set,
-                    property,
-                    present_systems,
-                    time,
-                    scale,
-                    present_methods,
+        :returns: The lookup of the component, then the lookups of the components of its CUIs.
+        """
+
+        if component_bean is None:
+            return []
+
+        component = component_bean.timex_value
+        new_component = component.replace("'", "\\'")
+
+        present_systems = self._get_present_system(system_beans)
+        time = self._get_time_from_time(time)
+        present_methods = self._get_present_method(method_beans)
+
+        property_set = self._get_property_set_from_unit(unit_bean)
+        scale_set = self._get_scale_set_from_unit(unit_bean)
+
+        lookups = []
+        component_sets = [{new_component}]
+        for cui in component_bean.cui_set or []:
+            cui = int(cui)
+            if cui in self.cui_component_map.keys():
+                component_sets.append(self.cui_component_map[cui])
+
+        for component_set in component_sets:
+            lookups.append(
+                LaboratoryLoincLookup(
+                    cache_dto=self.laboratory_loinc_code_cache.get_laboratory_loinc_code_cache_dto(
+                        component_set,
+                        property_set,
+                        present_systems,
+                        time,
+                        scale_set,
+                        present_methods,
+                    ),
+                    component_set=component_set,
+                    unit_bean=unit_bean,
+                    present_systems=present_systems,
+                    time=time,
+                    present_methods=present_methods,
                 )
             )
+
+        return lookups
+
+    def _get_loinc_code_beans(self, lookup: LaboratoryLoincLookup) -> List[LoincCodeBean]:
+        """
+        Gets the code beans of a lookup from the cache, or finds and caches them.
+        """
+
+        loinc_code_beans = self.laboratory_loinc_code_cache.get(
+            lookup.cache_dto,
+            version=self.reference_data.version,
+            release=self.reference_data.release,
+        )
+        if loinc_code_beans is None:
+            logging.info(f"==> Query Details = Component: {lookup.component_set}, unit: {lookup.unit_bean}, present_systems: {lookup.present_systems}, present_methods: {lookup.present_methods}, time: {lookup.time}")
+            loinc_code_beans = self._find_loinc_codes(
+                lookup.component_set,
+                lookup.unit_bean,
+                lookup.present_systems,
+                lookup.time,
+                lookup.present_methods,
+            )
+            self.laboratory_loinc_code_cache.put(
+                lookup.cache_dto,
+                loinc_code_beans,
+                version=self.reference_data.version,
+                release=self.reference_data.release,
+            )
+
+        return loinc_code_beans
+
+    def resolve_lookups(
+        self, lookup_chains: Iterable[List[LaboratoryLoincLookup]]
+    ) -> Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]]:
+        """
+        Resolves the lookups of many entities at once, each distinct signature is
+        resolved a single time and added to the cache. The signatures already in
+        the cache are not resolved again. The CUI lookups of an entity are only
+        resolved when its component lookup finds nothing, as in
+        start_suggesting_code.
+
+        :param lookup_chains: Lookups of every entity, as returned by get_lookups.
+        :returns: The best ranked code bean (or none) of every signature of the entities.
+        """
+
+        chains = {}
+        for lookups in lookup_chains:
+            if len(lookups) != 0:
+                chains.setdefault(tuple(it.cache_dto for it in lookups), lookups)
+
+        resolved: Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]] = dict()
+        found: Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]] = dict()
+
+        primary_lookups = {it[0].cache_dto: it[0] for it in chains.values()}
+        found.update(self._find_uncached_loinc_codes(primary_lookups, resolved))
+
+        fallback_lookups = dict()
+        for lookups in chains.values():
+            if len(resolved[lookups[0].cache_dto]) == 0:
+                for lookup in lookups[1:]:
+                    if lookup.cache_dto not in resolved:
+                        fallback_lookups.setdefault(lookup.cache_dto, lookup)
+        found.update(self._find_uncached_loinc_codes(fallback_lookups, resolved))
+
+        for cache_dto, loinc_code_beans in found.items():
+            self.laboratory_loinc_code_cache.put(
+                cache_dto,
+                loinc_code_beans,
+                version=self.reference_data.version,
+                release=self.reference_data.release,
+            )
+
+        logging.info(
+            f"==> Resolved {len(resolved)} distinct laboratory signatures of {len(chains)} distinct entities, {len(found)} not cached"
+        )
+        return resolved
+
+    def _find_uncached_loinc_codes(
+        self,
+        lookups: Dict[LaboratoryLoincCodeCacheDto, LaboratoryLoincLookup],
+        resolved: Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]],
+    ) -> Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]]:
+        """
+        Adds the code beans of the lookups to resolved, from the cache or found in bulk.
+
+        :returns: The code beans found in bulk, the ones not cached.
+        """
+
+        uncached_lookups = []
+        for cache_dto, lookup in lookups.items():
+            loinc_code_beans = self.laboratory_loinc_code_cache.get(
+                cache_dto,
+                version=self.reference_data.version,
+                release=self.reference_data.release,
+            )
             if loinc_code_beans is None:
-                logging.info(f"==> Query Details = New_component: {new_component}, property: {property}, present_systems: {present_systems}, present_methods: {present_methods}, time: {time}, scale: {time}")
-                new_component = self._get_seperate_string(component_set)
-                query = self._generate_query(
-                    new_component, property, system, time, scale, method
+                uncached_lookups.append(lookup)
+            else:
+                resolved[cache_dto] = loinc_code_beans
+
+        found = self._find_loinc_codes_bulk(uncached_lookups)
+        resolved.update(found)
+        return found
+
+    def _find_loinc_codes_bulk(
+        self, lookups: List[LaboratoryLoincLookup]
+    ) -> Dict[LaboratoryLoincCodeCacheDto, List[LoincCodeBean]]:
+        """
+        Finds the best ranked code of many lookups. Without a snapshot, the lookups
+        sharing their property, system, time, scale and method are resolved by one
+        query over all their components, the first row of a lookup being the first
+        one of its components in rank order.
+
+        :param lookups: Lookups with distinct signatures.
+        :returns: The best ranked code bean (or none) of every lookup.
+        """
+
+        resolved = dict()
+        if self.loinc_snapshot is not None:
+            for lookup in lookups:
+                resolved[lookup.cache_dto] = self._find_loinc_codes(
+                    lookup.component_set,
+                    lookup.unit_bean,
+                    lookup.present_systems,
+                    lookup.time,
+                    lookup.present_methods,
                 )
-                logging.info(f"==> Query: {query}")
+            return resolved
+
+        groups: Dict[tuple, List[LaboratoryLoincLookup]] = dict()
+        for lookup in lookups:
+            query_filters = (
+                self._get_property_from_unit(lookup.unit_bean),
+                self._get_seperate_string_from_system(lookup.present_systems),
+                lookup.time,
+                self._get_scale_from_unit(lookup.unit_bean),
+                self._get_seperate_string_from_method(lookup.present_methods),
+            )
+            groups.setdefault(query_filters, []).append(lookup)
 
-                loinc_code_beans = self.query_my_sql.get_loinc_codes(query=query)
-                self.laboratory_loinc_code_cache.add_into_cache(
-                    loinc_code_beans,
-                    component_set,
+        for (property, system, time, scale, method), group in groups.items():
+            # A lookup is resolved by a single query, so that its first row is its best ranked one.
+            batches = [[]]
+            batch_components = set()
+            for lookup in group:
+                if (
+                    len(batches[-1]) != 0
+                    and len(batch_components | set(lookup.component_set))
+                    > self.BULK_QUERY_COMPONENTS
+                ):
+                    batches.append([])
+                    batch_components = set()
+                batches[-1].append(lookup)
+                batch_components.update(lookup.component_set)
+
+            for batch in batches:
+                components = sorted({it for lookup in batch for it in lookup.component_set})
+                query = self._generate_query(
+                    self._get_seperate_string(components),
                     property,
-                    present_systems,
+                    system,
                     time,
                     scale,
-                    present_methods,
+                    method,
                 )
+                loinc_code_beans = self.query_my_sql.get_loinc_codes(query=query)
 
-            if len(loinc_code_beans) != 0:
-                logging.info(f"==> Loinc codes found !, extracting evidence and returning 1st item: {loinc_code_beans}")
-                code_bean = copy.deepcopy(loinc_code_beans[0])
-                self._extract_evidence_from_query(
-                    code_bean,
-                    component_bean,
-                    unit_bean,
-                    property,
-                    present_systems,
-                    present_methods,
-                )
+                for lookup in batch:
+                    component_set = {
+                        LoincMasterSnapshot.normalize(it) for it in lookup.component_set
+                    }
+                    resolved[lookup.cache_dto] = [
+                        bean
+                        for bean in loinc_code_beans
+                        if LoincMasterSnapshot.normalize(bean.component) in component_set
+                    ][:1]
 
-            else:
-                logging.info(f"==> Loinc code not found, trying other methods ...")
-                component_cuis = component_bean.cui_set
-                if component_cuis is not None and len(component_cuis) > 0:
-                    for cui in component_cuis:
-                        cui = int(cui)
-                        if cui in self.cui_component_map.keys():
-                            component_set = self.cui_component_map[cui]
-                            loinc_code_beans = self.laboratory_loinc_code_cache.check_cache_is_available(
-                                component_set,
-                                property,
-                                present_systems,
-                                time,
-                                scale,
-                                present_methods,
-                            )
-
-                            if loinc_code_beans is None:
-                                new_component = self._get_seperate_string(component_set)
-                                logging.info(f"==> For CUI: {str(cui)}, Query Details = New_component: {new_component}, property: {property}, present_systems: {present_systems}, present_methods: {present_methods}, time: {time}, scale: {time}")
-                                query = self._generate_query(
-                                    new_component, property, system, time, scale, method
-                                )
-                                logging.info(f"==> Query: {query}")
-                                
-                                loinc_code_beans = self.query_my_sql.get_loinc_codes(
-                                    query=query
-                                )
-
-                                self.laboratory_loinc_code_cache.add_into_cache(
-                                    loinc_code_beans,
-                                    component_set,
-                                    property,
-                                    present_systems,
-                                    time,
-                                    scale,
-                                    present_methods,
-                                )
-
-                            if len(loinc_code_beans) != 0:
-                                logging.info(f"==> Loinc codes found !, extracting evidence and returning 1st item: {loinc_code_beans}")
-                                code_bean = copy.deepcopy(loinc_code_beans[0])
-                                self._extract_evidence_from_query(
-                                    code_bean,
-                                    component_bean,
-                                    unit_bean,
-                                    property,
-                                    present_systems,
-                                    present_methods,
-                                )
-                            else : 
-                                logging.info(f"==>Loinc codes not found.")
+        return resolved
 
-        return code_bean
+    def _find_loinc_codes(
+        self,
+        component_set: Set[str],
+        unit_bean: LoincUnit,
+        present_systems: List[LoincSystem],
+        time: str,
+        present_methods: List[LoincMethod],
+    ) -> List[LoincCodeBean]:
+        """
+        Finds the LOINC codes for the given attributes, from the in-memory snapshot
+        when one is loaded and from MySQL otherwise.
+
+        :param component_set: Set of components.
+        :param unit_bean: Unit bean.
+        :param present_systems: The systems that are found.
+        :param time: Present time.
+        :param present_methods: The methods that are found.
+
+        :returns: Loinc code beans, best ranked first.
+        """
+
+        if self.loinc_snapshot is not None:
+            return self.loinc_snapshot.find_codes(
+                component_set=component_set,
+                property_set=self._get_property_set_from_unit(unit_bean),
+                system_set=[it.timexValue for it in present_systems or []],
+                time=time,
+                scale_set=self._get_scale_set_from_unit(unit_bean),
+                method_set=[it.timexValue for it in present_methods or []],
+                limit=1,
+            )
+
+        query = self._generate_query(
+            self._get_seperate_string(component_set),
+            self._get_property_from_unit(unit_bean),
+            self._get_seperate_string_from_system(present_systems),
+            time,
+            self._get_scale_from_unit(unit_bean),
+            self._get_seperate_string_from_method(present_methods),
+        )
+        logging.info(f"==> Query: {query}")
+
+        return self.query_my_sql.get_loinc_codes(query=query)
 
     def _get_present_system(self, system_beans: List[LoincSystem]):
         """
@@ -344,6 +471,32 @@ class LaboratoryLoincCodeService:
             else None
         )
 
+    def _get_property_set_from_unit(self, unit_bean: LoincUnit):
+        """
+        Get the properties allowed for the unit bean.
+
+        :param unit_bean: Unit bean.
+        :returns: Returns the set of properties of the unit if it is present in the unit_property_set_map else None.
+        """
+
+        return (
+            self.unit_property_set_map.get(unit_bean.timexValue.strip().lower())
+            if unit_bean is not None
+            else None
+        )
+
+    def _get_scale_set_from_unit(self, unit_bean: LoincUnit):
+        """
+        Get the scales allowed for the unit bean.
+
+        :param unit_bean: Unit bean.
+        :returns: Returns the set of scales of the unit if it is present in the unit_scale_set_map else None.
+        """
+
+        if unit_bean is not None:
+            return self.unit_scale_set_map.get(unit_bean.timexValue.strip().lower())
+        return None
+
     def _get_scale_from_unit(self, unit_bean: LoincUnit):
         """
         Get the present scale from unit bean.
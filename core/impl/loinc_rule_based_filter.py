@@ -1,8 +1,12 @@
+from .classes.bilateral_cui_set import BilateralCuiSet, is_bilateral_text
 from .classes.core_dto import EntityMentionDto
 from .classes.my_sql import QueryMySQL
 
 
 class LoincRuleBasedFilter:
+    def __init__(self, bilateral_cui_set: BilateralCuiSet = None) -> None:
+        self.bilateral_cui_set = bilateral_cui_set
+
     def filter_cuis_of_bilateral(
         self, system_entity_mention_dto: EntityMentionDto, query_mysql: QueryMySQL
     ):
@@ -21,20 +25,17 @@ class LoincRuleBasedFilter:
         isBilateralFound = False
 
         for text in textSpanList:
-            text = text.lower()
-            if (
-                "bilateral" in text
-                or "bilaterally" in text
-                or "both" in text
-                or "b/l" in text
-            ):
+            if is_bilateral_text(text):
                 isBilateralFound = True
                 break
 
         if isBilateralFound:
             modifiedSystemCuiList = []
             for cui in systemCuiList:
-                is_found = query_mysql.check_bilateral_in_text(cui)
+                if self.bilateral_cui_set is not None:
+                    is_found = cui in self.bilateral_cui_set
+                else:
+                    is_found = query_mysql.check_bilateral_in_text(cui)
                 if is_found:
                     modifiedSystemCuiList.append(cui)
 
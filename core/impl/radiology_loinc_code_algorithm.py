@@ -1,42 +1,53 @@
-import copy
+import itertools
 import logging
-from typing import Dict, List, Set
+from typing import Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
+from .classes.bilateral_cui_set import BilateralCuiSet
 from .classes.core_dto import EntityMentionDto, TextSpan
 from .classes.my_sql import QueryMySQL
+from .classes.persistent_cache import PersistentResolutionCache
 from .classes.radiology_classes import (RadiologyComponentDto,
                                         RadiologyLoincCodeBean,
                                         RadiologyLoincPropertyDto,
                                         RadiologyMethodDto,
                                         RadiologyTermMappingTableDto)
+from .classes.radiology_index import (RadiologyCuiMappingIndex,
+                                      RadiologyTermMappingIndex)
 from .loinc_rule_based_filter import LoincRuleBasedFilter
 
 
 class RadiologyLoincCodeAlgorithm:
-    def __init__(self, connection) -> None:
+    def __init__(
+        self,
+        connection,
+        radiology_cui_mapping_index: RadiologyCuiMappingIndex = None,
+        radiology_term_mapping_index: RadiologyTermMappingIndex = None,
+        bilateral_cui_set: BilateralCuiSet = None,
+        persistent_cache: PersistentResolutionCache = None,
+        release: str = None,
+    ) -> None:
         self.query_my_sql = QueryMySQL(connection=connection)
-        self.loinc_rule_based_filter = LoincRuleBasedFilter()
+        self.persistent_cache = persistent_cache
+        # Release of the reference data of the request, the persisted resolutions are tagged with it.
+        self.release = release
+        self.loinc_rule_based_filter = LoincRuleBasedFilter(
+            bilateral_cui_set=bilateral_cui_set
+        )
+        self.radiology_cui_mapping_index = radiology_cui_mapping_index
+        self.radiology_term_mapping_index = radiology_term_mapping_index
 
-    def get_combination(self, lisOfList):
-        allCombinationList = []
-        self.generateValues(lisOfList, "", allCombinationList)
-        return allCombinationList
+    def get_combination(
+        self, lisOfList: Sequence[Sequence[int]]
+    ) -> Iterator[Tuple[int, ...]]:
+        """
+        Lazily generates the CUI combinations, one CUI of every list, in priority
+        order: the first CUI of the first list with every CUI of the next ones first.
 
-    def generateValues(
-        self, outerList: List[List[int]], outPut: str, allCombinationList: List[str]
-    ):
-        lst = next(iter(outerList))
-        for s in lst:
-            newOuter = copy.deepcopy(outerList)
-            if lst in outerList:
-                newOuter.remove(lst)
-            if len(outerList) > 1:
-                self.generateValues(
-                    newOuter, (outPut + " " + str(s)).strip(), allCombinationList
-                )
-            else:
-                lemmaValues = (outPut + " " + str(s)).strip()
-                allCombinationList.append(lemmaValues)
+        :param lisOfList: CUI lists, e.g. [method CUIs, system CUIs].
+        :returns: Iterator over the CUI tuples, the caller stops at the first match.
+        """
+
+        return itertools.product(*lisOfList)
 
     def get_radiology_loinc_code(
         self, radiology_method_dto: RadiologyMethodDto
@@ -64,17 +75,15 @@ class RadiologyLoincCodeAlgorithm:
             outer_cui_list.append(system_cui_list)
 
             combination_ofcui_list = self.get_combination(outer_cui_list)
-            logging.info(f"==> Combination of Cui List : {combination_ofcui_list}")
-
-            for cui_pair in combination_ofcui_list:
-                cui_list = []
-                for single_cui in cui_pair.split(" "):
-                    cui_list.append(int(single_cui))
+            logging.info(
+                f"==> Combinations of Cui Lists : {method_cui_list} x {system_cui_list}"
+            )
 
-                cui_map_id_list = self.get_map_id_from_radiology_cui_mapping(cui_list)
-                if len(cui_map_id_list) != 0:
-                    system_entity_mention = radiology_system_dto.entity_mention_dto
-                    break
+            cui_map_id_list = self.get_map_id_of_first_matching_combination(
+                combination_ofcui_list
+            )
+            if len(cui_map_id_list) != 0:
+                system_entity_mention = radiology_system_dto.entity_mention_dto
 
             if len(cui_map_id_list) != 0:
                 break
@@ -90,6 +99,40 @@ class RadiologyLoincCodeAlgorithm:
 
         return radiology_loinc_code_list
 
+    def get_map_id_of_first_matching_combination(
+        self, combination_ofcui_list: Iterable[Sequence[int]]
+    ):
+        """
+        Gets the map_ids of the first CUI combination found in radiology_cui_mapping.
+
+        :param combination_ofcui_list: CUI combinations in priority order, consumed
+            only up to the first match.
+        :returns: map_ids of the first matching combination, empty if none match.
+        """
+
+        if self.radiology_cui_mapping_index is not None:
+            _, cui_map_id_list = self.radiology_cui_mapping_index.find_map_ids(
+                combination_ofcui_list
+            )
+            return cui_map_id_list
+
+        for cui_list in combination_ofcui_list:
+            cui_map_id_list = None
+            if self.persistent_cache is not None:
+                cui_map_id_list = self.persistent_cache.get_radiology_map_ids(
+                    cui_list, self.release
+                )
+            if cui_map_id_list is None:
+                cui_map_id_list = self.get_map_id_from_radiology_cui_mapping(cui_list)
+                if self.persistent_cache is not None:
+                    self.persistent_cache.put_radiology_map_ids(
+                        cui_list, cui_map_id_list, self.release
+                    )
+            if len(cui_map_id_list) != 0:
+                return cui_map_id_list
+
+        return []
+
     def get_map_id_from_radiology_cui_mapping(self, cui_list: List[int]):
         length = len(cui_list)
         cui_string = ""
@@ -126,14 +169,15 @@ class RadiologyLoincCodeAlgorithm:
 
         logging.info(f"==> Inside get_radiology_codes")
         try:
-            radiology_term_mapping_row_set: List[
-                RadiologyTermMappingTableDto
-            ] = self.get_all_term_mapping_from_cui_mapping(cui_map_id_list)
-            logging.info(f"==> radiology_term_mapping_row_set from CUI set: {radiology_term_mapping_row_set}")
-            
             all_components = self.get_all_components(radiology_component_dto)
             logging.info(f"==> All components: {all_components}")
 
+            (
+                radiology_term_mapping_row_set,
+                match_count_list,
+            ) = self.get_term_mapping_with_match_count(cui_map_id_list, all_components)
+            logging.info(f"==> radiology_term_mapping_row_set from CUI set: {radiology_term_mapping_row_set}")
+
             probable_outptu_dto: List[RadiologyTermMappingTableDto] = []
             cui_map_id_whiche_arefound_in_term_mapping = set()
 
@@ -142,7 +186,9 @@ class RadiologyLoincCodeAlgorithm:
             globalmiss_count = 9999999999
 
 
-            for table_dto in radiology_term_mapping_row_set:
+            for table_dto, match_count in zip(
+                radiology_term_mapping_row_set, match_count_list
+            ):
                 logging.info(f"==> Searching for Table Dto : {table_dto} in radiology_term_mapping_row_set")
                 cui_map_id_whiche_arefound_in_term_mapping.add(table_dto.map_id)
                 total_term_in_raw = table_dto.totalTerms
@@ -152,9 +198,6 @@ class RadiologyLoincCodeAlgorithm:
                     probable_outptu_dto.append(table_dto)
                     break
 
-                match_count = self.get_total_number_of_matched_term(
-                    table_dto, all_components
-                )
                 logging.info(f"==> Match count : {match_count}")
 
                 miss_count = total_term_in_raw - match_count
@@ -210,7 +253,7 @@ class RadiologyLoincCodeAlgorithm:
                         system_entity_mention,
                     )
                     code_bean = RadiologyLoincCodeBean(
-                        code=code, text_spans=evidence_list
+                        code=code, text_spans=evidenceList
                     )
                     radiology_loinc_code_list.add(code_bean)
 
@@ -220,6 +263,51 @@ class RadiologyLoincCodeAlgorithm:
         logging.info(f"==> Returning loinc code list : {radiology_loinc_code_list}")
         return radiology_loinc_code_list
 
+    def get_term_mapping_with_match_count(
+        self,
+        cui_map_id_list: List[str],
+        all_components: Dict[str, RadiologyLoincPropertyDto],
+    ) -> Tuple[List[RadiologyTermMappingTableDto], List[int]]:
+        """
+        Gets the radiology_term_mapping rows of the map_ids and the number of their
+        terms found in the components.
+
+        :param cui_map_id_list: map_ids found in radiology_cui_mapping.
+        :param all_components: Components of the method, keyed by lower cased text.
+        :returns: The rows in table order and the match count of every row.
+        """
+
+        if self.radiology_term_mapping_index is not None:
+            row_nums = self.radiology_term_mapping_index.get_row_nums(cui_map_id_list)
+            radiology_term_mapping_row_set = [
+                self.radiology_term_mapping_index.rows[row_num] for row_num in row_nums
+            ]
+            match_count_list = self.radiology_term_mapping_index.get_match_counts(
+                row_nums, all_components.keys()
+            ).tolist()
+            return radiology_term_mapping_row_set, match_count_list
+
+        radiology_term_mapping_row_set = None
+        if self.persistent_cache is not None:
+            radiology_term_mapping_row_set = (
+                self.persistent_cache.get_radiology_term_mapping(
+                    cui_map_id_list, self.release
+                )
+            )
+        if radiology_term_mapping_row_set is None:
+            radiology_term_mapping_row_set = self.get_all_term_mapping_from_cui_mapping(
+                cui_map_id_list
+            )
+            if self.persistent_cache is not None:
+                self.persistent_cache.put_radiology_term_mapping(
+                    cui_map_id_list, radiology_term_mapping_row_set, self.release
+                )
+        match_count_list = [
+            self.get_total_number_of_matched_term(table_dto, all_components)
+            for table_dto in radiology_term_mapping_row_set
+        ]
+        return radiology_term_mapping_row_set, match_count_list
+
     def get_all_term_mapping_from_cui_mapping(
         self, cui_map_id_list: List[str]
     ) -> List[RadiologyTermMappingTableDto]:
@@ -3,29 +3,37 @@ import logging
 from typing import Dict, List, Set
 
 from .classes.core_dto import *
+from .classes.interval_index import IntervalIndex
+from .classes.persistent_cache import PersistentResolutionCache
 from .classes.radiology_classes import *
+from .classes.reference_data import ReferenceData
+from .classes.token_boundaries import TokenBoundaries
 from .radiology_loinc_code_algorithm import RadiologyLoincCodeAlgorithm
 
 
 class RadiologyLoincCodeService:
-    def __init__(self, connection, attribute_loader) -> None:
+    def __init__(
+        self,
+        connection,
+        attribute_loader,
+        reference_data: ReferenceData,
+        persistent_cache: PersistentResolutionCache = None,
+    ) -> None:
         self.connection = connection
-        self.method_quilified_cui_list = set()
         self.radiology_loinc_algo = RadiologyLoincCodeAlgorithm(
-            connection=self.connection
+            connection=self.connection,
+            radiology_cui_mapping_index=reference_data.radiology_cui_mapping_index,
+            radiology_term_mapping_index=reference_data.radiology_term_mapping_index,
+            bilateral_cui_set=reference_data.bilateral_cui_set,
+            persistent_cache=persistent_cache,
+            release=reference_data.release,
         )
         self.attribute_loader: AttributeLoader = attribute_loader
+        self.init_radiology_loinc_service(reference_data)
 
-    def init_radiology_loinc_service(self):
-        try:
-            self.get_method_qualified_cui_list()
-        except Exception as err:
-            print(err)
-
-    def get_method_qualified_cui_list(self):
-        all_cuis = "41618,220934,1456803,1875843,2368378,243032,162481,34571,43309,1306645,1962945,3244296,24485,1552358,16356,40405,1552357,16356,34571,43309,1306645,1962945,3244296,10000553,10001564,34606,34607,2368359,3665374,10001564,34606,34607,2368359,3665374,40399,24671,260913,24671,260913,729296,1514967,40404,16356,16356,3463807,1510486,40405,1552357,31001,1536105,1441535,34571,43309,1306645,1962945,3244296,16356,16356,10000553,24487,34571,43309,1306645,1962945,3244296,729296,1514967,32743,376335,40405,1552357,31001,1536105,1441535,24671,260913,10002881,10001564,34606,34607,2368359,3665374,40399,40405,1552357,41618,220934,1456803,1875843,2368378,2748260,2367013,40405,1552357,11321,41618,220934,1456803,1875843,2368378,24671,260913,32743,31001,40405,1552357,1536105,1441535,40405,1552357,31001,1536105,1441535"
-        for single_cui in all_cuis.split(","):
-            self.method_quilified_cui_list.add(int(single_cui))
+    def init_radiology_loinc_service(self, reference_data: ReferenceData):
+        self.reference_data = reference_data
+        self.method_quilified_cui_list = reference_data.method_qualified_cui_set
 
     def find_radiology_loinc_code(
         self,
@@ -33,14 +41,25 @@ class RadiologyLoincCodeService:
         entity_mention_dto_set: Set[EntityMentionDto],
         crf_beg_end_to_crf_mention: Dict[Span, CRFEntityMention],
         radiology_loinc_code_bean_set: Set[RadiologyLoincCodeBean],
+        crf_span_index: IntervalIndex = None,
     ) -> Set[RadiologyLoincCodeBean]:
         
         # Sent should contain sentence begin and end and other details
+        # Shared by all the methods of the sentence, built with the first one.
+        anatomical_structure_list = None
+        token_boundaries = None
+
         for entity_mention_dto in entity_mention_dto_set:
             logging.info(f"==> Checking for entity: {entity_mention_dto}")
 
             if self.check_method_is_valid(entity_mention_dto):
 
+                if anatomical_structure_list is None:
+                    anatomical_structure_list = self.get_anatomical_structures(
+                        entity_mention_dto_set
+                    )
+                    token_boundaries = TokenBoundaries(sent.covered_text, sent.begin)
+
                 em_begin_list = entity_mention_dto.begin_set
                 em_end_list = entity_mention_dto.end_set
 
@@ -51,7 +70,7 @@ class RadiologyLoincCodeService:
                     emspan = Span(begin=begin, end=end)
                     crf_entity_mention = (
                         self.get_crf_entity_mention_from_entity_mention(
-                            emspan, crf_beg_end_to_crf_mention
+                            emspan, crf_beg_end_to_crf_mention, crf_span_index
                         )
                     )
 
@@ -63,7 +82,11 @@ class RadiologyLoincCodeService:
 
                 radiology_system_dto_list = (
                     self.get_all_anatomical_structure_with_distance(
-                        sent, entity_mention_dto_set, entity_mention_dto
+                        sent,
+                        entity_mention_dto_set,
+                        entity_mention_dto,
+                        anatomical_structure_list=anatomical_structure_list,
+                        token_boundaries=token_boundaries,
                     )
                 )
 
@@ -91,11 +114,23 @@ class RadiologyLoincCodeService:
         return radiology_loinc_code_bean_set
 
     def get_crf_entity_mention_from_entity_mention(
-        self, em_span: Span, crf_beg_end_to_crf_mention: Dict[Span, CRFEntityMention]
+        self,
+        em_span: Span,
+        crf_beg_end_to_crf_mention: Dict[Span, CRFEntityMention],
+        crf_span_index: IntervalIndex = None,
     ):
         if em_span in crf_beg_end_to_crf_mention.keys():
             return crf_beg_end_to_crf_mention.get(em_span)
 
+        if crf_span_index is not None:
+            # Items are (position in the dict, span), the first covering or covered span wins.
+            candidates = crf_span_index.enclosing(
+                em_span.begin, em_span.end
+            )[:1] + crf_span_index.enclosed(em_span.begin, em_span.end)[:1]
+            if len(candidates) == 0:
+                return None
+            return crf_beg_end_to_crf_mention.get(min(candidates)[1])
+
         for span in crf_beg_end_to_crf_mention.keys():
             if span.is_cover(em_span.begin, em_span.end) or em_span.is_cover(
                 span.begin, span.end
@@ -107,73 +142,88 @@ class RadiologyLoincCodeService:
 
         return None
 
+    def get_anatomical_structures(
+        self, entity_mention_dto_set: Set[EntityMentionDto]
+    ) -> List[EntityMentionDto]:
+        """
+        :param entity_mention_dto_set: Entities of a sentence.
+        :returns: The ANATOMICAL_STRUCTURE entities, in the iteration order of the set.
+        """
+
+        return [
+            sub_dto
+            for sub_dto in entity_mention_dto_set
+            if "ANATOMICAL_STRUCTURE" in sub_dto.possible_entity_type_set
+        ]
+
     def get_all_anatomical_structure_with_distance(
         self,
         sent: Sentence,
         entity_mention_dto_set: Set[EntityMentionDto],
         entity_mention_dto: EntityMentionDto,
+        anatomical_structure_list: List[EntityMentionDto] = None,
+        token_boundaries: TokenBoundaries = None,
     ) -> List[RadiologySystemDto]:
+        """
+        Gets the anatomical structures of the sentence with their min and max token
+        distance to the method.
+
+        :param sent: Sentence of the method.
+        :param entity_mention_dto_set: Entities of the sentence.
+        :param entity_mention_dto: Method entity.
+        :param anatomical_structure_list: Output of get_anatomical_structures, computed if not given.
+        :param token_boundaries: Token boundaries of the sentence, built if not given.
+        :returns: System dto of every anatomical structure other than the method.
+        """
+
         radiology_system_dto_tree_set = list()
-        sent_begin = sent.begin
-        sentence = sent.covered_text
+
+        if anatomical_structure_list is None:
+            anatomical_structure_list = self.get_anatomical_structures(
+                entity_mention_dto_set
+            )
+        if token_boundaries is None:
+            token_boundaries = TokenBoundaries(sent.covered_text, sent.begin)
 
         begin_list = entity_mention_dto.begin_set
         end_list = entity_mention_dto.end_set
 
-        for sub_dto in entity_mention_dto_set:
+        for sub_dto in anatomical_structure_list:
             if sub_dto == entity_mention_dto:
                 continue
-            entit_type_list = sub_dto.possible_entity_type_set
-            if "ANATOMICAL_STRUCTURE" in entit_type_list:
-                sub_begin_list = sub_dto.begin_set
-                sub_end_list = sub_dto.end_set
-
-                min_distance = 999999999
-                max_distance = 0
-
-                i = 0
-
-                for begin in begin_list:
-                    end = end_list[i]
-                    isub = 0
-                    for sub_begin in sub_begin_list:
-                        sub_end = sub_end_list[isub]
-
-                        if sub_end < begin:
-                            between_text = sentence[
-                                sub_end - sent_begin : begin - sent_begin
-                            ].strip()
-
-                            between_tokens = len(between_text.split(" "))
-                            if between_tokens < min_distance:
-                                min_distance = between_tokens
-                            if between_tokens > max_distance:
-                                max_distance = between_tokens
-
-                        elif sub_begin > end:
-                            between_text = sentence[
-                                end - sent_begin : sub_begin - sent_begin
-                            ].strip()
-                            between_tokens = len(between_text.split(" "))
-                            if between_tokens < min_distance:
-                                min_distance = between_tokens
-                            if between_tokens > max_distance:
-                                max_distance = between_tokens
-
-                        else:
-                            min_distance = 0
-
-                        isub += 1
-
-                    i += 1
-
-                radiologySystemDto = RadiologySystemDto(
-                    entity_mention_dto=sub_dto,
-                    max_distance=max_distance,
-                    min_distance=min_distance,
-                )
-
-                radiology_system_dto_tree_set.append(radiologySystemDto)
+            sub_begin_list = sub_dto.begin_set
+            sub_end_list = sub_dto.end_set
+
+            min_distance = 999999999
+            max_distance = 0
+
+            for begin, end in zip(begin_list, end_list):
+                for sub_begin, sub_end in zip(sub_begin_list, sub_end_list):
+
+                    if sub_end < begin:
+                        between_tokens = token_boundaries.token_distance(sub_end, begin)
+                        if between_tokens < min_distance:
+                            min_distance = between_tokens
+                        if between_tokens > max_distance:
+                            max_distance = between_tokens
+
+                    elif sub_begin > end:
+                        between_tokens = token_boundaries.token_distance(end, sub_begin)
+                        if between_tokens < min_distance:
+                            min_distance = between_tokens
+                        if between_tokens > max_distance:
+                            max_distance = between_tokens
+
+                    else:
+                        min_distance = 0
+
+            radiologySystemDto = RadiologySystemDto(
+                entity_mention_dto=sub_dto,
+                max_distance=max_distance,
+                min_distance=min_distance,
+            )
+
+            radiology_system_dto_tree_set.append(radiologySystemDto)
 
         # TODO : Check hashing in RadiologySystemDto
         return radiology_system_dto_tree_set
@@ -0,0 +1,145 @@
+import logging
+import threading
+import time
+from typing import Dict, Tuple
+
+
+class ReadinessCheck:
+    """
+    Readiness of the service, for the load balancer.
+
+    The service is ready when the reference data loaded without errors, MySQL
+    answers a query on a connection outside of the pool within `db_timeout`
+    seconds, so a busy pool does not report a healthy instance as down, at
+    least one NER replica, when NER is configured, answers within `ner_timeout`
+    seconds, and the startup cache warm-up, if any, is over. The result is kept
+    for `cache_secs` seconds, so frequent probes do not add load on MySQL and NER.
+    """
+
+    def __init__(
+        self,
+        connection_pool,
+        reference_data_registry,
+        ner_client,
+        laboratory_loinc_code_cache,
+        cache_warmup=None,
+        db_timeout: float = 2,
+        ner_timeout: float = 2,
+        cache_secs: float = 5,
+    ) -> None:
+        self.connection_pool = connection_pool
+        self.reference_data_registry = reference_data_registry
+        self.ner_client = ner_client
+        self.laboratory_loinc_code_cache = laboratory_loinc_code_cache
+        self.cache_warmup = cache_warmup
+
+        self.db_timeout = db_timeout
+        self.ner_timeout = ner_timeout
+        self.cache_secs = cache_secs
+
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._last_result: Tuple[bool, Dict] = None
+        self._last_checked_at = 0.0
+
+    def check(self) -> Tuple[bool, Dict]:
+        """
+        Runs the checks, unless the last result is recent enough. The lock is only
+        held to read and store the result, a probe arriving while the checks run
+        gets the previous result instead of waiting for them.
+
+        :returns: Whether the service is ready, and the report of every check.
+        """
+
+        with self._lock:
+            if self._is_fresh():
+                return self._last_result
+
+        # Only the first probe, with no previous result to give, waits for the checks.
+        if not self._probe_lock.acquire(blocking=self._last_result is None):
+            return self._last_result
+
+        try:
+            with self._lock:
+                if self._is_fresh():
+                    return self._last_result
+
+            start = time.time()
+            checks = {
+                "referenceData": self._check_reference_data(),
+                "database": self._check_database(),
+                "ner": self._check_ner(),
+                "cache": self._check_cache(),
+            }
+            if self.cache_warmup is not None:
+                checks["warmup"] = self._check_warmup()
+            is_ready = all(check.get("ok", True) for check in checks.values())
+            report = {
+                "status": "READY" if is_ready else "NOT_READY",
+                "checkedAt": start,
+                "checkTime": time.time() - start,
+                "checks": checks,
+            }
+            if not is_ready:
+                logging.warning(f"==> Service not ready : {report}")
+
+            with self._lock:
+                self._last_result = (is_ready, report)
+                self._last_checked_at = time.time()
+                return self._last_result
+        finally:
+            self._probe_lock.release()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._last_result is not None
+            and time.time() - self._last_checked_at < self.cache_secs
+        )
+
+    def _check_reference_data(self) -> Dict:
+        stats = self.reference_data_registry.stats()
+        stats["ok"] = stats.get("loaded", False) and len(stats.get("errors", [])) == 0
+        return stats
+
+    def _check_database(self) -> Dict:
+        result = {}
+        try:
+            result["latency"] = self.connection_pool.ping(timeout=self.db_timeout)
+            result["ok"] = result["latency"] <= self.db_timeout
+        except Exception as err:
+            result["ok"] = False
+            result["error"] = str(err)
+        # Reported only, a pool with every connection in use is busy, not down.
+        result["pool"] = self.connection_pool.stats()
+        result["poolSaturated"] = result["pool"]["inUse"] >= result["pool"]["poolSize"]
+        return result
+
+    def _check_ner(self) -> Dict:
+        if len(self.ner_client.endpoint_urls) == 0:
+            # Only /loinc_output_from_ner can be served, it does not need NER.
+            return {"ok": True, "configured": False}
+
+        replicas = self.ner_client.check_replicas(timeout=self.ner_timeout)
+        return {
+            "ok": any(replica["reachable"] for replica in replicas),
+            "configured": True,
+            "replicas": replicas,
+            "client": self.ner_client.stats(),
+        }
+
+    def _check_warmup(self) -> Dict:
+        # A failed warm-up does not block the service, it only starts cold.
+        result = self.cache_warmup.stats()
+        result["ok"] = self.cache_warmup.is_done
+        return result
+
+    def _check_cache(self) -> Dict:
+        # Reported only, a cold cache is slower but still correct.
+        result = {"laboratory": self.laboratory_loinc_code_cache.stats()}
+        persistent_cache = self.laboratory_loinc_code_cache.persistent_cache
+        if persistent_cache is not None:
+            try:
+                result["persistent"] = persistent_cache.stats()
+            except Exception as err:
+                result["persistent"] = {"error": str(err)}
+        return result
@@ -1,11 +1,15 @@
 import logging
 import os
-from typing import Dict
+from typing import Dict, List, Set
 
+from config import COMPONENT_ALIAS_PATH
+from core.impl.classes.cache import LaboratoryLoincCodeCache, LaboratoryLoincLookup
 from core.impl.classes.core_dto import *
+from core.impl.classes.interval_index import IntervalIndex
 from core.impl.classes.loinc_classes import *
 from core.impl.classes.my_sql import *
 from core.impl.classes.radiology_classes import *
+from core.impl.classes.reference_data import ReferenceDataRegistry, normalize_component
 from core.impl.core_service_impl import CoreServiceImplementation
 from core.impl.laboratory_loinc_code_service import LaboratoryLoincCodeService
 from core.impl.radiology_loinc_code_service import RadiologyLoincCodeService
@@ -19,11 +23,27 @@ logging.basicConfig(
 
 
 class LoincServiceImplementation:
-    def __init__(self, connection) -> None:
+    def __init__(
+        self,
+        connection,
+        reference_data_registry: ReferenceDataRegistry = None,
+        laboratory_loinc_code_cache: LaboratoryLoincCodeCache = None,
+    ) -> None:
         self.cDoc = None
         self.connection = connection
         self.core_service_impl = CoreServiceImplementation()
 
+        if reference_data_registry is None:
+            reference_data_registry = ReferenceDataRegistry(
+                component_alias_path=COMPONENT_ALIAS_PATH
+            )
+            reference_data_registry.refresh(connection)
+        self.reference_data_registry = reference_data_registry
+
+        if laboratory_loinc_code_cache is None:
+            laboratory_loinc_code_cache = LaboratoryLoincCodeCache()
+        self.laboratory_loinc_code_cache = laboratory_loinc_code_cache
+
     def invoke_core_service(self, document_text, f_json) -> Dict:
         """
         Main entry point of the LOINC service.
@@ -36,28 +56,81 @@ class LoincServiceImplementation:
         cDoc = f_json  # ["result"]
         loinc_final_output = None
 
-        self.attribute_loader = AttributeLoader(cDoc=cDoc)
-        self.radiology_loinc_code_service = RadiologyLoincCodeService(
-            connection=self.connection, attribute_loader=self.attribute_loader
-        )
-        self.laboratory_loinc_code_service = LaboratoryLoincCodeService(
-            connection=self.connection
-        )
-        self.query_my_sql = QueryMySQL(connection=self.connection)
-        self.laboratory_loinc_code_service.init_loinc_service(
-            connection=self.connection
-        )
-        self.radiology_loinc_code_service.init_radiology_loinc_service()
+        self.init_document_services(cDoc)
 
         start = time.time()
         loinc_final_output = self.get_loinc_codes(cDoc, "", document_text)
         end = time.time()
+        logging.info(
+            f"==> Laboratory cache stats : {self.laboratory_loinc_code_cache.stats()}"
+        )
         final_output = {}
         final_output["timeTaken"] = str(end - start) + " secs"
         final_output["result"] = loinc_final_output
 
         return final_output
 
+    def init_document_services(self, cDoc):
+        """
+        Creates the services of a document.
+
+        :param cDoc: NER Json.
+        :returns: None.
+        """
+
+        # The whole request works on the same version of the reference data.
+        reference_data = self.reference_data_registry.current
+        self.loinc_snapshot = reference_data.loinc_snapshot
+        self.component_alias_map = reference_data.component_alias_map
+        # The persistent cache of the laboratory lookups also keeps the radiology ones.
+        self.persistent_cache = self.laboratory_loinc_code_cache.persistent_cache
+        self.release = reference_data.release
+
+        self.attribute_loader = AttributeLoader(cDoc=cDoc)
+        self.radiology_loinc_code_service = RadiologyLoincCodeService(
+            connection=self.connection,
+            attribute_loader=self.attribute_loader,
+            reference_data=reference_data,
+            persistent_cache=self.persistent_cache,
+        )
+        self.laboratory_loinc_code_service = LaboratoryLoincCodeService(
+            connection=self.connection,
+            reference_data=reference_data,
+            laboratory_loinc_code_cache=self.laboratory_loinc_code_cache,
+        )
+        self.query_my_sql = QueryMySQL(connection=self.connection)
+
+    def collect_laboratory_lookups(self, f_json) -> List[List[LaboratoryLoincLookup]]:
+        """
+        Gets the laboratory lookups of a document without resolving them, first pass
+        of the corpus mode. Resolving them with LaboratoryLoincCodeService.resolve_lookups
+        fills the cache used by invoke_core_service.
+
+        :param f_json: Json of the NER output.
+        :returns: Lookups of every laboratory entity.
+        """
+
+        cDoc = f_json
+        self.init_document_services(cDoc)
+
+        lookup_chains = []
+        for parsed_entity in self.core_service_impl.get_parsed_entities(cDoc):
+            if parsed_entity.entity_type == "LABORATORY_DATA":
+                component_bean, unit_bean, system_bean_list, method_bean_list = (
+                    self.get_laboratory_beans(parsed_entity)
+                )
+                lookup_chains.append(
+                    self.laboratory_loinc_code_service.get_lookups(
+                        component_bean=component_bean,
+                        unit_bean=unit_bean,
+                        system_beans=system_bean_list,
+                        time=None,
+                        method_beans=method_bean_list,
+                    )
+                )
+
+        return lookup_chains
+
     def get_loinc_codes(self, cDoc, work_type_id, doc_text):
         """
         Gets the LOINC Codes.
@@ -72,70 +145,76 @@ class LoincServiceImplementation:
         #     self.core_service_impl.get_negation_data(cDoc)
         # )
         # self.sec_beg_end_to_name = self.core_service_impl.get_section_data(cDoc)
-        self.sent_to_entity_map = self.core_service_impl.get_entity_mention_data(cDoc)
+        self.parsed_entities = self.core_service_impl.get_parsed_entities(cDoc)
+        self.sent_to_entity_map = self.core_service_impl.get_entity_mention_data(
+            cDoc, self.parsed_entities
+        )
         self.crf_beg_end_to_crf_mention: Dict[
             Span, CRFEntityMention
-        ] = self.core_service_impl.get_crf_entity_data(cDoc)
+        ] = self.core_service_impl.get_crf_entity_data(cDoc, self.parsed_entities)
+        self.crf_span_index = IntervalIndex(
+            (span.begin, span.end, (position, span))
+            for position, span in enumerate(self.crf_beg_end_to_crf_mention.keys())
+        )
 
-        self.get_laboratory_loic_codes(cDoc)
+        self.get_laboratory_loic_codes(self.parsed_entities)
         self.get_radiology_loinc_code()
 
         responses = self.get_required_output_format()
         return responses
 
-    def get_laboratory_loic_codes(self, cDoc):
+    def get_laboratory_loic_codes(self, parsed_entities: List[ParsedEntity]):
         """
         Gets the Laboratory Loinc Codes.
 
-        :param cDoc: NER Json.
+        :param parsed_entities: Parsed entities of the document.
         :returns: None.
         """
         self.loinc_code_set: Set[LoincCodeBean] = set()
 
-        for entity in cDoc["entities"]:
-            beg_array = [ent["begin"] for ent in entity["textSpan"]]
-            end_array = [ent["end"] for ent in entity["textSpan"]]
-            entity_array = [ent["text"] for ent in entity["textSpan"]]
-
-            text_span_list = []
-            i = 0
-            for s in beg_array:
-                beg = int(s)
-                span = TextSpan(text=entity_array[i], begin_offset=beg)
-                i += 1
-                text_span_list.append(span)
-
-            ner_umls_data = self.get_Umls_Data(entity)
-
-            entity_type = entity["type"]
-            if entity_type == "LABORATORY_DATA":
-                logging.info(f"==> Entity with the 'LABORATORY DATA FOUND': {entity}")
-                loinc_code = self.generate_loinc_codes(entity, ner_umls_data)
+        for parsed_entity in parsed_entities:
+            if parsed_entity.entity_type == "LABORATORY_DATA":
+                logging.info(
+                    f"==> Entity with the 'LABORATORY DATA FOUND': {parsed_entity.entity}"
+                )
+                loinc_code = self.generate_loinc_codes(parsed_entity)
 
                 if loinc_code is not None and loinc_code.code != "":
                     self.loinc_code_set.add(loinc_code)
 
-    def get_Umls_Data(self, data):
+    def generate_loinc_codes(self, parsed_entity: ParsedEntity):
         """
-        Gets the UMLS Data from the NER segment of the entity. 
+        Gets the LOINC Code using Laboratory Method ater extracting required components. 
 
-        :param data: JSON doct of the entity.
-        :returns: UMLS data. 
+        :param parsed_entity: Parsed entity.
+        :returns: Loinc Code for the entity if present. 
         """
 
-        umls_data = data["metadata"]["normalization"]
-        return umls_data
+        component_bean, unit_bean, system_bean_list, method_bean_list = (
+            self.get_laboratory_beans(parsed_entity)
+        )
+
+        loinc_codebean = self.laboratory_loinc_code_service.start_suggesting_code(
+            component_bean=component_bean,
+            unit_bean=unit_bean,
+            system_beans=system_bean_list,
+            scale=None,
+            time=None,
+            method_beans=method_bean_list,
+        )
+
+        return loinc_codebean
 
-    def generate_loinc_codes(self, entity, ner_umls_data):
+    def get_laboratory_beans(self, parsed_entity: ParsedEntity):
         """
-        Gets the LOINC Code using Laboratory Method ater extracting required components. 
+        Extracts the component, unit, systems and methods of a laboratory entity.
 
-        :param entity: Entity dict.
-        :param ner_umls_data: The NER UMLS Data.
-        :returns: Loinc Code for the entity if present. 
+        :param parsed_entity: Parsed entity.
+        :returns: Component bean, unit bean, system beans and method beans.
         """
 
-        component = " ".join(ent["text"] for ent in entity["textSpan"])
+        entity = parsed_entity.entity
+        component = " ".join(parsed_entity.texts)
         method_id_set = [it for it in entity["metadata"]["labData"]["method"]]
         system_id_set = [it for it in entity["metadata"]["labData"]["system"]]
         unit_id_set = [it for it in entity["metadata"]["labData"]["unit"]]
@@ -152,21 +231,11 @@ class LoincServiceImplementation:
         component_bean = LoincComponent(
             text=component,
             timex_value=modified_component,
-            begin=entity["textSpan"][0]["begin"],
-            end=entity["textSpan"][0]["end"],
+            begin=parsed_entity.begins[0],
+            end=parsed_entity.ends[0],
         )
 
-        temp_delete_cuis = ""
-        cuit_set = set()
-        for it in ner_umls_data:
-            for cui in it["cuis"]:
-                # As Cui's are of the form : C0011847, we take only the numerical part.
-                filtered_cui = cui.split("C")[-1]
-                cuit_set.add(int(filtered_cui))
-                temp_delete_cuis += filtered_cui + "_CUI_"
-
-        cuit_set = list(cuit_set)
-        component_bean.cui_set = cuit_set
+        component_bean.cui_set = list(set(parsed_entity.cuis))
 
         temp_delete_unit = ""
         if unit_id_set is not None:
@@ -213,78 +282,18 @@ class LoincServiceImplementation:
 
         logging.info(f"==> From the entity, component_bean: {component_bean}, unit_bean: {unit_bean}, system_beans_list: {system_bean_list}, method_beans: {method_bean_list}")
 
-        loinc_codebean = self.laboratory_loinc_code_service.start_suggesting_code(
-            component_bean=component_bean,
-            unit_bean=unit_bean,
-            system_beans=system_bean_list,
-            scale=None,
-            time=None,
-            method_beans=method_bean_list,
-        )
-
-        return loinc_codebean
+        return component_bean, unit_bean, system_bean_list, method_bean_list
 
     def get_modified_component_for_accuracy_improvement(self, component: str):
         """
-        Modifies the component for accuracy improvement. 
+        Modifies the component for accuracy improvement, using the component alias
+        table of the reference data. 
 
         :param component: Text of the component.
         :returns: Modified component. 
         """
 
-        if component.strip().lower() in [
-            "blood glucose",
-            "glucose blood",
-            "bld glucose",
-            "glucose bld",
-            "urine glucose",
-            "ur glucose",
-            "glucose urine",
-            "glucose ur",
-            "glucose level"  # Added to accomodate Glucose Level in the DB.
-        ]:
-            return "Glucose"
-
-        if component.strip().lower() in [
-            "cr",
-            "creat",
-            "blood cr",
-            "cr blood",
-            "urine cr",
-            "cr urine",
-        ]:
-            return "Creatinine"
-
-        if component.strip().lower() in [
-            "blood creatinine",
-            "creatinine blood",
-            "bld creatinine",
-            "creatinine bld",
-            "urine creatinine",
-            "ur creatinine",
-            "creatinine urine",
-            "creatinine ur",
-        ]:
-            return "Creatinine"
-
-        if component.strip().lower() in [
-            "serum alcohol",
-            "alcohol serum",
-            "alcohol ser",
-            "ser alcohol",
-            "serum alcohol level",
-        ]:
-            return "Alcohol"
-
-        if component.strip().lower() in [
-            "serum sodium",
-            "sodium serum",
-            "sodium ser",
-            "ser sodium",
-        ]:
-            return "Sodium"
-
-        return component
+        return self.component_alias_map.get(normalize_component(component), component)
 
     def get_radiology_loinc_code(self):
         """
@@ -310,16 +319,61 @@ class LoincServiceImplementation:
                     entity_mention_dto_set=entity_mention_dto,
                     crf_beg_end_to_crf_mention=self.crf_beg_end_to_crf_mention,
                     radiology_loinc_code_bean_set=radiology_loinc_code_set,
+                    crf_span_index=self.crf_span_index,
                 )
             )
 
-        for radiology_code_bean in radiology_loinc_code_set:
-            loinc_code_bean = self.query_my_sql.get_loinc_master_data_from_code(
-                code=radiology_code_bean.code, text_span=radiology_code_bean.text_spans
-            )
+        code_to_text_spans = {
+            radiology_code_bean.code: radiology_code_bean.text_spans
+            for radiology_code_bean in radiology_loinc_code_set
+        }
+        for loinc_code_bean in self.get_loinc_master_data_from_codes(code_to_text_spans):
+            self.loinc_code_set.add(loinc_code_bean)
 
+    def get_loinc_master_data_from_codes(
+        self, code_to_text_spans: Dict[str, Set[TextSpan]]
+    ) -> List[LoincCodeBean]:
+        """
+        Gets the LOINC master data of all the codes of the document at once, from
+        the snapshot when it is loaded and with a single query otherwise (for the
+        codes missing from the persistent cache, if any).
+
+        :param code_to_text_spans: Text spans of every code.
+        :returns: Code beans of the ACTIVE codes, with their text spans.
+        """
+
+        if self.loinc_snapshot is None:
+            if self.persistent_cache is None:
+                return self.query_my_sql.get_loinc_master_data_from_codes(
+                    code_to_text_spans
+                )
+
+            loinc_code_beans = []
+            missing_code_to_text_spans = dict()
+            for code, text_spans in code_to_text_spans.items():
+                loinc_code_bean = self.persistent_cache.get_loinc_code(code, self.release)
+                if loinc_code_bean is None:
+                    missing_code_to_text_spans[code] = text_spans
+                else:
+                    loinc_code_bean.textSpans = text_spans
+                    loinc_code_beans.append(loinc_code_bean)
+
+            for loinc_code_bean in self.query_my_sql.get_loinc_master_data_from_codes(
+                missing_code_to_text_spans
+            ):
+                self.persistent_cache.put_loinc_code(loinc_code_bean, self.release)
+                loinc_code_beans.append(loinc_code_bean)
+
+            return loinc_code_beans
+
+        loinc_code_beans = []
+        for code, text_spans in code_to_text_spans.items():
+            loinc_code_bean = self.loinc_snapshot.get_code_bean(code)
             if loinc_code_bean is not None:
-                self.loinc_code_set.add(loinc_code_bean)
+                loinc_code_bean.textSpans = text_spans
+                loinc_code_beans.append(loinc_code_bean)
+
+        return loinc_code_beans
 
     def get_required_output_format(self):
         """
@@ -1,18 +1,27 @@
-import copy
-import json
 import logging
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import date, datetime
 
-import mysql.connector as Cn
-import pandas as pd
-import requests
 from flask import Flask, jsonify, request
 from tqdm import tqdm
 from waitress import serve
 
 from config import *
+from cache_warmup import CacheWarmup
+from core.impl.classes.cache import LaboratoryLoincCodeCache
+from core.impl.classes.connection_pool import MySQLConnectionPool
+from core.impl.classes.persistent_cache import PersistentResolutionCache
+from core.impl.classes.reference_data import ReferenceDataRegistry
+from health_check import ReadinessCheck
 from loinc_service_implementation import LoincServiceImplementation
+from ner_client import NerClient
+from ner_json import loads_ner_output
+from ner_preprocessing import (
+    get_loinc_output,
+    get_ner_result_from_body,
+    preprocess_ner_output,
+)
 
 app = Flask(__name__)
 
@@ -29,69 +38,84 @@ logging.basicConfig(
     filemode="a",
 )
 
-# Creating a connection
-connection = Cn.connect(
+# Creating the connection pool, every request checks out its own connection.
+connection_pool = MySQLConnectionPool(
+    pool_size=LOINC_DB_POOL_SIZE,
+    checkout_timeout=LOINC_DB_POOL_TIMEOUT,
     host=HOST,
     user=USER,
     database=DATABASE,
     passwd=PASSWORD,
 )
 
+# Reference tables shared by every request, loaded once at startup.
+logging.info(f"==> Loading the reference data ...")
+reference_data_registry = ReferenceDataRegistry(
+    load_loinc_snapshot=LOINC_SNAPSHOT_ENABLED,
+    bilateral_cui_set_path=BILATERAL_CUI_SET_PATH,
+    component_alias_path=COMPONENT_ALIAS_PATH,
+    # The release only tags the persisted resolutions.
+    release=RESOLUTION_CACHE_RELEASE,
+    release_checksum_enabled=bool(RESOLUTION_CACHE_PATH),
+)
+with connection_pool.connection() as connection:
+    reference_data_registry.refresh(connection)
+
+# Resolutions kept across restarts, optional. The cache is disabled while the
+# release of the reference data is unknown.
+persistent_cache = None
+if RESOLUTION_CACHE_PATH:
+    persistent_cache = PersistentResolutionCache(RESOLUTION_CACHE_PATH)
+    persistent_cache.set_release(reference_data_registry.current.release)
+
+# Laboratory lookups shared by every request.
+laboratory_loinc_code_cache = LaboratoryLoincCodeCache(
+    max_cache_limit=LAB_CACHE_MAX_ENTRIES, persistent_cache=persistent_cache
+)
 
-def get_ner_ent_content(text_dict, ner_version):
-    """
-    Gets the relevant entities from the Json entities as well as the relationships.
-
-    :param text_dict: JSON output from the NER-2.0 API.
-    :returns: List of all the entities in correct format as required by the SNOMED code.
-    :returns: List of tokens.
-    """
-
-    if ner_version == 1:
-        return text_dict
-
-    map = pd.read_csv("resources/Guideline_Mapping.csv")
-    map["New_entity_type"] = map["New_entity_type"].apply(lambda x: str(x).upper())
-    map["Old_entity_type_1"] = map["Old_entity_type_1"].apply(lambda x: str(x).upper())
-    map["Old_entity_type_2"] = map["Old_entity_type_2"].apply(lambda x: str(x).upper())
-
-    mp = {}
-    for row in map.itertuples(index=False):
-        mp[row[0]] = [row[1], row[2]]
-
-    new_text_dict = copy.deepcopy(text_dict)
-    text_dict = text_dict["result"]
-    all_entities = text_dict["entities"]
-    contextTokens = text_dict["contextTokens"]
-
-    tokens = []
-    for token in contextTokens:
-        tokens.append([token["text"], int(token["begin"]), int(token["end"])])
-
-    tokens.sort(key=lambda x: x[1])
-
-    ret_ent = []
-
-    for ent in all_entities:
-        newtype = mp[ent["type"].upper()]
-
-        if newtype[0] != "NAN":
-            n_type = newtype[0]
-            ent_copy = copy.deepcopy(ent)
-            ent_copy["type"] = n_type
 
-            ret_ent.append(ent_copy)
+# NER-2.0 client shared by every request.
+ner_client = NerClient(
+    endpoint_urls=NER_ENDPOINT_URLS,
+    connect_timeout=NER_CONNECT_TIMEOUT,
+    read_timeout=NER_READ_TIMEOUT,
+    max_retries=NER_MAX_RETRIES,
+    backoff_factor=NER_RETRY_BACKOFF,
+    hedging_enabled=NER_HEDGING_ENABLED,
+    # NER is called by the waitress threads and by the batch NER workers.
+    pool_maxsize=LOINC_THREADS + NER_BATCH_CONCURRENCY,
+)
 
-        if newtype[1] != "NAN":
-            n_type = newtype[1]
-            ent_copy = copy.deepcopy(ent)
-            ent_copy["type"] = n_type
 
-            ret_ent.append(ent_copy)
+# Replays recorded NER outputs to warm the caches, optional.
+cache_warmup = None
+if WARMUP_CORPUS_PATH:
+    cache_warmup = CacheWarmup(
+        connection_pool=connection_pool,
+        reference_data_registry=reference_data_registry,
+        laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+        corpus_path=WARMUP_CORPUS_PATH,
+        max_secs=WARMUP_MAX_SECS,
+        max_documents=WARMUP_MAX_DOCUMENTS,
+    )
+    cache_warmup.start()
+
+
+# Checks of /health/ready.
+readiness_check = ReadinessCheck(
+    connection_pool=connection_pool,
+    reference_data_registry=reference_data_registry,
+    ner_client=ner_client,
+    laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+    cache_warmup=cache_warmup,
+    db_timeout=READINESS_DB_TIMEOUT,
+    ner_timeout=READINESS_NER_TIMEOUT,
+    cache_secs=READINESS_CACHE_SECS,
+)
 
-    new_text_dict["result"]["entities"] = ret_ent
 
-    return new_text_dict
+# Runs the NER calls of the batch requests concurrently.
+ner_executor = ThreadPoolExecutor(max_workers=NER_BATCH_CONCURRENCY)
 
 
 def get_ner_output(text):
@@ -101,62 +125,68 @@ def get_ner_output(text):
     :param text: Document to be proccessed.
     :returns: Json output from the NER-2.0 API
     """
-    url = NER_ENDPOINT_URL + "/predict_ner_str"
-    logging.info(f"==> Serving NER url at : {url}")
-    
-    data = {"content": text, "servicingFacility": "RUMC"}
-    res = requests.post(url, headers={"Content-type": "application/json"}, json=data)
-    output = res.text
-    return json.loads(output)
 
+    return ner_client.predict(text)
 
-def get_labdata_values(text_dict):
-    new_entites = []
-    old_entities = text_dict["result"]["entities"]
-    relations = text_dict["result"]["relations"]
 
-    for ent in old_entities:
-        unit_list = []
-        method_list = []
-        value_list = []
-        system_list = []
+@app.route("/", methods=["GET"])
+def index_route():
+    return jsonify({"message": "Index Route"})
 
-        ent_id = ent["id"]
 
-        for rel in relations:
-            if rel["head"]["id"] == ent_id:
-                tail_type = rel["tail"]["type"]
-                ttype = tail_type.split("_")[0]
-                if ttype == "VALUE":
-                    value_list.append(rel["tail"]["id"])
-                if ttype == "METHOD":
-                    method_list.append(rel["tail"]["id"])
-                if ttype == "SYSTEM":
-                    system_list.append(rel["tail"]["id"])
-                if ttype == "UNIT":
-                    unit_list.append(rel["tail"]["id"])
+@app.route("/health", methods=["GET"])
+def health():
+    return "200"
 
-        new_ent = copy.deepcopy(ent)
-        new_ent["metadata"]["labData"]["unit"] = unit_list
-        new_ent["metadata"]["labData"]["value"] = value_list
-        new_ent["metadata"]["labData"]["system"] = system_list
-        new_ent["metadata"]["labData"]["method"] = method_list
 
-        new_entites.append(new_ent)
+@app.route("/health/live", methods=["GET"])
+def health_live():
+    """
+    Liveness probe, the process is up and serving requests.
 
-    text_dict["result"]["entities"] = new_entites
+    :returns: JSON with the status.
+    """
 
-    return text_dict
+    return jsonify({"status": "ALIVE"})
 
 
-@app.route("/", methods=["GET"])
-def index_route():
-    return jsonify({"message": "Index Route"})
+@app.route("/health/ready", methods=["GET"])
+def health_ready():
+    """
+    Readiness probe, checks the reference data, MySQL and NER and reports the caches.
 
+    :returns: JSON report of the checks, with status 503 when the service is not ready.
+    """
 
-@app.route("/health", methods=["GET"])
-def health():
-    return "200"
+    is_ready, report = readiness_check.check()
+    return jsonify(report), 200 if is_ready else 503
+
+
+@app.route("/reference_data/refresh", methods=["POST"])
+def refresh_reference_data():
+    """
+    Reloads the reference tables. Requests in flight finish on the previous version.
+
+    :returns: JSON with the new reference data version.
+    """
+
+    with connection_pool.connection() as connection:
+        reference_data = reference_data_registry.refresh(connection)
+    if persistent_cache is not None:
+        # Requests still running on the previous release cannot write anymore.
+        persistent_cache.set_release(reference_data.release)
+    # Lookups of the requests still running on the previous version are not cached anymore.
+    laboratory_loinc_code_cache.clear(reference_data.version)
+    logging.info(f"==> Reference data refreshed to version {reference_data.version}")
+
+    return jsonify(
+        {
+            "version": reference_data.version,
+            "loadedAt": reference_data.loaded_at,
+            "release": reference_data.release,
+            "errors": list(reference_data.load_errors),
+        }
+    )
 
 
 @app.route("/loinc_output", methods=["POST"])
@@ -172,22 +202,24 @@ def success(return_json=True):
     logging.info(f"==> Request recieved at : Data: {today}, Time: {time}")
 
     if request.method == "POST":
-        service = LoincServiceImplementation(connection=connection)
         text = request.json["content"]
 
         print("Running NER pipeline ....")
         text_dict = get_ner_output(text)
-        new_text_dict = get_ner_ent_content(text_dict=text_dict, ner_version=2)
-        new_text_dict = get_labdata_values(text_dict=new_text_dict)
-
-        # logging.info(f"==> Final NER content : {new_text_dict}")
 
         print("Running LOINC code ......")
         logging.info(f"==> Starting LOINC service ...")
 
-        res_dict = service.invoke_core_service(
-            document_text="", f_json=new_text_dict["result"]
-        )
+        # The connection is only held for the LOINC part, not during the NER call.
+        with connection_pool.connection() as connection:
+            service = LoincServiceImplementation(
+                connection=connection,
+                reference_data_registry=reference_data_registry,
+                laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+            )
+            res_dict = get_loinc_output(text_dict, service)
+        logging.info(f"==> Connection pool stats : {connection_pool.stats()}")
+        logging.info(f"==> NER client stats : {ner_client.stats()}")
 
         final_dict = {}
         final_dict["status"] = "COMPLETED"
@@ -201,10 +233,201 @@ def success(return_json=True):
     return jsonify({"msg": "Error"})
 
 
+@app.route("/loinc_output_from_ner", methods=["POST"])
+def success_from_ner():
+    """
+    Entry point of the API for documents already processed by NER, the NER call is skipped.
+
+    Body : the NER-2.0 output ({"result": {...}}, e.g. misc/IHH_4_2456.json) or its "result" object.
+    "skipRemap": true skips the guideline entity type remapping, for entities already remapped.
+
+    :returns: JSON result containing LOINC code of entities.
+    """
+
+    today = date.today()
+    time = datetime.now()
+    logging.info(f"==> NER output recieved at : Data: {today}, Time: {time}")
+
+    try:
+        # Only the parts of the NER output read by the LOINC service are kept.
+        body = loads_ner_output(request.get_data())
+    except ValueError as err:
+        return jsonify({"status": "FAILED", "msg": f"Invalid JSON : {err}"}), 400
+
+    try:
+        text_dict, ner_version = get_ner_result_from_body(body)
+    except ValueError as err:
+        return jsonify({"status": "FAILED", "msg": str(err)}), 400
+
+    logging.info(f"==> Starting LOINC service ...")
+    with connection_pool.connection() as connection:
+        service = LoincServiceImplementation(
+            connection=connection,
+            reference_data_registry=reference_data_registry,
+            laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+        )
+        res_dict = get_loinc_output(text_dict, service, ner_version)
+    logging.info(f"==> Connection pool stats : {connection_pool.stats()}")
+
+    final_dict = {}
+    final_dict["status"] = "COMPLETED"
+    final_dict["codes"] = res_dict
+
+    logging.info(f"==> -------------- Finished running LOINC service ------------")
+
+    return jsonify(final_dict)
+
+
+def get_batch_laboratory_cache(connection, ner_outputs, results) -> LaboratoryLoincCodeCache:
+    """
+    Resolves the distinct laboratory signatures of a batch at once.
+
+    :param connection: Connection of the batch.
+    :param ner_outputs: Preprocessed NER output of every document, by position.
+    :param results: Results of the batch, for the ids in the logs.
+    :returns: Cache of the batch, primed with every signature of the batch and
+        backed by the shared persistent cache.
+    """
+
+    service = LoincServiceImplementation(
+        connection=connection,
+        reference_data_registry=reference_data_registry,
+        laboratory_loinc_code_cache=laboratory_loinc_code_cache,
+    )
+    lookup_chains = []
+    for position, text_dict in ner_outputs.items():
+        try:
+            lookup_chains.extend(service.collect_laboratory_lookups(text_dict["result"]))
+        except Exception as err:
+            # The document fails again, and is reported, when it is coded.
+            logging.warning(
+                f"==> Lookups of document {results[position]['id']} of the batch failed : {err}"
+            )
+
+    # Signatures already cached are read from the shared cache, the other ones are
+    # resolved in bulk and added to it.
+    resolved = service.laboratory_loinc_code_service.resolve_lookups(lookup_chains)
+
+    batch_cache = LaboratoryLoincCodeCache(
+        max_cache_limit=max(1, len(resolved)),
+        persistent_cache=laboratory_loinc_code_cache.persistent_cache,
+    )
+    batch_cache.prime(resolved)
+    return batch_cache
+
+
+@app.route("/loinc_output_batch", methods=["POST"])
+def batch_success():
+    """
+    Batch entry point of the API. The NER calls of the documents run concurrently,
+    at most NER_BATCH_MAX_IN_FLIGHT at a time per batch, so one large batch does
+    not hold the NER workers of the other ones. No connection is held while the
+    NER calls run. Once the NER outputs are back, the laboratory lookups of the
+    whole batch are collected and each distinct signature is resolved once, as in
+    the two pass mode of bulk_loinc.py, then the documents are coded from a cache
+    primed with them, whatever LAB_CACHE_MAX_ENTRIES.
+
+    Body : {"documents": [{"id": ..., "content": ...}, ...]}, a document may also be a plain string.
+
+    :returns: JSON result with the LOINC codes, or the error, of every document in input order.
+    """
+
+    today = date.today()
+    time = datetime.now()
+    logging.info(f"==> Batch request recieved at : Data: {today}, Time: {time}")
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"status": "FAILED", "msg": "The body must be a JSON object"}), 400
+
+    documents = body.get("documents")
+    if not isinstance(documents, list):
+        return jsonify({"status": "FAILED", "msg": "'documents' must be a list"}), 400
+    if len(documents) > LOINC_BATCH_MAX_DOCUMENTS:
+        return (
+            jsonify(
+                {
+                    "status": "FAILED",
+                    "msg": f"At most {LOINC_BATCH_MAX_DOCUMENTS} documents per batch",
+                }
+            ),
+            400,
+        )
+
+    results = []
+    texts = []
+    for position, document in enumerate(documents):
+        if isinstance(document, dict):
+            doc_id, text = document.get("id", position), document.get("content")
+        else:
+            doc_id, text = position, document
+        results.append({"id": doc_id, "status": "FAILED"})
+
+        if not isinstance(text, str):
+            results[position]["error"] = "'content' must be a string"
+            continue
+        texts.append((position, text))
+
+    logging.info(f"==> Running NER on {len(texts)} of {len(documents)} documents ...")
+
+    pending_texts = iter(texts)
+    ner_futures = {}
+
+    def submit_next():
+        for position, text in pending_texts:
+            ner_futures[ner_executor.submit(get_ner_output, text)] = position
+            return
+
+    for _ in range(NER_BATCH_MAX_IN_FLIGHT):
+        submit_next()
+
+    ner_outputs = {}
+    while len(ner_futures) != 0:
+        done, _ = wait(ner_futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            position = ner_futures.pop(future)
+            submit_next()
+            try:
+                ner_outputs[position] = preprocess_ner_output(future.result())
+            except Exception as err:
+                logging.exception(
+                    f"==> Document {results[position]['id']} of the batch failed : {err}"
+                )
+                results[position]["error"] = str(err)
+
+    if len(ner_outputs) != 0:
+        with connection_pool.connection() as connection:
+            batch_cache = get_batch_laboratory_cache(connection, ner_outputs, results)
+            service = LoincServiceImplementation(
+                connection=connection,
+                reference_data_registry=reference_data_registry,
+                laboratory_loinc_code_cache=batch_cache,
+            )
+            for position in sorted(ner_outputs):
+                try:
+                    results[position]["codes"] = service.invoke_core_service(
+                        document_text="", f_json=ner_outputs[position]["result"]
+                    )
+                    results[position]["status"] = "COMPLETED"
+                except Exception as err:
+                    logging.exception(
+                        f"==> Document {results[position]['id']} of the batch failed : {err}"
+                    )
+                    results[position]["error"] = str(err)
+
+    if len(texts) != 0:
+        logging.info(f"==> Connection pool stats : {connection_pool.stats()}")
+        logging.info(f"==> NER client stats : {ner_client.stats()}")
+
+    logging.info(f"==> -------------- Finished running LOINC batch of {len(documents)} documents ------------")
+
+    return jsonify({"status": "COMPLETED", "results": results})
+
+
 if __name__ == "__main__":
     print(f"LOINC service serving on host : {LOINC_HOST} port : {LOINC_PORT}")
     today = date.today()
     time = datetime.now()
     logging.info(f"==> Starting loinc service at : {time}")
     # app.run(host=LOINC_HOST, port=LOINC_PORT, debug=True)
-    serve(app=app, host=LOINC_HOST, port=LOINC_PORT)
+    serve(app=app, host=LOINC_HOST, port=LOINC_PORT, threads=LOINC_THREADS)
@@ -0,0 +1,255 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from ner_json import loads_ner_output
+
+
+class NerClient:
+    """
+    Client of the NER-2.0 API.
+
+    Keeps a pool of keep-alive connections per replica, applies connect/read
+    timeouts and retries the connection errors and the 502/503/504 responses with
+    a backoff, a read timeout is not retried. When hedging is enabled
+    and several replicas are configured, a call slower than the p95 latency is
+    sent again to the next replica and the first response wins. The delay is
+    timed from the start of the first call, and a call is not hedged when every
+    hedge worker is busy.
+    """
+
+    PREDICT_PATH = "/predict_ner_str"
+
+    # Number of latencies needed before the p95 is trusted for hedging.
+    HEDGE_MIN_SAMPLES = 20
+
+    def __init__(
+        self,
+        endpoint_urls: List[str],
+        connect_timeout: float = 5,
+        read_timeout: float = 120,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+        hedging_enabled: bool = False,
+        pool_maxsize: int = 4,
+        latency_window: int = 1000,
+    ) -> None:
+        self.endpoint_urls = [url.rstrip("/") for url in endpoint_urls]
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.hedging_enabled = hedging_enabled and len(self.endpoint_urls) > 1
+
+        # Number of hedges running at once, one per executor worker.
+        hedge_workers = pool_maxsize
+        if self.hedging_enabled:
+            # The losing call of a hedged pair keeps its connection until it finishes.
+            pool_maxsize = 2 * pool_maxsize
+
+        # A read timeout is not retried, NER may still be running the document and a
+        # retry would run it again and wait for the read timeout once more.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=max(1, len(self.endpoint_urls)),
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+        self.session = requests.Session()
+        self.session.headers.update({"Content-type": "application/json"})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._executor = (
+            ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="ner-hedge")
+            if self.hedging_enabled
+            else None
+        )
+        self._hedge_slots = threading.Semaphore(hedge_workers)
+
+        self._lock = threading.Lock()
+        self._replica_cycle = itertools.cycle(range(len(self.endpoint_urls)))
+        self._latencies = deque(maxlen=latency_window)
+        self.calls = 0
+        self.errors = 0
+        self.hedged_calls = 0
+        self.hedge_wins = 0
+
+    def predict(self, text: str) -> Dict:
+        """
+        Gets the NER-2.0 output of a document.
+
+        :param text: Document to be proccessed.
+        :returns: Json output from the NER-2.0 API.
+        """
+
+        if len(self.endpoint_urls) == 0:
+            raise ValueError("No NER endpoint url configured, set NER_ENDPOINT_URL")
+
+        data = {"content": text, "servicingFacility": "RUMC"}
+
+        with self._lock:
+            replica = next(self._replica_cycle)
+            self.calls += 1
+
+        hedge_delay = self._get_hedge_delay()
+        try:
+            if hedge_delay is None:
+                return self._post(replica, data)
+            return self._post_hedged(replica, data, hedge_delay)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def _post(self, replica: int, data: Dict) -> Dict:
+        url = self.endpoint_urls[replica] + self.PREDICT_PATH
+        logging.info(f"==> Serving NER url at : {url}")
+
+        start = time.time()
+        res = self.session.post(url, json=data, timeout=self.timeout)
+        res.raise_for_status()
+        output = loads_ner_output(res.content)
+
+        latency = time.time() - start
+        with self._lock:
+            self._latencies.append(latency)
+        logging.info(f"==> NER call took {latency} secs")
+
+        return output
+
+    def _post_hedged(self, replica: int, data: Dict, hedge_delay: float) -> Dict:
+        # The primary call starts at once on its own thread, the caller's thread only
+        # waits. Only the hedges go through the executor, so the primary never waits
+        # in its queue and its queue time cannot fire a hedge.
+        primary = Future()
+        threading.Thread(
+            target=self._run_primary,
+            args=(primary, replica, data),
+            name="ner-primary",
+            daemon=True,
+        ).start()
+
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        if not self._hedge_slots.acquire(blocking=False):
+            # Every executor worker is already running a hedge, they would only queue.
+            return primary.result()
+
+        hedge_replica = (replica + 1) % len(self.endpoint_urls)
+        logging.info(
+            f"==> NER call slower than {hedge_delay} secs, hedging to {self.endpoint_urls[hedge_replica]}"
+        )
+        hedge = self._executor.submit(self._run_hedge, hedge_replica, data)
+        with self._lock:
+            self.hedged_calls += 1
+
+        pending = {primary, hedge}
+        error = None
+        while len(pending) != 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+
+        raise error
+
+    def _run_primary(self, future: Future, replica: int, data: Dict):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._post(replica, data))
+        except Exception as err:
+            future.set_exception(err)
+
+    def _run_hedge(self, replica: int, data: Dict) -> Dict:
+        try:
+            return self._post(replica, data)
+        finally:
+            self._hedge_slots.release()
+
+    def _get_hedge_delay(self):
+        if not self.hedging_enabled:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return self._percentile(latencies, 0.95)
+
+    def check_replicas(self, timeout: float = 2) -> List[Dict]:
+        """
+        Probes every replica without running NER. Any HTTP response, whatever its
+        status, means the replica is reachable.
+
+        :param timeout: Seconds allowed to connect and to get the response.
+        :returns: Reachability and latency of every replica.
+        """
+
+        replicas = []
+        for url in self.endpoint_urls:
+            start = time.time()
+            try:
+                res = requests.get(url, timeout=timeout)
+                res.close()
+                replicas.append(
+                    {
+                        "url": url,
+                        "reachable": True,
+                        "status": res.status_code,
+                        "latency": time.time() - start,
+                    }
+                )
+            except Exception as err:
+                replicas.append(
+                    {
+                        "url": url,
+                        "reachable": False,
+                        "error": str(err),
+                        "latency": time.time() - start,
+                    }
+                )
+        return replicas
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], fraction: float) -> float:
+        if len(sorted_values) == 0:
+            return 0.0
+        position = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+        return sorted_values[position]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "replicas": len(self.endpoint_urls),
+                "calls": self.calls,
+                "errors": self.errors,
+                "hedgedCalls": self.hedged_calls,
+                "hedgeWins": self.hedge_wins,
+                "avgLatency": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50Latency": self._percentile(latencies, 0.50),
+                "p95Latency": self._percentile(latencies, 0.95),
+                "p99Latency": self._percentile(latencies, 0.99),
+            }
@@ -0,0 +1,207 @@
+import json
+import re
+from typing import Dict, List, Set, Union
+
+# Keys of the NER "result" read by the LOINC pipeline, the other sections are skipped unparsed.
+RESULT_KEYS = frozenset(
+    ["content", "entities", "relations", "sentences", "contextTokens", "tokens"]
+)
+
+# Context tokens used by CoreServiceImplementation.get_crf_entity_data, the others are dropped.
+CONTEXT_TOKEN_TYPES = frozenset(
+    [
+        "ModalityToken",
+        "ViewToken",
+        "PharmaceuticalToken",
+        "RadiologyrouteToken",
+        "UnitToken",
+    ]
+)
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+STRING = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+# Everything up to the next bracket, strings included, so brackets in strings are skipped.
+UNTIL_BRACKET = re.compile(r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*', re.DOTALL)
+SCALAR = re.compile(r"[^,\]}\s]*")
+
+_decoder = json.JSONDecoder()
+
+
+class _Scanner:
+    """
+    Cursor over a JSON text, values are either decoded or skipped without
+    building them.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.pos = 0
+
+    def skip_whitespace(self):
+        self.pos = WHITESPACE.match(self.text, self.pos).end()
+
+    def expect(self, char: str):
+        self.skip_whitespace()
+        if self.text[self.pos : self.pos + 1] != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.text, self.pos)
+        self.pos += 1
+
+    def peek(self) -> str:
+        self.skip_whitespace()
+        return self.text[self.pos : self.pos + 1]
+
+    def decode_value(self):
+        self.skip_whitespace()
+        value, self.pos = _decoder.raw_decode(self.text, self.pos)
+        return value
+
+    def skip_value(self):
+        self.skip_whitespace()
+        char = self.text[self.pos : self.pos + 1]
+        if char == '"':
+            match = STRING.match(self.text, self.pos)
+            if match is None:
+                raise json.JSONDecodeError("Unterminated string", self.text, self.pos)
+            self.pos = match.end()
+        elif char in ("[", "{"):
+            depth = 0
+            while True:
+                self.pos = UNTIL_BRACKET.match(self.text, self.pos).end()
+                char = self.text[self.pos : self.pos + 1]
+                if char == "":
+                    raise json.JSONDecodeError("Unterminated value", self.text, self.pos)
+                self.pos += 1
+                depth += 1 if char in ("[", "{") else -1
+                if depth == 0:
+                    break
+        else:
+            self.pos = SCALAR.match(self.text, self.pos).end()
+
+    def iter_object(self):
+        """
+        Iterates over the keys of an object, the caller decodes or skips every value.
+        """
+
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+            self.skip_whitespace()
+            if self.peek() == ",":
+                self.pos += 1
+                continue
+            self.expect("}")
+            return
+
+
+def loads_ner_output(data: Union[str, bytes]) -> Dict:
+    """
+    Parses a NER-2.0 output keeping only what the LOINC pipeline reads. In the
+    "result" object, the sections not in RESULT_KEYS are skipped without being
+    built, the context tokens are limited to CONTEXT_TOKEN_TYPES and the tokens
+    to the ones referenced by the lab data of the entities or by the relations.
+    A document without a "result" object is parsed completely.
+
+    :param data: JSON text of the NER output.
+    :returns: The NER output with the reduced "result".
+    """
+
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+
+    scanner = _Scanner(data)
+    if scanner.peek() != "{":
+        return json.loads(data)
+
+    output = {}
+    for key in scanner.iter_object():
+        if key == "result" and scanner.peek() == "{":
+            output[key] = _load_result(scanner)
+        else:
+            output[key] = scanner.decode_value()
+
+    scanner.skip_whitespace()
+    if scanner.pos != len(data):
+        raise json.JSONDecodeError("Extra data", data, scanner.pos)
+
+    return output
+
+
+def loads_top_level_keys(data: Union[str, bytes], keys) -> Dict:
+    """
+    Reads some top level keys of a JSON object, the other values are skipped.
+
+    :param data: JSON text of an object.
+    :param keys: Keys to read.
+    :returns: The values of the keys found.
+    """
+
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode("utf-8")
+
+    scanner = _Scanner(data)
+    if scanner.peek() != "{":
+        return {}
+
+    values = {}
+    for key in scanner.iter_object():
+        if key in keys:
+            values[key] = scanner.decode_value()
+        else:
+            scanner.skip_value()
+
+    return values
+
+
+def _load_result(scanner: _Scanner) -> Dict:
+    result = {}
+    all_tokens = None
+
+    for key in scanner.iter_object():
+        if key not in RESULT_KEYS:
+            scanner.skip_value()
+        elif key == "tokens":
+            # Filtered once the entities and relations, which may come later, are read.
+            all_tokens = scanner.decode_value()
+        elif key == "contextTokens":
+            result[key] = _filter_list(
+                scanner.decode_value(),
+                lambda token: token.get("type") in CONTEXT_TOKEN_TYPES,
+            )
+        else:
+            result[key] = scanner.decode_value()
+
+    if all_tokens is not None:
+        referenced_ids = _get_referenced_token_ids(result)
+        result["tokens"] = _filter_list(
+            all_tokens, lambda token: str(token.get("id")) in referenced_ids
+        )
+
+    return result
+
+
+def _filter_list(values, keep) -> List:
+    # Decoded at once (in C) then filtered, only the kept items outlive the call.
+    if not isinstance(values, list):
+        return values
+    return [it for it in values if not isinstance(it, dict) or keep(it)]
+
+
+def _get_referenced_token_ids(result: Dict) -> Set[str]:
+    referenced_ids = set()
+
+    for entity in result.get("entities") or []:
+        lab_data = (entity.get("metadata") or {}).get("labData") or {}
+        for ids in lab_data.values():
+            if isinstance(ids, list):
+                referenced_ids.update(str(it) for it in ids)
+
+    for relation in result.get("relations") or []:
+        tail = relation.get("tail") or {}
+        referenced_ids.add(str(tail.get("id")))
+
+    return referenced_ids
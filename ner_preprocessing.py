@@ -0,0 +1,187 @@
+import csv
+from typing import Dict, Tuple
+
+# Tail types of the relations and the lab data key they fill.
+LAB_DATA_TAIL_TYPES = {
+    "UNIT": "unit",
+    "VALUE": "value",
+    "SYSTEM": "system",
+    "METHOD": "method",
+}
+
+# Keys of the NER "result" read unconditionally by the LOINC pipeline, "tokens" is
+# read by AttributeLoader for the lab data of the relations.
+REQUIRED_RESULT_KEYS = (
+    "content",
+    "entities",
+    "relations",
+    "sentences",
+    "tokens",
+    "contextTokens",
+)
+
+# Values read as "no type", same as the pandas defaults the mapping used to be read with.
+GUIDELINE_MAPPING_NA_VALUES = frozenset(
+    ["", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+     "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"]
+)
+
+
+def load_guideline_mapping(path: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Loads the entity type remapping of the NER-2.0 entities.
+
+    :param path: Path of Guideline_Mapping.csv.
+    :returns: Upper cased entity type to its (first, second) new type, None when there is no type.
+    """
+
+    def to_type(value):
+        if value is None or value in GUIDELINE_MAPPING_NA_VALUES:
+            return None
+        return value.upper()
+
+    guideline_mapping = {}
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if len(row) == 0:
+                continue
+            row = row + [None] * (3 - len(row))
+            key = to_type(row[0])
+            guideline_mapping["NAN" if key is None else key] = (
+                to_type(row[1]),
+                to_type(row[2]),
+            )
+
+    return guideline_mapping
+
+
+# Entity type remapping, compiled once at startup.
+guideline_mapping = load_guideline_mapping("resources/Guideline_Mapping.csv")
+
+
+def get_ner_result_from_body(body) -> Tuple[Dict, int]:
+    """
+    Reads the NER output of a /loinc_output_from_ner body.
+
+    :param body: The NER-2.0 output ({"result": {...}}) or its "result" object, with an
+        optional "skipRemap": true when the entities are already remapped.
+    :returns: The NER output ({"result": {...}}) and its ner_version.
+    :raises ValueError: When the "result" object or some of its required keys are missing.
+    """
+
+    ner_result = body.get("result", body) if isinstance(body, dict) else None
+    if not isinstance(ner_result, dict):
+        raise ValueError("No NER 'result' object found")
+
+    missing_keys = [key for key in REQUIRED_RESULT_KEYS if key not in ner_result]
+    if len(missing_keys) != 0:
+        raise ValueError(f"Keys missing from the NER 'result' : {', '.join(missing_keys)}")
+
+    ner_version = 1 if body.get("skipRemap", False) else 2
+    return {"result": ner_result}, ner_version
+
+
+def get_ner_ent_content(text_dict, ner_version):
+    """
+    Gets the relevant entities from the Json entities as well as the relationships.
+
+    :param text_dict: JSON output from the NER-2.0 API.
+    :returns: JSON output with the entities remapped to the types required by the LOINC code.
+    """
+
+    if ner_version == 1:
+        return text_dict
+
+    ret_ent = []
+
+    for ent in text_dict["result"]["entities"]:
+        newtype = guideline_mapping[ent["type"].upper()]
+
+        # The remapped entities share their body with the input, only the type differs.
+        for n_type in newtype:
+            if n_type is not None:
+                ent_copy = dict(ent)
+                ent_copy["type"] = n_type
+
+                ret_ent.append(ent_copy)
+
+    new_text_dict = dict(text_dict)
+    new_text_dict["result"] = dict(text_dict["result"])
+    new_text_dict["result"]["entities"] = ret_ent
+
+    return new_text_dict
+
+
+def get_labdata_values(text_dict):
+    """
+    Fills the unit, value, system and method of the lab data of every entity with
+    the ids of the related entities.
+
+    :param text_dict: NER output.
+    :returns: NER output with the lab data of the entities filled.
+    """
+
+    old_entities = text_dict["result"]["entities"]
+    relations = text_dict["result"]["relations"]
+
+    # Tail ids of the relations, grouped by head id and tail type, in relation order.
+    lab_data_of_head: Dict[str, Dict[str, list]] = dict()
+    for rel in relations:
+        ttype = rel["tail"]["type"].split("_")[0]
+        if ttype not in LAB_DATA_TAIL_TYPES:
+            continue
+        lab_data = lab_data_of_head.get(rel["head"]["id"])
+        if lab_data is None:
+            lab_data = {key: [] for key in LAB_DATA_TAIL_TYPES.values()}
+            lab_data_of_head[rel["head"]["id"]] = lab_data
+        lab_data[LAB_DATA_TAIL_TYPES[ttype]].append(rel["tail"]["id"])
+
+    new_entites = []
+    for ent in old_entities:
+        lab_data = lab_data_of_head.get(ent["id"])
+        if lab_data is None:
+            lab_data = {key: [] for key in LAB_DATA_TAIL_TYPES.values()}
+
+        # Only the lab data is replaced, the rest of the entity is shared with the input.
+        metadata = ent["metadata"]
+        new_ent = dict(ent)
+        new_ent["metadata"] = dict(metadata)
+        new_ent["metadata"]["labData"] = {**metadata["labData"], **lab_data}
+
+        new_entites.append(new_ent)
+
+    text_dict["result"]["entities"] = new_entites
+
+    return text_dict
+
+
+def get_loinc_output(text_dict, service, ner_version=2):
+    """
+    Runs the LOINC stages on a NER output.
+
+    :param text_dict: JSON output from the NER-2.0 API.
+    :param service: LOINC service of the request.
+    :param ner_version: 1 if the entities are already remapped to the LOINC entity types.
+    :returns: LOINC codes of the entities.
+    """
+
+    new_text_dict = preprocess_ner_output(text_dict, ner_version)
+
+    # logging.info(f"==> Final NER content : {new_text_dict}")
+
+    return service.invoke_core_service(document_text="", f_json=new_text_dict["result"])
+
+
+def preprocess_ner_output(text_dict, ner_version=2):
+    """
+    Remaps the entity types and fills the lab data of a NER output.
+
+    :param text_dict: JSON output from the NER-2.0 API.
+    :param ner_version: 1 if the entities are already remapped to the LOINC entity types.
+    :returns: NER output ready for the LOINC service.
+    """
+
+    new_text_dict = get_ner_ent_content(text_dict=text_dict, ner_version=ner_version)
+    return get_labdata_values(text_dict=new_text_dict)
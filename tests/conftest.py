@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The tests import the modules from the root of the repository, like main.py.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# QueryMaster builds its queries from the database names when it is imported.
+os.environ.setdefault("LOINC_DB_NAME", "LOINC")
+os.environ.setdefault("UMLS_DB_NAME", "UMLS")
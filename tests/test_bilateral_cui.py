@@ -0,0 +1,55 @@
+import pytest
+
+from core.impl.classes.bilateral_cui_set import BilateralCuiSet
+from core.impl.classes.my_sql import QueryMySQL
+
+# Rows of umls_test1, the cui column holds either the "C" form or the number.
+UMLS_ROWS = [
+    {"cui": "C0011847", "text": "Bilateral lungs"},
+    {"cui": "C0011847", "text": "Lungs"},
+    {"cui": "C0000005", "text": "Left knee"},
+    {"cui": 1234, "text": "Both kidneys"},
+    {"cui": 4321, "text": "Kidney"},
+    {"cui": "C0000777", "text": "B/L hips"},
+]
+
+
+class UmlsCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def execute(self, query, params=None):
+        if params is None:
+            # get_bilateral_cui_candidates, filtered by BilateralCuiSet.build.
+            self.result = list(self.rows)
+        else:
+            self.result = [
+                {"text": row["text"]} for row in self.rows if str(row["cui"]) in params
+            ]
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        pass
+
+
+class UmlsConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, **kwargs):
+        return UmlsCursor(self.rows)
+
+
+@pytest.mark.parametrize("cui", [11847, 5, 1234, 4321, 777, 999])
+def test_fallback_agrees_with_the_bilateral_cui_set(cui):
+    connection = UmlsConnection(UMLS_ROWS)
+    bilateral_cui_set = BilateralCuiSet.build(connection)
+
+    assert QueryMySQL(connection).check_bilateral_in_text(cui) == (cui in bilateral_cui_set)
+
+
+def test_bilateral_cui_set_strips_the_prefix():
+    assert BilateralCuiSet.build(UmlsConnection(UMLS_ROWS)).cuis == {11847, 1234, 777}
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from core.impl.classes.connection_pool import ConnectionPoolTimeout, MySQLConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, fail_rollback=False):
+        self.fail_rollback = fail_rollback
+        self.rollbacks = 0
+        self.closed = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.fail_rollback:
+            raise Exception("Lost connection to MySQL server")
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnectionFactory:
+    def __init__(self):
+        self.connections = []
+        self.fail_rollback = False
+
+    def __call__(self):
+        connection = FakeConnection(self.fail_rollback)
+        self.connections.append(connection)
+        return connection
+
+
+def test_released_connection_is_rolled_back_and_reused():
+    factory = FakeConnectionFactory()
+    pool = MySQLConnectionPool(pool_size=2, connection_factory=factory)
+
+    with pool.connection() as connection:
+        pass
+    with pool.connection() as reused:
+        assert reused is connection
+
+    assert connection.rollbacks == 2
+    assert not connection.closed
+    assert len(factory.connections) == 1
+    assert pool.stats()["idle"] == 1
+
+
+def test_connection_is_closed_and_dropped_when_rollback_fails():
+    factory = FakeConnectionFactory()
+    factory.fail_rollback = True
+    pool = MySQLConnectionPool(pool_size=1, connection_factory=factory)
+
+    with pool.connection() as connection:
+        pass
+
+    assert connection.closed
+    assert pool.stats()["opened"] == 0
+    assert pool.stats()["idle"] == 0
+
+    # The slot is free again, the next checkout opens a new connection.
+    factory.fail_rollback = False
+    with pool.connection() as new_connection:
+        assert new_connection is not connection
+    assert len(factory.connections) == 2
+
+
+def test_checkout_times_out_when_every_connection_is_in_use():
+    pool = MySQLConnectionPool(pool_size=1, connection_factory=FakeConnectionFactory())
+    connection = pool.checkout()
+
+    with pytest.raises(ConnectionPoolTimeout):
+        pool.checkout(timeout=0.05)
+    assert pool.stats()["timeouts"] == 1
+
+    pool.release(connection)
+    assert pool.checkout(timeout=0.05) is connection
+
+
+def test_released_connection_wakes_a_waiting_checkout():
+    pool = MySQLConnectionPool(pool_size=1, connection_factory=FakeConnectionFactory())
+    connection = pool.checkout()
+    checked_out = []
+
+    waiter = threading.Thread(target=lambda: checked_out.append(pool.checkout(timeout=5)))
+    waiter.start()
+    pool.release(connection)
+    waiter.join(5)
+
+    assert checked_out == [connection]
+
+
+def test_failed_connect_frees_its_slot():
+    def failing_factory():
+        raise Exception("Can't connect to MySQL server")
+
+    pool = MySQLConnectionPool(pool_size=1, connection_factory=failing_factory)
+    for _ in range(2):
+        with pytest.raises(Exception, match="Can't connect"):
+            pool.checkout(timeout=0.05)
+
+    assert pool.stats()["opened"] == 0
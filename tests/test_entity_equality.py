@@ -0,0 +1,68 @@
+from core.impl.classes.core_dto import EntityMentionDto, ParsedEntity, Sentence, TextSpan
+from core.impl.classes.loinc_classes import LoincCodeBean
+from core.impl.core_service_impl import CoreServiceImplementation
+
+
+def mention(id, entity_type, text="CT"):
+    return EntityMentionDto(id=id, text_set=[text], possible_entity_type_set=[entity_type])
+
+
+def test_remapped_mentions_sharing_an_id_are_kept():
+    # The remapping of an entity gives several mentions with its id, one per type.
+    mentions = {mention(7, "MODALITY"), mention(7, "VIEW"), mention(8, "MODALITY")}
+
+    assert len(mentions) == 3
+    assert mention(7, "VIEW") in mentions
+    assert mention(7, "PHARMACEUTICAL") not in mentions
+
+
+def test_mentions_of_the_same_id_and_type_are_deduplicated():
+    mentions = {mention(7, "MODALITY", "CT"), mention(7, "MODALITY", "ct scan")}
+
+    assert len(mentions) == 1
+    assert mention(7, "MODALITY") == mention(7, "MODALITY", "other text")
+    assert mention(7, "MODALITY") != mention(8, "MODALITY")
+    assert EntityMentionDto(id=7) == EntityMentionDto(id=7, possible_entity_type_set=[])
+
+
+def test_mentions_of_a_sentence_keep_the_remapped_copies():
+    parsed_entities = [
+        ParsedEntity(id=1, entity_type="MODALITY", begin=0, end=2),
+        ParsedEntity(id=1, entity_type="VIEW", begin=0, end=2),
+        ParsedEntity(id=1, entity_type="VIEW", begin=0, end=2),
+        ParsedEntity(id=2, entity_type="SYSTEM", begin=3, end=8),
+    ]
+
+    mentions = CoreServiceImplementation().get_entity_mention_of_sentence(
+        Sentence(begin=0, end=20), parsed_entities
+    )
+
+    assert sorted((it.id, it.possible_entity_type_set[0]) for it in mentions) == [
+        (1, "MODALITY"),
+        (1, "VIEW"),
+        (2, "SYSTEM"),
+    ]
+
+
+def bean(code, *begin_offsets):
+    return LoincCodeBean(
+        code=code,
+        textSpans={TextSpan(text=f"t{offset}", begin_offset=offset) for offset in begin_offsets},
+    )
+
+
+def test_beans_are_identified_by_their_text_spans():
+    assert bean("2345-7", 10, 40, 25) == bean("2345-7", 25, 10, 40)
+    assert hash(bean("2345-7", 10, 40, 25)) == hash(bean("2345-7", 40, 25, 10))
+    assert bean("2345-7", 10) != bean("2345-7", 10, 40)
+    # The code is not part of the identity, a span gives a single code.
+    assert bean("2345-7", 10) == bean("2951-2", 10)
+
+
+def test_beans_with_the_same_spans_are_deduplicated():
+    beans = {bean("2345-7", 10, 40), bean("2345-7", 40, 10), bean("2951-2", 60), bean("2345-7")}
+
+    assert len(beans) == 3
+    assert bean("2345-7", 10, 40) in beans
+    assert bean("2345-7", 10) not in beans
+    assert bean("2345-7") in beans
@@ -0,0 +1,48 @@
+import random
+
+from core.impl.classes.interval_index import IntervalIndex
+
+
+def random_intervals(rng: random.Random, count: int):
+    intervals = []
+    for item in range(count):
+        begin = rng.randint(0, 200)
+        intervals.append((begin, begin + rng.randint(0, 30), item))
+    return intervals
+
+
+def test_queries_match_a_linear_scan():
+    rng = random.Random(9)
+
+    for _ in range(300):
+        intervals = random_intervals(rng, rng.randint(0, 40))
+        index = IntervalIndex(intervals)
+        assert len(index) == len(intervals)
+
+        for _ in range(20):
+            begin = rng.randint(-10, 230)
+            end = begin + rng.randint(0, 60)
+
+            assert index.enclosed(begin, end) == [
+                item for b, e, item in intervals if begin <= b and e <= end
+            ]
+            assert index.enclosed(begin, end, strict_end=True) == [
+                item for b, e, item in intervals if begin <= b and e < end
+            ]
+            assert index.enclosing(begin, end) == [
+                item for b, e, item in intervals if b <= begin and end <= e
+            ]
+            assert index.enclosing(begin, end, strict_end=True) == [
+                item for b, e, item in intervals if b <= begin and end < e
+            ]
+            assert index.overlapping(begin, end) == [
+                item for b, e, item in intervals if b < end and begin < e
+            ]
+
+
+def test_items_are_returned_in_insertion_order():
+    index = IntervalIndex([(10, 20, "b"), (0, 30, "a"), (10, 15, "c")])
+
+    assert index.enclosed(0, 30) == ["b", "a", "c"]
+    assert index.enclosing(12, 14) == ["b", "a", "c"]
+    assert index.overlapping(16, 18) == ["b", "a"]
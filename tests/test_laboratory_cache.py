@@ -0,0 +1,101 @@
+from core.impl.classes.cache import LaboratoryLoincCodeCache, LaboratoryLoincCodeCacheDto
+from core.impl.classes.loinc_classes import LoincCodeBean
+
+
+def dto(name):
+    return LaboratoryLoincCodeCacheDto(component_set=frozenset([name]))
+
+
+def beans(code):
+    return [LoincCodeBean(code=code), LoincCodeBean(code=code + "-2")]
+
+
+class FakePersistentCache:
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+        self.puts = []
+
+    def get_laboratory(self, cache_dto, release):
+        return self.entries.get(cache_dto)
+
+    def put_laboratory(self, cache_dto, loinc_code_beans, release):
+        self.puts.append((cache_dto, [it.code for it in loinc_code_beans], release))
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LaboratoryLoincCodeCache(max_cache_limit=2)
+    cache.put(dto("a"), beans("a"))
+    cache.put(dto("b"), beans("b"))
+    assert cache.get(dto("a")) is not None
+
+    cache.put(dto("c"), beans("c"))
+
+    assert cache.get(dto("b")) is None
+    assert [it.code for it in cache.get(dto("a"))] == ["a"]
+    assert [it.code for it in cache.get(dto("c"))] == ["c"]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_only_the_best_ranked_bean_is_kept():
+    cache = LaboratoryLoincCodeCache()
+    cache.put(dto("a"), beans("a"))
+
+    assert [it.code for it in cache.get(dto("a"))] == ["a"]
+
+
+def test_no_entry_is_kept_without_capacity():
+    cache = LaboratoryLoincCodeCache(max_cache_limit=0)
+    cache.put(dto("a"), beans("a"))
+
+    assert cache.get(dto("a")) is None
+
+
+def test_puts_of_an_older_version_are_dropped_after_clear():
+    persistent_cache = FakePersistentCache()
+    cache = LaboratoryLoincCodeCache(persistent_cache=persistent_cache)
+    cache.put(dto("a"), beans("a"), version=1, release="r1")
+
+    cache.clear(version=2)
+    assert cache.get(dto("a")) is None
+
+    cache.put(dto("b"), beans("b"), version=1, release="r1")
+    cache.put(dto("c"), beans("c"), version=2, release="r2")
+
+    assert cache.get(dto("b")) is None
+    assert cache.get(dto("c")) is not None
+    assert cache.stats()["stalePuts"] == 1
+    assert [it[0] for it in persistent_cache.puts] == [dto("a"), dto("c")]
+
+
+def test_clear_never_goes_back_to_an_older_version():
+    cache = LaboratoryLoincCodeCache()
+    cache.clear(version=3)
+    cache.clear(version=2)
+    cache.clear()
+
+    assert cache.version == 3
+
+
+def test_persistent_hit_of_an_older_version_is_not_kept_in_memory():
+    persistent_cache = FakePersistentCache({dto("a"): beans("a")[:1]})
+    cache = LaboratoryLoincCodeCache(persistent_cache=persistent_cache)
+    cache.clear(version=2)
+
+    # A request still on version 1 gets the row but does not cache it.
+    assert [it.code for it in cache.get(dto("a"), version=1, release="r1")] == ["a"]
+    assert cache.stats()["size"] == 0
+
+    assert cache.get(dto("a"), version=2, release="r2") is not None
+    assert cache.stats()["size"] == 1
+    assert cache.stats()["persistentHits"] == 2
+
+
+def test_primed_entries_are_not_written_to_the_persistent_cache():
+    persistent_cache = FakePersistentCache()
+    cache = LaboratoryLoincCodeCache(max_cache_limit=5, persistent_cache=persistent_cache)
+    cache.prime({dto("a"): beans("a"), dto("b"): []})
+
+    assert [it.code for it in cache.get(dto("a"))] == ["a"]
+    assert cache.get(dto("b")) == []
+    assert persistent_cache.puts == []
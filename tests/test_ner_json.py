@@ -0,0 +1,125 @@
+import json
+import os
+import random
+
+from ner_json import (
+    CONTEXT_TOKEN_TYPES,
+    RESULT_KEYS,
+    loads_ner_output,
+    loads_top_level_keys,
+)
+
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "misc", "IHH_4_2456.json"
+)
+
+# Strings the scanner has to skip without being confused by them.
+TRICKY_STRINGS = ['a "quoted" ]}', "back\\slash\\", "[{", "unié中", "", "\n\t"]
+
+
+def expected_result(result):
+    """
+    What loads_ner_output keeps of a fully parsed "result".
+    """
+
+    expected = {key: value for key, value in result.items() if key in RESULT_KEYS}
+    if "contextTokens" in expected:
+        expected["contextTokens"] = [
+            it for it in expected["contextTokens"] if it.get("type") in CONTEXT_TOKEN_TYPES
+        ]
+    if "tokens" in expected:
+        referenced_ids = set()
+        for entity in result.get("entities", []):
+            for ids in entity["metadata"]["labData"].values():
+                referenced_ids.update(str(it) for it in ids)
+        for relation in result.get("relations", []):
+            referenced_ids.add(str(relation["tail"]["id"]))
+        expected["tokens"] = [
+            it for it in expected["tokens"] if str(it.get("id")) in referenced_ids
+        ]
+    return expected
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randint(0, 6 if depth < 3 else 3)
+    if kind == 0:
+        return rng.choice(TRICKY_STRINGS)
+    if kind == 1:
+        return rng.randint(-1000, 1000)
+    if kind == 2:
+        return rng.choice([True, False, None, 1.5e-3])
+    if kind == 3:
+        return "".join(rng.choice("ab ]}[{\"\\") for _ in range(rng.randint(0, 8)))
+    if kind in (4, 5):
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    return {
+        rng.choice(TRICKY_STRINGS) + str(i): random_value(rng, depth + 1)
+        for i in range(rng.randint(0, 4))
+    }
+
+
+def random_ner_output(rng: random.Random):
+    token_ids = list(range(30))
+    entities = [
+        {
+            "id": i,
+            "type": "Laboratory_Data",
+            "metadata": {"labData": {"unit": rng.sample(token_ids, 2), "value": []}},
+            "extra": random_value(rng),
+        }
+        for i in range(rng.randint(0, 5))
+    ]
+    result = {
+        "content": rng.choice(TRICKY_STRINGS),
+        "entities": entities,
+        "relations": [
+            {"head": {"id": 0}, "tail": {"id": rng.choice(token_ids)}}
+            for _ in range(rng.randint(0, 5))
+        ],
+        "sentences": [random_value(rng) for _ in range(3)],
+        "contextTokens": [
+            {"type": rng.choice(["UnitToken", "ViewToken", "OtherToken"]), "v": random_value(rng)}
+            for _ in range(rng.randint(0, 6))
+        ],
+        "tokens": [{"id": i, "text": rng.choice(TRICKY_STRINGS)} for i in token_ids],
+        "sections": random_value(rng),
+        "icd10cmcodes": [random_value(rng) for _ in range(3)],
+    }
+    keys = list(result)
+    rng.shuffle(keys)
+    return {"status": "ok", "result": {key: result[key] for key in keys}, "id": 7}
+
+
+def test_kept_keys_match_json_loads():
+    rng = random.Random(17)
+
+    for _ in range(300):
+        document = random_ner_output(rng)
+        text = json.dumps(document, indent=rng.choice([None, 1]), ensure_ascii=rng.random() < 0.5)
+
+        output = loads_ner_output(text)
+
+        assert output["status"] == "ok" and output["id"] == 7
+        assert output["result"] == expected_result(json.loads(text)["result"])
+        assert loads_ner_output(text.encode("utf-8")) == output
+
+
+def test_sample_ner_output():
+    with open(SAMPLE_PATH, "rb") as f:
+        data = f.read()
+
+    assert loads_ner_output(data)["result"] == expected_result(json.loads(data)["result"])
+
+
+def test_document_without_result_is_parsed_completely():
+    text = json.dumps({"content": "x", "entities": [{"id": 1}]})
+
+    assert loads_ner_output(text) == json.loads(text)
+    assert loads_ner_output("[1, 2]") == [1, 2]
+
+
+def test_top_level_keys():
+    text = json.dumps({"result": random_value(random.Random(1)), "id": "a]", "request_id": 3})
+
+    assert loads_top_level_keys(text, ("id", "request_id")) == {"id": "a]", "request_id": 3}
+    assert loads_top_level_keys("[]", ("id",)) == {}
@@ -0,0 +1,54 @@
+import copy
+import json
+import os
+
+import pytest
+
+from ner_preprocessing import REQUIRED_RESULT_KEYS, get_ner_result_from_body
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "misc", "IHH_4_2456.json")
+
+
+def load_sample():
+    with open(SAMPLE_PATH, encoding="utf8") as f:
+        return json.load(f)
+
+
+def test_sample_body_is_accepted():
+    body = load_sample()
+    text_dict, ner_version = get_ner_result_from_body(body)
+
+    assert text_dict["result"] is body["result"]
+    assert ner_version == 2
+
+
+def test_result_object_with_skip_remap_is_accepted():
+    body = dict(load_sample()["result"], skipRemap=True)
+    text_dict, ner_version = get_ner_result_from_body(body)
+
+    assert text_dict["result"] is body
+    assert ner_version == 1
+
+
+@pytest.mark.parametrize("missing_key", REQUIRED_RESULT_KEYS)
+def test_missing_key_is_reported(missing_key):
+    body = copy.deepcopy(load_sample())
+    del body["result"][missing_key]
+
+    with pytest.raises(ValueError, match=missing_key):
+        get_ner_result_from_body(body)
+
+
+def test_body_without_tokens_is_rejected():
+    # AttributeLoader reads "tokens" for the lab data of the relations.
+    body = load_sample()
+    del body["result"]["tokens"]
+
+    with pytest.raises(ValueError, match="tokens"):
+        get_ner_result_from_body(body)
+
+
+@pytest.mark.parametrize("body", [[], "text", 5, None, {"result": []}])
+def test_body_without_result_object_is_rejected(body):
+    with pytest.raises(ValueError):
+        get_ner_result_from_body(body)
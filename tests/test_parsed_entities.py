@@ -0,0 +1,139 @@
+import json
+import os
+import random
+
+from core.impl.classes.core_dto import Sentence
+from core.impl.core_service_impl import CoreServiceImplementation
+
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "misc", "IHH_4_2456.json"
+)
+
+
+def old_parse_ids(entity, key, prefix):
+    # Parsing of the CUI/TUI/SUI strings before get_parsed_entities.
+    ids = []
+    for it in entity["metadata"]["normalization"]:
+        for value in it[key]:
+            ids += [int(c.strip().split(prefix)[1]) for c in value.split(",")]
+    return ids
+
+
+def old_entity_mentions_of_sentence(sentence, entities):
+    # get_entity_mention_of_sentence before the parsed entities and the interval index.
+    mentions = []
+    for entity in entities:
+        ent_begin = [int(it["begin"]) for it in entity["textSpan"]][0]
+        ent_end = [int(it["end"]) for it in entity["textSpan"]][-1]
+        if sentence.begin <= ent_begin and ent_end < sentence.end:
+            mentions.append(
+                (
+                    int(entity["id"]),
+                    [int(it["begin"]) for it in entity["textSpan"]],
+                    [int(it["end"]) for it in entity["textSpan"]],
+                    [it["text"] for it in entity["textSpan"]],
+                    old_parse_ids(entity, "cuis", "C"),
+                    old_parse_ids(entity, "tuis", "T"),
+                    old_parse_ids(entity, "suis", "S"),
+                    [entity["type"]],
+                )
+            )
+    return sorted(mentions)
+
+
+def random_entity(rng: random.Random, entity_id: int):
+    spans = []
+    begin = rng.randint(0, 300)
+    for _ in range(rng.randint(1, 3)):
+        end = begin + rng.randint(1, 10)
+        spans.append({"begin": begin, "end": end, "text": "x" * (end - begin)})
+        begin = end + rng.randint(0, 5)
+
+    def ids(prefix):
+        return [
+            ", ".join(f"{prefix}{rng.randint(1, 9999999):07d}" for _ in range(rng.randint(1, 3)))
+            for _ in range(rng.randint(0, 2))
+        ]
+
+    return {
+        "id": entity_id,
+        "type": rng.choice(["PROBLEM", "TEST", "Laboratory_Data"]),
+        "textSpan": spans,
+        "metadata": {
+            "normalization": [
+                {"cuis": ids("C"), "tuis": ids("T"), "suis": ids("S")}
+                for _ in range(rng.randint(0, 2))
+            ]
+        },
+    }
+
+
+def check_document(document):
+    service = CoreServiceImplementation()
+    parsed_entities = service.get_parsed_entities(document)
+
+    assert len(parsed_entities) == len(document["entities"])
+    for parsed_entity, entity in zip(parsed_entities, document["entities"]):
+        assert parsed_entity.entity is entity
+        assert parsed_entity.id == int(entity["id"])
+        assert parsed_entity.entity_type == entity["type"]
+        assert list(parsed_entity.begins) == [int(it["begin"]) for it in entity["textSpan"]]
+        assert list(parsed_entity.ends) == [int(it["end"]) for it in entity["textSpan"]]
+        assert parsed_entity.begin == parsed_entity.begins[0]
+        assert parsed_entity.end == parsed_entity.ends[-1]
+        assert list(parsed_entity.texts) == [it["text"] for it in entity["textSpan"]]
+        assert list(parsed_entity.cuis) == old_parse_ids(entity, "cuis", "C")
+        assert list(parsed_entity.tuis) == old_parse_ids(entity, "tuis", "T")
+        assert list(parsed_entity.suis) == old_parse_ids(entity, "suis", "S")
+
+    sentence_mentions = service.get_entity_mention_data(document, parsed_entities)
+    assert len(sentence_mentions) == len({(it["begin"], it["end"]) for it in document["sentences"]})
+    for sentence, mentions in sentence_mentions.items():
+        assert sorted(
+            (
+                it.id,
+                list(it.begin_set),
+                list(it.end_set),
+                list(it.text_set),
+                list(it.cui_set),
+                list(it.tui_set),
+                list(it.sui_set),
+                list(it.possible_entity_type_set),
+            )
+            for it in mentions
+        ) == old_entity_mentions_of_sentence(sentence, document["entities"])
+
+
+def test_random_documents_parse_like_before():
+    rng = random.Random(19)
+
+    for _ in range(200):
+        entities = [random_entity(rng, i) for i in range(rng.randint(0, 25))]
+        sentences = []
+        begin = 0
+        for i in range(rng.randint(1, 8)):
+            end = begin + rng.randint(1, 80)
+            sentences.append({"id": i, "begin": begin, "end": end})
+            begin = end
+        check_document(
+            {"content": "y" * begin, "entities": entities, "sentences": sentences}
+        )
+
+
+def test_sample_document_parses_like_before():
+    with open(SAMPLE_PATH, encoding="utf8") as f:
+        check_document(json.load(f)["result"])
+
+
+def test_sentence_of_an_entity_ending_on_its_end_is_excluded():
+    document = {
+        "content": "x" * 20,
+        "entities": [random_entity(random.Random(1), 1)],
+        "sentences": [],
+    }
+    parsed_entity = CoreServiceImplementation().get_parsed_entities(document)[0]
+    sentence = Sentence(begin=parsed_entity.begin, end=parsed_entity.end, sentence_num=0)
+
+    assert CoreServiceImplementation().get_entity_mention_of_sentence(
+        sentence, [parsed_entity]
+    ) == set()
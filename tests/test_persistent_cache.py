@@ -0,0 +1,88 @@
+from core.impl.classes.cache import LaboratoryLoincCodeCacheDto
+from core.impl.classes.loinc_classes import LoincCodeBean
+from core.impl.classes.persistent_cache import LABORATORY, PersistentResolutionCache
+
+CACHE_DTO = LaboratoryLoincCodeCacheDto(
+    component_set=frozenset(["glucose"]), property=frozenset(["mcnc"]), time="pt"
+)
+
+
+def open_cache(tmp_path, release="r1"):
+    cache = PersistentResolutionCache(str(tmp_path / "cache" / "resolutions.sqlite"))
+    cache.set_release(release)
+    return cache
+
+
+def test_entries_are_kept_across_restarts(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_laboratory(CACHE_DTO, [LoincCodeBean(code="2345-7", component="Glucose")], "r1")
+    cache.close()
+
+    cache = open_cache(tmp_path)
+    loinc_code_beans = cache.get_laboratory(CACHE_DTO, "r1")
+    assert [(it.code, it.component) for it in loinc_code_beans] == [("2345-7", "Glucose")]
+    assert cache.stats()["entries"] == {LABORATORY: 1}
+    cache.close()
+
+
+def test_set_release_drops_the_entries_of_other_releases(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_radiology_map_ids([1, 2], ["m1"], "r1")
+    cache.put_loinc_code(LoincCodeBean(code="24627-2"), "r1")
+
+    cache.set_release("r2")
+
+    assert cache.get_radiology_map_ids([1, 2], "r2") is None
+    assert cache.stats()["entries"] == {}
+    cache.put_radiology_map_ids([1, 2], ["m2"], "r2")
+    assert cache.get_radiology_map_ids([1, 2], "r2") == ["m2"]
+    cache.close()
+
+    # The entries of r1 are gone from the file too.
+    cache = open_cache(tmp_path, release="r1")
+    assert cache.get_radiology_map_ids([1, 2], "r1") is None
+    assert cache.stats()["entries"] == {}
+    cache.close()
+
+
+def test_put_ignores_a_mismatched_release(tmp_path):
+    cache = open_cache(tmp_path)
+
+    # A request still running on the previous release.
+    cache.put_radiology_map_ids([1, 2], ["m1"], "r0")
+    cache.put_radiology_map_ids([3], ["m3"], None)
+
+    assert cache.get_radiology_map_ids([1, 2], "r1") is None
+    assert cache.get_radiology_map_ids([1, 2], "r0") is None
+    stats = cache.stats()
+    assert stats["writes"] == 0
+    assert stats["staleWrites"] == 2
+    assert stats["entries"] == {}
+    cache.close()
+
+
+def test_unknown_release_disables_the_cache(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_radiology_map_ids([1, 2], ["m1"], "r1")
+
+    cache.set_release(None)
+    assert cache.get_radiology_map_ids([1, 2], "r1") is None
+    cache.put_radiology_map_ids([3], ["m3"], "r1")
+
+    # The entries are kept until a release is set again.
+    cache.set_release("r1")
+    assert cache.get_radiology_map_ids([1, 2], "r1") == ["m1"]
+    assert cache.get_radiology_map_ids([3], "r1") is None
+    cache.close()
+
+
+def test_entry_counts_follow_inserts_and_replacements(tmp_path):
+    cache = open_cache(tmp_path)
+    cache.put_radiology_map_ids([1, 2], ["m1"], "r1")
+    cache.put_radiology_map_ids([1, 2], ["m1", "m2"], "r1")
+    cache.put_radiology_map_ids([2, 1], ["m3"], "r1")
+
+    assert cache.get_radiology_map_ids([1, 2], "r1") == ["m1", "m2"]
+    assert cache.stats()["entries"] == {"radiology_cui": 2}
+    assert cache.stats()["writes"] == 3
+    cache.close()
@@ -0,0 +1,64 @@
+import copy
+import random
+from typing import List
+
+from core.impl.classes.radiology_index import RadiologyCuiMappingIndex
+from core.impl.radiology_loinc_code_algorithm import RadiologyLoincCodeAlgorithm
+
+
+class UnusedConnection:
+    def cursor(self, **kwargs):
+        return None
+
+
+def old_generate_values(outer_list: List[List[int]], output: str, combinations: List[str]):
+    # RadiologyLoincCodeAlgorithm.generateValues before the lazy combinations.
+    lst = next(iter(outer_list))
+    for s in lst:
+        new_outer = copy.deepcopy(outer_list)
+        if lst in outer_list:
+            new_outer.remove(lst)
+        if len(outer_list) > 1:
+            old_generate_values(new_outer, (output + " " + str(s)).strip(), combinations)
+        else:
+            combinations.append((output + " " + str(s)).strip())
+
+
+def test_combinations_keep_the_former_order():
+    rng = random.Random(20)
+    algorithm = RadiologyLoincCodeAlgorithm(connection=UnusedConnection())
+
+    for _ in range(500):
+        cui_lists = [
+            [rng.randint(1, 50) for _ in range(rng.randint(1, 5))]
+            for _ in range(rng.randint(1, 3))
+        ]
+        old_combinations = []
+        old_generate_values(cui_lists, "", old_combinations)
+
+        assert [tuple(it) for it in algorithm.get_combination(cui_lists)] == [
+            tuple(int(cui) for cui in it.split(" ")) for it in old_combinations
+        ]
+
+
+def test_combinations_are_consumed_up_to_the_first_match():
+    index = RadiologyCuiMappingIndex()
+    index.add_row("map-1", [3, 20, None])
+    algorithm = RadiologyLoincCodeAlgorithm(
+        connection=UnusedConnection(), radiology_cui_mapping_index=index
+    )
+
+    consumed = []
+
+    def recorded(combinations):
+        for it in combinations:
+            consumed.append(it)
+            yield it
+
+    map_ids = algorithm.get_map_id_of_first_matching_combination(
+        recorded(algorithm.get_combination([[1, 2, 3, 4], [10, 20, 30]]))
+    )
+
+    assert map_ids == ["map-1"]
+    assert consumed[-1] == (3, 20)
+    assert len(consumed) == 8
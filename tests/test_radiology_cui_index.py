@@ -0,0 +1,88 @@
+import random
+from itertools import product
+
+from core.impl.classes.radiology_index import RadiologyCuiMappingIndex
+
+CUI_COLUMNS = 6
+
+# Rows of radiology_cui_mapping, (map_id, [cui1, cui2, ...]).
+CUI_MAPPING_ROWS = [
+    ("m1", [1, 2]),
+    ("m2", [2, 1]),
+    ("m3", [1]),
+    ("m4", [1, None, 3]),
+    ("m5", [1, 1]),
+    ("m6", [""]),
+    ("m7", [1, "x"]),
+    ("m8", [None, 1]),
+    ("m9", ["7"]),
+    ("m10", [3, 4, 5]),
+    ("m11", [2]),
+    ("m12", [" 2 ", 7]),
+    ("m13", [1, 2]),
+    ("m14", [5, ""]),
+]
+
+
+def sql_value(value):
+    # MySQL compares a string to the integers of "in (...)" as a number, 0 when it is
+    # not one, and no CUI is 0.
+    if isinstance(value, str):
+        digits = value.strip()
+        return int(digits) if digits.isdigit() else 0
+    return value
+
+
+def sql_map_ids(rows, cui_list):
+    # RadiologyLoincCodeAlgorithm.get_map_id_from_radiology_cui_mapping:
+    # "cui1 in (...) and ... cuiN in (...) and cuiN+1 is null", in table order.
+    length = len(cui_list)
+    values = {int(cui) for cui in cui_list}
+    map_ids = []
+    for map_id, cuis in rows:
+        cuis = list(cuis) + [None] * (CUI_COLUMNS - len(cuis))
+        if all(
+            cuis[column] is not None and sql_value(cuis[column]) in values
+            for column in range(length)
+        ) and cuis[length] is None:
+            map_ids.append(map_id)
+    return map_ids
+
+
+def build_cui_index(rows):
+    index = RadiologyCuiMappingIndex()
+    for map_id, cuis in rows:
+        index.add_row(map_id, list(cuis) + [None] * (CUI_COLUMNS - len(cuis)))
+    return index
+
+
+def test_cui_index_matches_the_query_on_hand_built_rows():
+    index = build_cui_index(CUI_MAPPING_ROWS)
+
+    for length in range(1, 4):
+        for cui_list in product([1, 2, 3, 4, 5, 7, 8], repeat=length):
+            assert index.get_map_ids(cui_list) == sql_map_ids(CUI_MAPPING_ROWS, cui_list), cui_list
+
+
+def test_cui_index_matches_the_query_on_random_rows():
+    rng = random.Random(5)
+
+    for _ in range(100):
+        rows = []
+        for row_num in range(rng.randint(0, 60)):
+            cuis = [rng.randint(1, 6) for _ in range(rng.randint(1, 4))]
+            if rng.random() < 0.1:
+                cuis.insert(rng.randint(0, len(cuis)), None)
+            rows.append((f"m{row_num}", cuis))
+        index = build_cui_index(rows)
+
+        for _ in range(30):
+            cui_list = [rng.randint(1, 6) for _ in range(rng.randint(1, 4))]
+            assert index.get_map_ids(cui_list) == sql_map_ids(rows, cui_list)
+
+
+def test_find_map_ids_stops_at_the_first_matching_combination():
+    index = build_cui_index(CUI_MAPPING_ROWS)
+
+    assert index.find_map_ids([[9], [3, 4, 5], [1]]) == ([3, 4, 5], ["m10"])
+    assert index.find_map_ids([[9], [8, 9]]) == (None, [])
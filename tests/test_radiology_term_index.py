@@ -0,0 +1,98 @@
+import random
+from itertools import product
+
+import numpy as np
+
+from core.impl.classes.radiology_classes import RadiologyTermMappingTableDto
+from core.impl.classes.radiology_index import RadiologyTermMappingIndex
+
+
+def term_row(map_id, *terms):
+    terms = list(terms) + [None] * (7 - len(terms))
+    return RadiologyTermMappingTableDto(map_id, *terms, code=f"{map_id}-code")
+
+
+# Rows of radiology_term_mapping.
+TERM_MAPPING_ROWS = [
+    term_row("m1", "CT", "Chest"),
+    term_row("m2", "MRI", "Head", "W contrast"),
+    term_row("m1", "ct", "chest", "WO contrast"),
+    term_row("m3"),
+    term_row("m2", "Head", "Head"),
+    term_row("m4", None, "XR", None, "Knee"),
+    term_row("m1", "Chest", "CT", "Abdomen", "Pelvis", "W contrast", "WO contrast", "Views"),
+]
+
+
+def linear_term_mapping(rows, map_ids, components):
+    # get_all_term_mapping_from_cui_mapping and get_total_number_of_matched_term.
+    matches = [row for row in rows if row.map_id in set(map_ids)]
+    counts = [
+        sum(
+            1
+            for term in (row.term1, row.term2, row.term3, row.term4, row.term5, row.term6, row.term7)
+            if term is not None and term.lower() in components
+        )
+        for row in matches
+    ]
+    return matches, counts
+
+
+def get_indexed_term_mapping(index, map_ids, components):
+    row_nums = index.get_row_nums(map_ids)
+    return (
+        [index.rows[row_num] for row_num in row_nums],
+        index.get_match_counts(row_nums, components).tolist(),
+    )
+
+
+def test_term_index_matches_the_linear_count_on_hand_built_rows():
+    index = RadiologyTermMappingIndex()
+    index.build(TERM_MAPPING_ROWS)
+
+    map_id_lists = [["m1"], ["m2", "m1"], ["m3"], ["m4", "m9"], ["m9"], [], ["m1", "m1"]]
+    component_sets = [
+        set(),
+        {"ct"},
+        {"ct", "chest"},
+        {"head", "w contrast"},
+        {"xr", "knee", "views"},
+        {"unknown"},
+    ]
+    for map_ids, components in product(map_id_lists, component_sets):
+        assert get_indexed_term_mapping(index, map_ids, components) == linear_term_mapping(
+            TERM_MAPPING_ROWS, map_ids, components
+        ), (map_ids, components)
+
+
+def test_term_index_matches_the_linear_count_on_random_rows():
+    rng = random.Random(6)
+    vocabulary = ["CT", "ct", "MRI", "Chest", "head", "Head", "Knee", "W contrast", None]
+
+    for _ in range(100):
+        rows = [
+            term_row(
+                f"m{rng.randint(0, 8)}",
+                *[rng.choice(vocabulary) for _ in range(rng.randint(0, 7))],
+            )
+            for _ in range(rng.randint(0, 40))
+        ]
+        index = RadiologyTermMappingIndex()
+        index.build(rows)
+
+        for _ in range(20):
+            map_ids = [f"m{rng.randint(0, 9)}" for _ in range(rng.randint(0, 4))]
+            components = {
+                term.lower() for term in rng.sample(vocabulary[:-1], rng.randint(0, 4))
+            }
+            assert get_indexed_term_mapping(index, map_ids, components) == linear_term_mapping(
+                rows, map_ids, components
+            )
+
+
+def test_term_index_of_no_rows():
+    index = RadiologyTermMappingIndex()
+    index.build([])
+
+    assert len(index.get_row_nums(["m1"])) == 0
+    assert index.get_match_counts(np.empty(0, dtype=np.int64), {"ct"}).tolist() == []
@@ -0,0 +1,34 @@
+import random
+
+from core.impl.classes.token_boundaries import TokenBoundaries
+
+
+def count_tokens(text: str, offset: int, begin: int, end: int) -> int:
+    # Count used by get_all_anatomical_structure_with_distance before TokenBoundaries.
+    return len(text[begin - offset : end - offset].strip().split(" "))
+
+
+def test_token_distance_matches_slice_and_split():
+    rng = random.Random(21)
+    alphabet = ["a", "b", " ", " ", "  ", "\t", "\n", ".", ","]
+
+    for _ in range(2000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        offset = rng.randint(0, 100)
+        token_boundaries = TokenBoundaries(text, offset)
+
+        for _ in range(20):
+            begin = rng.randint(offset - 5, offset + len(text) + 5)
+            end = rng.randint(offset - 5, offset + len(text) + 5)
+            assert token_boundaries.token_distance(begin, end) == count_tokens(
+                text, offset, max(begin, offset), max(end, offset)
+            ), (text, offset, begin, end)
+
+
+def test_token_distance_of_words():
+    token_boundaries = TokenBoundaries("CT of the chest", offset=10)
+
+    assert token_boundaries.token_distance(12, 20) == 2
+    assert token_boundaries.token_distance(10, 25) == 4
+    assert token_boundaries.token_distance(12, 13) == 1
+    assert token_boundaries.token_distance(20, 12) == 1